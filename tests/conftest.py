@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, Vinman, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.cub@gmail.com>
+
+import re
+import time
+import logging
+import threading
+import pytest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _FileHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.owner.connect()
+
+    def do_HEAD(self):
+        self._handle(head=True)
+
+    def do_GET(self):
+        self._handle(head=False)
+
+    def _handle(self, head):
+        server = self.server.owner
+        path = self.path.split('?', 1)[0]
+        headers = dict((key.lower(), value) for key, value in self.headers.items())
+        server.begin(self.command, path, headers)
+        try:
+            item = server.files.get(path)
+            if item is None:
+                return self._send(404, {}, b'')
+            if item.get('delay'):
+                time.sleep(item['delay'])
+            if item.get('status'):
+                return self._send(item['status'], {}, b'')
+            body = item['body']
+            validators = {}
+            if item.get('etag'):
+                validators['ETag'] = item['etag']
+            if item.get('last_modified'):
+                validators['Last-Modified'] = item['last_modified']
+            validator = item.get('etag') or item.get('last_modified')
+            if validator and validator in (headers.get('if-none-match'), headers.get('if-modified-since')):
+                return self._send(304, validators, b'')
+            extra = dict(validators)
+            if item.get('ranges', True):
+                extra['Accept-Ranges'] = 'bytes'
+            match = re.match(r'bytes=(\d+)-(\d*)$', headers.get('range', ''))
+            if_range = headers.get('if-range')
+            if match and item.get('ranges', True) and (if_range is None or if_range == validator):
+                start = int(match.group(1))
+                end = int(match.group(2)) if match.group(2) else len(body) - 1
+                if start >= len(body):
+                    extra['Content-Range'] = 'bytes */{}'.format(len(body))
+                    return self._send(416, extra, b'')
+                end = min(end, len(body) - 1)
+                extra['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, len(body))
+                return self._send(206, extra, body[start:end + 1], head, item)
+            return self._send(200, extra, body, head, item)
+        finally:
+            server.end(path)
+
+    def _send(self, status, headers, body, head=False, item=None):
+        item = item or {}
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if item.get('chunked'):
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if head or status in (304, 416):
+            return
+        if item.get('chunked'):
+            for start in range(0, len(body), 4096):
+                chunk = body[start:start + 4096]
+                self.wfile.write('{:x}\r\n'.format(len(chunk)).encode('ascii') + chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        cut = item.get('cut_after')
+        if cut is not None and cut < len(body):
+            # 发送部分内容后断开连接，模拟下载中断
+            item.pop('cut_after')
+            self.wfile.write(body[:cut])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        self.wfile.write(body)
+
+
+class FileServer(object):
+    def __init__(self):
+        """
+        测试用的本地HTTP/1.1文件服务，支持Range/If-Range和ETag/Last-Modified条件请求，记录收到的请求和并发数
+
+        files: {路径: {'body': 内容, 'etag', 'last_modified', 'ranges': 是否支持Range(默认True),
+                       'delay': 响应前等待(秒), 'status': 固定返回的状态码, 'chunked': 不带Content-Length,
+                       'cut_after': 只发送该字节数后断开(仅一次)}}
+        """
+        self.files = {}
+        self.requests = []
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        self.httpd = _ThreadingHTTPServer(('127.0.0.1', 0), _FileHandler)
+        self.httpd.owner = self
+        self.base_url = 'http://{}:{}'.format(*self.httpd.server_address[:2])
+        t = threading.Thread(target=self.httpd.serve_forever, kwargs={'poll_interval': 0.05})
+        t.daemon = True
+        t.start()
+
+    def add(self, path, body, **kwargs):
+        item = dict(kwargs, body=body)
+        self.files[path] = item
+        return self.base_url + path
+
+    def connect(self):
+        with self._lock:
+            self.connections += 1
+
+    def begin(self, method, path, headers):
+        with self._lock:
+            self.requests.append((method, path, headers))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+    def end(self, path):
+        with self._lock:
+            self.active -= 1
+
+    def requests_for(self, path, method='GET'):
+        with self._lock:
+            return [headers for m, p, headers in self.requests if p == path and m == method]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def logger():
+    logger = logging.getLogger('vm_components.tests')
+    logger.setLevel(logging.CRITICAL)
+    return logger
+
+
+@pytest.fixture
+def http_server():
+    server = FileServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def make_http_server():
+    servers = []
+
+    def _make():
+        servers.append(FileServer())
+        return servers[-1]
+    yield _make
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def ssh_server():
+    """
+    进程内的SSH/SFTP服务(transport.benchmark.BenchmarkServer)，命令在本机执行，home为临时目录
+    """
+    pytest.importorskip('paramiko')
+    from vm_components.common.transport.benchmark import BenchmarkServer
+    server = BenchmarkServer()
+    yield server
+    server.close()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, Vinman, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.cub@gmail.com>
+
+import os
+import asyncio
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from vm_components.common.request import AsyncRequest
+
+
+def test_get_json_info_shares_connections(http_server, logger):
+    url = http_server.add('/updates.json', b'{"version": "1.0.0"}')
+
+    async def _main():
+        async with AsyncRequest(logger=logger, limit_per_host=2) as req:
+            return await asyncio.gather(*[req.get_json_info(url) for _ in range(10)])
+
+    assert asyncio.run(_main()) == [(0, {'version': '1.0.0'})] * 10
+    assert http_server.connections <= 2
+
+
+def test_download_with_content_length(http_server, logger, tmp_path):
+    body = os.urandom(300000)
+    url = http_server.add('/firmware.bin', body)
+
+    async def _main():
+        async with AsyncRequest(logger=logger) as req:
+            return await req.download(url, str(tmp_path), chunk_size=4096, write_size=65536)
+
+    status, path = asyncio.run(_main())
+    assert status is True
+    with open(path, 'rb') as f:
+        assert f.read() == body
+
+
+def test_download_chunked_without_content_length(http_server, logger, tmp_path):
+    body = os.urandom(50000)
+    url = http_server.add('/firmware.bin', body, chunked=True)
+
+    async def _main():
+        async with AsyncRequest(logger=logger) as req:
+            return await req.download(url, str(tmp_path))
+
+    status, path = asyncio.run(_main())
+    assert status is True
+    with open(path, 'rb') as f:
+        assert f.read() == body
+
+
+def test_reuse_across_event_loops(http_server, logger):
+    url = http_server.add('/updates.json', b'{"version": "1.0.0"}')
+    req = AsyncRequest(logger=logger, concurrency=2)
+
+    async def _main():
+        return await asyncio.gather(*[req.get_json_info(url) for _ in range(4)])
+
+    # 第一次没有关闭，之后在新的事件循环中重新创建会话和信号量
+    assert asyncio.run(_main()) == [(0, {'version': '1.0.0'})] * 4
+    assert asyncio.run(_main()) == [(0, {'version': '1.0.0'})] * 4
+
+    async def _close():
+        await _main()
+        await req.close()
+    asyncio.run(_close())
+    assert req._session is None and req._semaphore is None
+    assert asyncio.run(_main()) == [(0, {'version': '1.0.0'})] * 4
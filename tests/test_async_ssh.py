@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import time
+import asyncio
+import paramiko
+from vm_components.common.transport import AsyncSSHTransport
+
+
+def test_exec_command_and_stream(ssh_server, logger):
+    async def _main():
+        async with AsyncSSHTransport(ssh_server.config, logger=logger) as transport:
+            assert transport.transport.metadata is None
+            results = await transport.exec_command(['echo a', 'echo b >&2'])
+            items = [item async for item in transport.exec_command_stream("printf 'x\\ny'; exit 4")]
+            return results, items
+
+    results, items = asyncio.run(_main())
+    assert results == [{'stdout': ['a'], 'stderr': []}, {'stdout': [], 'stderr': ['b']}]
+    assert items == [('stdout', 'x'), ('stdout', 'y'), ('exit', 4)]
+
+
+def test_exec_command_does_not_retry_timeout(ssh_server, logger):
+    async def _main():
+        async with AsyncSSHTransport(ssh_server.config, logger=logger) as transport:
+            return await transport.exec_command('sleep 2', timeout=0.3)
+
+    start = time.time()
+    assert asyncio.run(_main()) == []
+    assert time.time() - start < 1.5
+    assert ssh_server.stats()['exec'] == 1
+
+
+def test_exec_command_retries_channel_open_failure(ssh_server, logger, monkeypatch):
+    exec_command = paramiko.Channel.exec_command
+    failures = []
+
+    def _exec_command(channel, command):
+        if not failures:
+            failures.append(command)
+            raise paramiko.SSHException('channel request failed')
+        return exec_command(channel, command)
+    monkeypatch.setattr(paramiko.Channel, 'exec_command', _exec_command)
+
+    async def _main():
+        async with AsyncSSHTransport(ssh_server.config, logger=logger) as transport:
+            return await transport.exec_command('echo ok')
+
+    assert asyncio.run(_main()) == [{'stdout': ['ok'], 'stderr': []}]
+    assert len(failures) == 1
+
+
+def test_exec_command_batch_connects_once(ssh_server, logger):
+    async def _main():
+        async with AsyncSSHTransport(ssh_server.config, logger=logger) as transport:
+            return [item async for item in transport.exec_command_batch(
+                ['sleep 0.3; echo {}'.format(i) for i in range(8)], max_channels=8)]
+
+    start = time.time()
+    results = asyncio.run(_main())
+    assert time.time() - start < 2
+    assert sorted(item['stdout'][0] for item in results) == [str(i) for i in range(8)]
+    assert all(item['status'] == 0 for item in results)
+    assert ssh_server.stats()['connections'] == 1
+
+
+def test_exec_command_batch_failure_only_closes_its_channel(ssh_server, logger, monkeypatch):
+    exec_command = paramiko.Channel.exec_command
+
+    def _exec_command(channel, command):
+        if 'broken' in command:
+            raise paramiko.SSHException('channel request failed')
+        return exec_command(channel, command)
+    monkeypatch.setattr(paramiko.Channel, 'exec_command', _exec_command)
+
+    async def _main():
+        async with AsyncSSHTransport(ssh_server.config, logger=logger) as transport:
+            results = [item async for item in transport.exec_command_batch(
+                ['sleep 0.5; echo a', 'broken', 'sleep 0.5; echo b'])]
+            return results, await transport.exec_command('echo ok')
+
+    results, after = asyncio.run(_main())
+    results = sorted(results, key=lambda item: item['index'])
+    assert [(item['stdout'], item['status']) for item in results] == [(['a'], 0), ([], -1), (['b'], 0)]
+    assert after == [{'stdout': ['ok'], 'stderr': []}]
+    assert ssh_server.stats()['connections'] == 1
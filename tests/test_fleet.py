@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import time
+from vm_components.common.transport import SSHTransport, SSHConnectionPool, FleetExecutor
+
+
+def test_fleet_exec_command(ssh_server, logger):
+    fleet = FleetExecutor([ssh_server.config] * 3, logger=logger)
+    results = list(fleet.exec_command(['echo a', 'echo b']))
+    assert len(results) == 3
+    for host, result in results:
+        assert host == FleetExecutor.host(ssh_server.config)
+        assert result['code'] == 0
+        assert result['results'] == [{'stdout': ['a'], 'stderr': []}, {'stdout': ['b'], 'stderr': []}]
+
+
+def test_exec_command_does_not_retry_timeout(ssh_server, logger):
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        start = time.time()
+        assert list(transport.exec_command('sleep 2', timeout=0.3)) == []
+        assert time.time() - start < 1.5
+    assert ssh_server.stats()['exec'] == 1
+
+
+def test_fleet_timeout_closes_connection(ssh_server, logger):
+    pool = SSHConnectionPool(logger=logger)
+    fleet = FleetExecutor([ssh_server.config], timeout=0.5, pool=pool, logger=logger)
+    start = time.time()
+    results = list(fleet.exec_command(['sleep 3', 'echo second']))
+    assert time.time() - start < 1.5
+    assert [result['code'] for _, result in results] == [-3]
+    # 超时主机的连接被关闭，命令不重试，后面的命令不再执行
+    assert pool.stats()['discarded'] == 1
+    assert pool.stats()['connections'] == 0
+    time.sleep(1)
+    stats = ssh_server.stats()
+    assert (stats['connections'], stats['exec']) == (1, 1)
+    pool.close_all()
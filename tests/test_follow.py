@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import os
+import time
+import threading
+import pytest
+from vm_components.common.transport import SSHTransport, RemoteFollower
+
+
+def _append(server, name, data):
+    with open(os.path.join(server.root, name), 'ab') as f:
+        f.write(data)
+
+
+def _poll_until(follower, count, timeout=5):
+    items = []
+    deadline = time.time() + timeout
+    while len(items) < count and time.time() < deadline:
+        items.extend(follower.poll(0.1))
+    return items
+
+
+@pytest.fixture
+def transport(ssh_server, logger):
+    transport = SSHTransport(ssh_server.config, logger=logger)
+    yield transport
+    transport.close()
+
+
+def test_transport_follow(ssh_server, transport):
+    _append(ssh_server, 'app.log', b'1\n2\n3\n')
+
+    def _writer():
+        time.sleep(0.3)
+        _append(ssh_server, 'app.log', b'4\n5\n')
+    t = threading.Thread(target=_writer)
+    t.start()
+    lines = list(transport.follow('app.log', backlog=2, timeout=1))
+    t.join()
+    assert lines == ['2', '3', '4', '5']
+
+
+@pytest.mark.parametrize('backlog, expected', [(0, []), (2, ['b', 'c']), (None, ['a', 'b', 'c'])])
+def test_follower_backlog(ssh_server, transport, logger, backlog, expected):
+    _append(ssh_server, 'app.log', b'a\nb\nc\n')
+    with RemoteFollower(logger=logger) as follower:
+        assert follower.add(transport, os.path.join(ssh_server.root, 'app.log'), tag='app', backlog=backlog) == 0
+        time.sleep(0.2)
+        _append(ssh_server, 'app.log', b'new\n')
+        items = _poll_until(follower, len(expected) + 1)
+    assert items == [('app', line) for line in expected + ['new']]
+
+
+def test_follower_multiple_files(ssh_server, transport, logger):
+    with RemoteFollower(logger=logger) as follower:
+        for name in ('a.log', 'b.log'):
+            _append(ssh_server, name, b'')
+            follower.add(transport, os.path.join(ssh_server.root, name), tag=name)
+        time.sleep(0.2)
+        _append(ssh_server, 'a.log', b'from a\n')
+        _append(ssh_server, 'b.log', b'from b\n')
+        items = _poll_until(follower, 2)
+    assert sorted(items) == [('a.log', 'from a'), ('b.log', 'from b')]
+    assert ssh_server.stats()['connections'] == 1
+
+
+def test_follower_reopens_at_received_offset(ssh_server, transport, logger):
+    path = os.path.join(ssh_server.root, 'app.log')
+    _append(ssh_server, 'app.log', b'old\n')
+    with RemoteFollower(logger=logger) as follower:
+        follower.add(transport, path, tag='app')
+        time.sleep(0.2)
+        _append(ssh_server, 'app.log', b'a\nb1')
+        assert _poll_until(follower, 1) == [('app', 'a')]
+        deadline = time.time() + 5
+        while follower._follows['app']['offset'] < len(b'old\na\nb1') and time.time() < deadline:
+            follower.poll(0.1)
+        # 服务端断开连接，断开期间追加的内容在重新连接后继续返回
+        for server_transport in ssh_server._transports:
+            server_transport.close()
+        _append(ssh_server, 'app.log', b'-rest\nc\n')
+        items = _poll_until(follower, 2)
+        assert items == [('app', 'b1-rest'), ('app', 'c')]
+        assert follower.tags == ['app']
+    assert ssh_server.stats()['connections'] == 2
+
+
+def test_follower_does_not_reopen_after_exit(ssh_server, transport, logger, monkeypatch):
+    monkeypatch.setattr(SSHTransport, '_follow_cmd', staticmethod(lambda path, backlog=0, offset=None: 'echo gone; exit 3'))
+    with RemoteFollower(logger=logger) as follower:
+        follower.add(transport, os.path.join(ssh_server.root, 'app.log'), tag='app')
+        items = list(follower.follow(timeout=2))
+        assert items == [('app', 'gone')]
+        assert follower.tags == []
+    assert ssh_server.stats()['exec'] == 1
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, Vinman, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.cub@gmail.com>
+
+import os
+import time
+from vm_components.common.request import Request, MirrorStats
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _mirrors(make_http_server, count=2):
+    servers = [make_http_server() for _ in range(count)]
+    return servers, [server.base_url + '/releases/' for server in servers]
+
+
+def test_hedged_request_uses_fastest_response(make_http_server, logger):
+    (slow, fast), mirrors = _mirrors(make_http_server)
+    slow.add('/releases/updates.json', b'{"from": "slow"}', delay=1.0)
+    fast.add('/releases/updates.json', b'{"from": "fast"}')
+    req = Request(logger=logger, mirrors=mirrors, hedge_delay=0.1)
+    start = time.time()
+    assert req.get_json_info(mirrors[0] + 'updates.json') == (0, {'from': 'fast'})
+    assert time.time() - start < 0.8
+    assert len(slow.requests_for('/releases/updates.json')) == 1
+
+
+def test_hedge_delay_follows_primary_mirror(make_http_server, logger):
+    (first, second, third), mirrors = _mirrors(make_http_server, 3)
+    first.add('/releases/updates.json', b'{"from": "first"}', delay=2.0)
+    second.add('/releases/updates.json', b'{"from": "second"}', delay=2.0)
+    third.add('/releases/updates.json', b'{"from": "third"}')
+    req = Request(logger=logger, mirrors=mirrors, hedge_delay=5)
+    # 第二个镜像的中位延迟较低但p95很高，不能拖慢对第三个镜像的对冲
+    for latency in (0.1, 0.1, 0.1, 0.1, 0.1):
+        req.mirror_stats.record(mirrors[0], latency)
+    for latency in (0.2, 0.2, 0.2, 0.2, 10):
+        req.mirror_stats.record(mirrors[1], latency)
+    for latency in (0.3, 0.3, 0.3, 0.3, 0.3):
+        req.mirror_stats.record(mirrors[2], latency)
+    assert req.mirror_stats.ordered() == mirrors
+    start = time.time()
+    assert req.get_json_info(mirrors[0] + 'updates.json') == (0, {'from': 'third'})
+    assert time.time() - start < 1.5
+
+
+def test_failover_on_server_error(make_http_server, logger):
+    (broken, healthy), mirrors = _mirrors(make_http_server)
+    broken.add('/releases/updates.json', b'', status=503)
+    healthy.add('/releases/updates.json', b'{"ok": true}')
+    req = Request(logger=logger, mirrors=mirrors, hedge_delay=5)
+    start = time.time()
+    assert req.get_json_info(mirrors[0] + 'updates.json') == (0, {'ok': True})
+    # 失败时立即切换，不等待对冲时间
+    assert time.time() - start < 2
+    assert req.mirror_stats.failure_rate(mirrors[0]) == 1.0
+    assert req.mirror_stats.ordered()[0] == mirrors[1]
+
+
+def test_hedge_false_goes_to_requested_url(make_http_server, logger):
+    (first, second), mirrors = _mirrors(make_http_server)
+    first.add('/releases/updates.json', b'{}', status=503)
+    second.add('/releases/updates.json', b'{}')
+    req = Request(logger=logger, mirrors=mirrors)
+    code, r = req.get(mirrors[0] + 'updates.json', hedge=False)
+    assert (code, r.status_code) == (0, 503)
+    assert second.requests_for('/releases/updates.json') == []
+
+
+def test_mirror_stats_percentile_and_order():
+    stats = MirrorStats(['http://a/', 'http://b'])
+    for latency in (0.1, 0.2, 0.3, 0.4, 0.5):
+        stats.record('http://a/', latency)
+        stats.record('http://b/', latency / 10)
+    assert stats.percentile('http://a/', 95, min_samples=5) == 0.5
+    assert stats.ordered() == ['http://b/', 'http://a/']
+    assert stats.match('http://b/x/y.bin') == ('http://b/', 'x/y.bin')
+
+
+def _segment_requests(server, path):
+    # 测速的Range GET不带If-Range，分段下载的请求都带If-Range
+    return [headers for headers in server.requests_for(path) if 'if-range' in headers]
+
+
+def test_segments_spread_across_consistent_mirrors(make_http_server, logger, tmp_path):
+    servers, mirrors = _mirrors(make_http_server)
+    body = os.urandom(256 * 1024)
+    for server in servers:
+        server.add('/releases/firmware.bin', body, etag='"v1"')
+    req = Request(logger=logger, mirrors=mirrors)
+    status, path = req.download(mirrors[0] + 'firmware.bin', str(tmp_path), segments=4, mirror_spread=2)
+    assert status is True
+    assert _read(path) == body
+    for server in servers:
+        requests = _segment_requests(server, '/releases/firmware.bin')
+        assert requests and all(headers['if-range'] == '"v1"' for headers in requests)
+
+
+def test_segments_skip_mirror_serving_other_version(make_http_server, logger, tmp_path):
+    (current, stale), mirrors = _mirrors(make_http_server)
+    body = os.urandom(256 * 1024)
+    current.add('/releases/firmware.bin', body, etag='"v2"')
+    # 落后一个版本的镜像，长度相同但ETag不同，测速较慢排在后面
+    stale.add('/releases/firmware.bin', os.urandom(256 * 1024), etag='"v1"', delay=0.2)
+    req = Request(logger=logger, mirrors=mirrors)
+    status, path = req.download(mirrors[0] + 'firmware.bin', str(tmp_path), segments=4, mirror_spread=2)
+    assert status is True
+    assert _read(path) == body
+    assert _segment_requests(stale, '/releases/firmware.bin') == []
+
+
+def test_if_range_rejects_mirror_changed_after_probe(make_http_server, logger, tmp_path):
+    (first, second), mirrors = _mirrors(make_http_server)
+    body = os.urandom(256 * 1024)
+    first.add('/releases/firmware.bin', body, etag='"v1"')
+    second.add('/releases/firmware.bin', body, etag='"v1"', delay=0.2)
+    req = Request(logger=logger, mirrors=mirrors)
+    assert len(req.select_sources(mirrors[0] + 'firmware.bin')) == 2
+    # 测速结果缓存期间第二个镜像更新了文件，分段请求的If-Range不匹配，服务器返回200，该段改从第一个镜像下载
+    second.add('/releases/firmware.bin', os.urandom(256 * 1024), etag='"v2"')
+    status, path = req.download(mirrors[0] + 'firmware.bin', str(tmp_path), segments=4, mirror_spread=2)
+    assert status is True
+    assert _read(path) == body
+    assert _segment_requests(second, '/releases/firmware.bin')
+
+
+def test_ranking_is_cached_per_path(make_http_server, logger):
+    servers, mirrors = _mirrors(make_http_server)
+    for server in servers:
+        server.add('/releases/a.bin', b'a' * 1000)
+        server.add('/releases/b.bin', b'b' * 2000)
+    req = Request(logger=logger, mirrors=mirrors)
+    assert req.select_sources(mirrors[0] + 'a.bin')[0]['length'] == 1000
+    assert req.select_sources(mirrors[0] + 'b.bin')[0]['length'] == 2000
+    req.select_sources(mirrors[0] + 'a.bin')
+    for server in servers:
+        assert len(server.requests_for('/releases/a.bin', method='HEAD')) == 1
+        assert len(server.requests_for('/releases/b.bin', method='HEAD')) == 1
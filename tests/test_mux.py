@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import os
+import time
+import functools
+import shutil
+import socket
+import tempfile
+import threading
+import pytest
+from vm_components.common.transport import SSHTransport, SSHMuxServer, MuxClient
+from vm_components.common.transport import mux
+
+
+@pytest.fixture
+def mux_dir():
+    # Unix socket路径有长度限制，不使用pytest的tmp_path
+    directory = tempfile.mkdtemp(prefix='vm_mux_')
+    yield directory
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+@pytest.fixture
+def mux_server(mux_dir, logger):
+    server = SSHMuxServer(os.path.join(mux_dir, 'sock', 'mux.sock'), idle_timeout=0, logger=logger)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    for _ in range(100):
+        if os.path.exists(server.socket_path):
+            break
+        time.sleep(0.02)
+    yield server
+    server.shutdown()
+    t.join(5)
+
+
+def test_multiplexed_calls_share_daemon_connection(ssh_server, mux_server, logger, tmp_path):
+    local = tmp_path / 'f.txt'
+    local.write_bytes(b'hello')
+    for _ in range(2):
+        transport = SSHTransport(ssh_server.config, logger=logger, multiplexed=mux_server.socket_path)
+        assert list(transport.exec_command('echo hi')) == [{'stdout': ['hi'], 'stderr': []}]
+        # 回调不发送给守护进程
+        transport.upload(str(local), 'f.txt', callback=lambda *args: None)
+        assert transport.stat('f.txt').st_size == 5
+        assert transport._mux is not None
+        transport.close()
+        # 守护进程在处理线程结束时才把连接归还连接池
+        for _ in range(100):
+            if mux_server.stats()['active_clients'] == 0:
+                break
+            time.sleep(0.02)
+    with open(os.path.join(ssh_server.root, 'f.txt'), 'rb') as f:
+        assert f.read() == b'hello'
+    assert ssh_server.stats()['connections'] == 1
+    assert mux_server.stats()['errors'] == 0
+
+
+def _run_with_timeout(target, timeout=5):
+    # 复用调用卡住时测试失败而不是一直等待
+    results = []
+    t = threading.Thread(target=lambda: results.append(target()))
+    t.daemon = True
+    t.start()
+    t.join(timeout)
+    assert results, 'multiplexed call blocked'
+    return results[0]
+
+
+def test_nested_call_during_generator(ssh_server, mux_server, logger):
+    transport = SSHTransport(ssh_server.config, logger=logger, multiplexed=mux_server.socket_path)
+
+    def _nested():
+        items = []
+        for result in transport.exec_command(['echo a', 'echo b']):
+            items.append((result['stdout'], transport.listdir('.')))
+        return items
+    assert _run_with_timeout(_nested) == [(['a'], []), (['b'], [])]
+    assert transport._mux is not None
+    # 依次调用时复用同一个到守护进程的连接
+    assert _run_with_timeout(lambda: list(transport.exec_command('echo c'))) == [{'stdout': ['c'], 'stderr': []}]
+    assert len(transport._mux._idle) == 2
+    transport.close()
+    assert mux_server.stats()['errors'] == 0
+
+
+def test_stream_does_not_block_other_threads(ssh_server, mux_server, logger):
+    transport = SSHTransport(ssh_server.config, logger=logger, multiplexed=mux_server.socket_path)
+    stream = transport.exec_command_stream('echo start; sleep 1; echo end')
+    assert next(stream) == ('stdout', 'start')
+    start = time.time()
+    assert _run_with_timeout(lambda: transport.stat('.')) is not None
+    assert time.time() - start < 0.8
+    assert list(stream) == [('stdout', 'end'), ('exit', 0)]
+    transport.close()
+
+
+def test_unserializable_arguments_fall_back(ssh_server, mux_server, logger, tmp_path):
+    local = tmp_path / 'f.txt'
+    local.write_bytes(b'hello')
+    transport = SSHTransport(ssh_server.config, logger=logger, multiplexed=mux_server.socket_path)
+    assert transport.stat('.') is not None
+    # 位置参数中的回调无法JSON序列化，退化为直接连接执行
+    transport.upload(str(local), 'f.txt', None, None, lambda done, total: None)
+    assert transport._mux is None
+    transport.close()
+    with open(os.path.join(ssh_server.root, 'f.txt'), 'rb') as f:
+        assert f.read() == b'hello'
+
+
+def test_follow_uses_direct_connection(ssh_server, mux_server, logger):
+    with open(os.path.join(ssh_server.root, 'app.log'), 'wb') as f:
+        f.write(b'1\n')
+    transport = SSHTransport(ssh_server.config, logger=logger, multiplexed=mux_server.socket_path)
+    other = SSHTransport(ssh_server.config, logger=logger, multiplexed=mux_server.socket_path)
+    lines = transport.follow('app.log', backlog=1, timeout=5)
+    assert next(lines) == '1'
+    # 跟踪期间不占用守护进程的连接，其他复用调用不被阻塞
+    results = []
+    t = threading.Thread(target=lambda: results.append(list(other.exec_command('echo hi'))))
+    t.daemon = True
+    t.start()
+    t.join(3)
+    assert results == [[{'stdout': ['hi'], 'stderr': []}]]
+    assert transport._ssh is not None
+    lines.close()
+    transport.close()
+    other.close()
+    assert mux_server.stats()['errors'] == 0
+
+
+def test_error_after_request_sent_is_not_retried_directly(ssh_server, mux_server, logger, monkeypatch, tmp_path):
+    local = tmp_path / 'f.txt'
+    local.write_bytes(b'hello')
+    call = SSHMuxServer._call
+
+    def _call(server, client, transport, request):
+        if request.get('method') in ('exec_command', 'upload'):
+            # 守护进程收到请求后中途断开(如进程退出)，无法知道操作是否已经执行
+            client.shutdown(socket.SHUT_RDWR)
+            return
+        return call(server, client, transport, request)
+    monkeypatch.setattr(SSHMuxServer, '_call', _call)
+    transport = SSHTransport(ssh_server.config, logger=logger, multiplexed=mux_server.socket_path)
+    with pytest.raises(mux.MuxError):
+        list(transport.exec_command('echo hi'))
+    with pytest.raises(mux.MuxError):
+        transport.upload(str(local), 'f.txt', callback=None)
+    # 没有退化为直接连接重新执行
+    assert transport._ssh is None
+    assert ssh_server.stats().get('exec', 0) == 0
+    assert not os.path.exists(os.path.join(ssh_server.root, 'f.txt'))
+    # 之后的调用重新连接守护进程
+    assert transport.stat('.') is not None
+    assert transport._mux is not None
+    transport.close()
+
+
+def test_daemon_unavailable_falls_back(ssh_server, mux_dir, logger):
+    path = os.path.join(mux_dir, 'mux.sock')
+    assert MuxClient(path).connect() == -1
+    transport = SSHTransport(ssh_server.config, logger=logger, multiplexed=path)
+    # 不真正启动守护进程，缩短等待启动的时间
+    client = transport._mux
+    client.spawn = lambda *args, **kwargs: None
+    client.connect = functools.partial(MuxClient.connect, client, start_timeout=0.2)
+    assert list(transport.exec_command('echo hi')) == [{'stdout': ['hi'], 'stderr': []}]
+    assert transport._mux is None
+    transport.close()
+
+
+def test_insecure_socket_dir_is_refused(mux_server, mux_dir, logger):
+    directory = os.path.dirname(mux_server.socket_path)
+    assert MuxClient(mux_server.socket_path).connect() == 0
+    os.chmod(directory, 0o755)
+    try:
+        assert mux.check_socket_dir(directory) is not None
+        assert MuxClient(mux_server.socket_path).connect(autostart=True) == -1
+        with pytest.raises(RuntimeError):
+            SSHMuxServer(mux_server.socket_path, logger=logger)._bind()
+    finally:
+        os.chmod(directory, 0o700)
+    # 指向安全目录的符号链接同样拒绝
+    link = os.path.join(mux_dir, 'link')
+    os.symlink(directory, link)
+    assert mux.check_socket_dir(link) is not None
+    assert MuxClient(os.path.join(link, 'mux.sock')).connect() == -1
+
+
+def test_default_socket_path_prefers_runtime_dir(monkeypatch, mux_dir):
+    monkeypatch.setenv('XDG_RUNTIME_DIR', mux_dir)
+    assert mux.default_socket_path() == os.path.join(mux_dir, 'vm_ssh_mux', 'mux.sock')
+    monkeypatch.delenv('XDG_RUNTIME_DIR')
+    assert mux.default_socket_path().startswith(tempfile.gettempdir())
+
+
+@pytest.mark.skipif(not hasattr(socket, 'SO_PEERCRED'), reason='SO_PEERCRED not supported')
+def test_peer_uid():
+    left, right = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        assert mux.peer_uid(left) == os.getuid()
+        assert mux._same_user(right)
+    finally:
+        left.close()
+        right.close()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import time
+import threading
+from vm_components.common.transport import SSHTransport, SSHConnectionPool
+
+
+def _connect(server, logger):
+    return lambda: SSHTransport(server.config, logger=logger)._create_client()
+
+
+def test_release_and_reuse(ssh_server, logger):
+    pool = SSHConnectionPool(logger=logger)
+    client = pool.acquire(ssh_server.config, _connect(ssh_server, logger))
+    pool.release(client)
+    assert pool.acquire(ssh_server.config, _connect(ssh_server, logger)) is client
+    stats = pool.stats()
+    assert (stats['created'], stats['reused'], stats['leases']) == (1, 1, 1)
+    assert ssh_server.stats()['connections'] == 1
+    pool.close_all()
+
+
+def test_share_after_max_per_host(ssh_server, logger):
+    pool = SSHConnectionPool(max_per_host=2, logger=logger)
+    clients = [pool.acquire(ssh_server.config, _connect(ssh_server, logger)) for _ in range(5)]
+    assert len(set(id(client) for client in clients)) == 2
+    assert pool.stats()['shared'] == 3
+    pool.close_all()
+
+
+def test_concurrent_acquire_respects_max_per_host(ssh_server, logger):
+    pool = SSHConnectionPool(max_per_host=2, logger=logger)
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(pool.acquire(ssh_server.config,
+                                                                           _connect(ssh_server, logger))))
+               for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(clients) == 6
+    assert pool.stats()['created'] == 2
+    assert ssh_server.stats()['connections'] == 2
+    pool.close_all()
+
+
+def test_discard_keeps_shared_connection_open_until_last_release(ssh_server, logger):
+    pool = SSHConnectionPool(max_per_host=1, logger=logger)
+    first = pool.acquire(ssh_server.config, _connect(ssh_server, logger))
+    second = pool.acquire(ssh_server.config, _connect(ssh_server, logger))
+    assert first is second
+    transport = first.get_transport()
+    # 一个使用者出错丢弃连接，另一个使用者的通道不受影响
+    pool.release(first, discard=True)
+    assert transport.is_active()
+    _, stdout, _ = second.exec_command('echo alive')
+    assert stdout.read().strip() == b'alive'
+    # 已损坏的连接不再分配给新的使用者
+    third = pool.acquire(ssh_server.config, _connect(ssh_server, logger))
+    assert third is not first
+    pool.release(second)
+    assert not transport.is_active()
+    assert pool.stats()['discarded'] == 1
+    pool.release(third)
+    pool.close_all()
+
+
+def test_discard_during_acquire_is_not_handed_out(ssh_server, logger):
+    pool = SSHConnectionPool(max_per_host=1, logger=logger)
+    first = pool.acquire(ssh_server.config, _connect(ssh_server, logger))
+    transport = first.get_transport()
+    is_healthy = pool.is_healthy
+
+    def _racing_is_healthy(client, probe=False):
+        # 新的使用者已选中该连接、还在检查时，原使用者出错丢弃了它
+        pool.is_healthy = is_healthy
+        pool.release(first, discard=True)
+        return is_healthy(client, probe)
+
+    pool.is_healthy = _racing_is_healthy
+    second = pool.acquire(ssh_server.config, _connect(ssh_server, logger))
+    assert second is not first
+    assert not transport.is_active()
+    assert pool.stats()['connections'] == 1
+    pool.release(second)
+    pool.close_all()
+
+
+def test_idle_connections_evicted_without_pool_activity(ssh_server, logger):
+    pool = SSHConnectionPool(idle_timeout=0.2, logger=logger)
+    client = pool.acquire(ssh_server.config, _connect(ssh_server, logger))
+    transport = client.get_transport()
+    pool.release(client)
+    # 之后没有acquire/release调用，由后台线程关闭空闲连接
+    for _ in range(50):
+        if pool.stats()['connections'] == 0:
+            break
+        time.sleep(0.05)
+    assert pool.stats()['evicted'] == 1
+    assert not transport.is_active()
+    for _ in range(50):
+        if pool._sweeper is None:
+            break
+        time.sleep(0.05)
+    assert pool._sweeper is None
+
+
+def test_dead_connection_is_replaced(ssh_server, logger):
+    pool = SSHConnectionPool(logger=logger)
+    client = pool.acquire(ssh_server.config, _connect(ssh_server, logger))
+    pool.release(client)
+    client.close()
+    other = pool.acquire(ssh_server.config, _connect(ssh_server, logger))
+    assert other is not client
+    assert other.get_transport().is_active()
+    assert pool.stats()['connections'] == 1
+    pool.close_all()
+
+
+def test_transport_uses_pool(ssh_server, logger):
+    pool = SSHConnectionPool(logger=logger)
+    for _ in range(3):
+        with SSHTransport(ssh_server.config, logger=logger, pool=pool) as transport:
+            assert list(transport.exec_command('echo hi')) == [{'stdout': ['hi'], 'stderr': []}]
+    assert ssh_server.stats()['connections'] == 1
+    pool.close_all()
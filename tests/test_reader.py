@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import io
+import os
+import pytest
+from vm_components.common.transport import SSHTransport
+
+
+@pytest.fixture
+def transport(ssh_server, logger):
+    transport = SSHTransport(ssh_server.config, logger=logger)
+    yield transport
+    transport.close()
+
+
+def _write(server, name, data):
+    with open(os.path.join(server.root, name), 'wb') as f:
+        f.write(data)
+
+
+def test_seek_and_read(ssh_server, transport):
+    data = bytes(bytearray(range(256))) * 40
+    _write(ssh_server, 'data.bin', data)
+    with transport.open_reader('data.bin', block_size=1000) as reader:
+        assert reader.size == len(data)
+        assert reader.read(10) == data[:10]
+        reader.seek(995)
+        # 跨越块边界
+        assert reader.read(10) == data[995:1005]
+        assert reader.tell() == 1005
+        reader.seek(-5, io.SEEK_END)
+        assert reader.read() == data[-5:]
+        assert reader.read(10) == b''
+        reader.seek(-100, io.SEEK_CUR)
+        buffer = bytearray(50)
+        assert reader.readinto(buffer) == 50
+        assert bytes(buffer) == data[-100:-50]
+        with pytest.raises(ValueError):
+            reader.seek(-1)
+
+
+def test_sequential_read_uses_readahead(ssh_server, transport):
+    data = os.urandom(16000)
+    _write(ssh_server, 'data.bin', data)
+    with transport.open_reader('data.bin', block_size=1000, readahead=4) as reader:
+        chunks = []
+        chunk = reader.read(300)
+        while chunk:
+            chunks.append(chunk)
+            chunk = reader.read(300)
+        assert b''.join(chunks) == data
+        stats = reader.stats()
+    # 每次readv读取当前块和预读的4块
+    assert stats['requests'] == 4
+    assert stats['bytes'] == len(data)
+
+
+def test_random_seek_reads_only_target_block(ssh_server, transport):
+    _write(ssh_server, 'data.bin', os.urandom(100000))
+    with transport.open_reader('data.bin', block_size=1000, readahead=8) as reader:
+        reader.read(1)
+        reader.seek(50000)
+        reader.read(1)
+        reader.seek(20500)
+        reader.read(1)
+        stats = reader.stats()
+    assert stats['requests'] == 3
+    # 只有第一次读取同时预读后面的8块
+    assert stats['bytes'] == (1 + 8) * 1000 + 2 * 1000
+
+
+def test_lines_and_reverse_lines(ssh_server, transport):
+    lines = [('line {}\n'.format(i) * (i % 3 + 1)).encode('ascii') for i in range(500)]
+    _write(ssh_server, 'app.log', b''.join(lines) + b'partial')
+    with transport.open_reader('app.log', block_size=512, readahead=2) as reader:
+        assert list(reader)[:3] == [b'line 0\n', b'line 1\n', b'line 1\n']
+        reader.seek(0)
+        assert reader.readline() == b'line 0\n'
+        position = reader.tell()
+        reversed_lines = list(reader.reverse_lines())
+        # 反向读取不改变当前位置
+        assert reader.tell() == position
+    expected = b''.join(lines).splitlines(True)
+    assert reversed_lines == [b'partial'] + expected[::-1]
+
+
+def test_refresh_after_append(ssh_server, transport):
+    _write(ssh_server, 'app.log', b'a' * 1500)
+    with transport.open_reader('app.log', block_size=1000) as reader:
+        assert reader.read() == b'a' * 1500
+        with open(os.path.join(ssh_server.root, 'app.log'), 'ab') as f:
+            f.write(b'b' * 700)
+        assert reader.refresh() == 2200
+        reader.seek(1400)
+        assert reader.read() == b'a' * 100 + b'b' * 700
+
+
+def test_reader_uses_dedicated_sftp(ssh_server, transport):
+    _write(ssh_server, 'data.bin', b'x' * 5000)
+    reader = transport.open_reader('data.bin', block_size=1000)
+    sftp = reader._file.sftp
+    assert sftp is not transport.sftp
+    # 实例的SFTP关闭不影响读取对象
+    transport.sftp.close()
+    transport._sftp = None
+    assert reader.read() == b'x' * 5000
+    reader.close()
+    assert sftp.sock.closed
+    assert transport.stat('data.bin').st_size == 5000
+
+
+def test_open_reader_missing_file(transport):
+    assert transport.open_reader('missing.bin') is None
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, Vinman, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.cub@gmail.com>
+
+import os
+import json
+import hashlib
+import threading
+from vm_components.common.request import Request
+
+
+def test_session_reuses_connections(http_server, logger):
+    url = http_server.add('/updates.json', json.dumps({'version': '1.0.0'}).encode('utf-8'))
+    with Request(logger=logger, use_session=True) as req:
+        for _ in range(5):
+            assert req.get_json_info(url) == (0, {'version': '1.0.0'})
+    assert http_server.connections == 1
+
+
+def test_per_call_opens_new_connections(http_server, logger):
+    url = http_server.add('/updates.json', b'{}')
+    req = Request(logger=logger)
+    for _ in range(3):
+        assert req.get_json_info(url) == (0, {})
+    assert http_server.connections == 3
+
+
+def test_session_shared_across_threads(http_server, logger):
+    url = http_server.add('/updates.json', b'{}')
+    sessions = []
+    with Request(logger=logger, use_session=True, pool_maxsize=4) as req:
+        threads = [threading.Thread(target=lambda: sessions.append(req.session)) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(set(id(session) for session in sessions)) == 1
+        assert req.get_json_info(url)[0] == 0
+    assert req._session is None
+
+
+def test_keep_alive_false_sends_connection_close(http_server, logger):
+    url = http_server.add('/updates.json', b'{}')
+    with Request(logger=logger, use_session=True, keep_alive=False) as req:
+        req.get_json_info(url)
+        req.get_json_info(url)
+    assert http_server.requests_for('/updates.json')[0]['connection'] == 'close'
+    assert http_server.connections == 2
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_segmented_download(http_server, logger, tmp_path):
+    body = bytes(bytearray(range(256))) * 1000
+    url = http_server.add('/firmware.bin', body)
+    status, path = Request(logger=logger).download(url, str(tmp_path), segments=4)
+    assert status is True
+    assert _read(path) == body
+    ranges = [headers.get('range') for headers in http_server.requests_for('/firmware.bin')]
+    assert sorted(r for r in ranges if r) == sorted('bytes={}-{}'.format(start, min(start + 64000, len(body)) - 1)
+                                                    for start in range(0, len(body), 64000))
+
+
+def test_segmented_download_without_ranges_falls_back(http_server, logger, tmp_path):
+    body = b'x' * 100000
+    url = http_server.add('/firmware.bin', body, ranges=False)
+    status, path = Request(logger=logger).download(url, str(tmp_path), segments=4)
+    assert status is True
+    assert _read(path) == body
+    assert len(http_server.requests_for('/firmware.bin')) == 1
+
+
+def test_resume_continues_with_range_and_if_range(http_server, logger, tmp_path):
+    body = bytes(bytearray(range(256))) * 400
+    url = http_server.add('/firmware.bin', body, etag='"v1"', cut_after=30000)
+    req = Request(logger=logger)
+    assert req.download(url, str(tmp_path), resume=True, chunk_size=4096) == (False, None)
+    part = tmp_path / 'firmware.bin.part'
+    offset = part.stat().st_size
+    assert 0 < offset <= 30000
+    status, path = req.download(url, str(tmp_path), resume=True, digest=hashlib.sha256(body).hexdigest())
+    assert status is True
+    assert _read(path) == body
+    assert not part.exists() and not (tmp_path / 'firmware.bin.part.json').exists()
+    headers = http_server.requests_for('/firmware.bin')[-1]
+    assert headers['range'] == 'bytes={}-'.format(offset)
+    assert headers['if-range'] == '"v1"'
+
+
+def test_resume_restarts_when_validator_changes(http_server, logger, tmp_path):
+    old = b'a' * 50000
+    url = http_server.add('/firmware.bin', old, etag='"v1"', cut_after=20000)
+    req = Request(logger=logger)
+    assert req.download(url, str(tmp_path), resume=True, chunk_size=4096) == (False, None)
+    assert (tmp_path / 'firmware.bin.part').stat().st_size > 0
+    new = b'b' * 60000
+    http_server.add('/firmware.bin', new, etag='"v2"')
+    status, path = req.download(url, str(tmp_path), resume=True)
+    assert status is True
+    # If-Range不匹配时服务器返回完整的新内容，不能拼接到旧的.part后面
+    assert _read(path) == new
+
+
+def test_download_many_limits_per_host(make_http_server, logger, tmp_path):
+    servers = [make_http_server(), make_http_server()]
+    items = []
+    for index, server in enumerate(servers):
+        for i in range(6):
+            items.append(server.add('/file{}.bin'.format(i), b'x' * 1000, delay=0.1))
+    req = Request(logger=logger)
+    results = list(req.download_many(items, target_path=str(tmp_path), max_workers=8, max_per_host=2,
+                                     use_cache=False))
+    assert len(results) == 12
+    assert all(status for _, (status, _) in results)
+    for server in servers:
+        assert server.max_active == 2
+
+
+def test_download_many_respects_max_workers(http_server, logger, tmp_path):
+    items = [http_server.add('/file{}.bin'.format(i), b'x', delay=0.1) for i in range(6)]
+    results = list(Request(logger=logger).download_many(items, target_path=str(tmp_path), max_workers=3,
+                                                        max_per_host=10))
+    assert len(results) == 6
+    assert http_server.max_active == 3
+
+
+def test_download_many_clamps_invalid_limits(http_server, logger, tmp_path):
+    items = [http_server.add('/file{}.bin'.format(i), b'x') for i in range(3)]
+    results = list(Request(logger=logger).download_many(items, target_path=str(tmp_path), max_per_host=0))
+    assert [status for _, (status, _) in results] == [True] * 3
+    assert http_server.max_active == 1
+
+
+def test_download_many_returns_tuples_on_failure(http_server, logger, tmp_path):
+    url = http_server.add('/file.bin', b'x')
+    blocker = tmp_path / 'blocker'
+    blocker.write_bytes(b'')
+    items = [url, {'url': url, 'target_path': str(blocker / 'sub')}]
+    results = dict((str(item), result) for item, result in
+                   Request(logger=logger).download_many(items, target_path=str(tmp_path)))
+    assert results[url][0] is True
+    assert [result for item, result in results.items() if item != url] == [(False, None)]
+
+
+def test_download_verifies_digest(http_server, logger, tmp_path):
+    body = os.urandom(200000)
+    url = http_server.add('/firmware.bin', body)
+    req = Request(logger=logger)
+    status, path = req.download(url, str(tmp_path), digest=hashlib.sha256(body).hexdigest(), chunk_size=8192)
+    assert status is True
+    assert _read(path) == body
+    status, path = req.download(url, str(tmp_path), digest=hashlib.md5(body).hexdigest(), digest_type='md5',
+                                segments=4)
+    assert status is True
+
+
+def test_download_digest_mismatch_removes_file(http_server, logger, tmp_path):
+    url = http_server.add('/firmware.bin', b'x' * 1000)
+    status, path = Request(logger=logger).download(url, str(tmp_path), digest='0' * 64)
+    assert (status, path) == (False, None)
+    assert not (tmp_path / 'firmware.bin').exists()
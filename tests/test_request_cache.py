@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, Vinman, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.cub@gmail.com>
+
+import os
+import json
+import time
+import threading
+from vm_components.common.request import Request, DownloadCache, ResponseCache
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_conditional_get_uses_cache_on_304(http_server, logger, tmp_path):
+    body = os.urandom(100000)
+    url = http_server.add('/firmware.bin', body, etag='"v1"')
+    req = Request(logger=logger, cache_dir=str(tmp_path / 'cache'))
+    assert req.download(url, str(tmp_path / 'a'))[0] is True
+    status, path = req.download(url, str(tmp_path / 'b'))
+    assert status is True
+    assert _read(path) == body
+    assert http_server.requests_for('/firmware.bin')[-1]['if-none-match'] == '"v1"'
+    stats = req.download_cache.stats()
+    assert (stats['hits'], stats['misses'], stats['stores']) == (1, 1, 1)
+
+
+def test_changed_validator_downloads_again(http_server, logger, tmp_path):
+    url = http_server.add('/firmware.bin', b'old' * 1000, last_modified='Mon, 01 Jan 2024 00:00:00 GMT')
+    req = Request(logger=logger, cache_dir=str(tmp_path / 'cache'))
+    assert req.download(url, str(tmp_path))[0] is True
+    http_server.add('/firmware.bin', b'new' * 1000, last_modified='Tue, 02 Jan 2024 00:00:00 GMT')
+    status, path = req.download(url, str(tmp_path))
+    assert status is True
+    assert _read(path) == b'new' * 1000
+    assert http_server.requests_for('/firmware.bin')[-1]['if-modified-since'] == 'Mon, 01 Jan 2024 00:00:00 GMT'
+    assert req.download_cache.stats()['stores'] == 2
+
+
+def test_server_error_falls_back_to_cache(http_server, logger, tmp_path):
+    url = http_server.add('/firmware.bin', b'x' * 1000, etag='"v1"')
+    req = Request(logger=logger, cache_dir=str(tmp_path / 'cache'))
+    assert req.download(url, str(tmp_path / 'a'))[0] is True
+    http_server.files['/firmware.bin']['status'] = 503
+    status, path = req.download(url, str(tmp_path / 'b'))
+    assert status is True
+    assert _read(path) == b'x' * 1000
+    assert req.download_cache.stats()['fallbacks'] == 1
+
+
+def test_store_keeps_separate_copy(logger, tmp_path):
+    source = tmp_path / 'file.bin'
+    source.write_bytes(b'x' * 4096)
+    cache = DownloadCache(str(tmp_path / 'cache'), logger=logger)
+    assert cache.store('http://a/file.bin', str(source), etag='"v1"') is True
+    entry = cache.lookup('http://a/file.bin')
+    assert entry['size'] == 4096
+    assert os.stat(cache.path(entry)).st_ino != os.stat(str(source)).st_ino
+    # 原地修改或删除下载的文件不影响缓存
+    with open(str(source), 'r+b') as f:
+        f.write(b'y' * 10)
+    source.unlink()
+    assert cache.copy_to('http://a/file.bin', str(tmp_path / 'copy.bin')) is True
+    assert (tmp_path / 'copy.bin').read_bytes() == b'x' * 4096
+
+
+def test_modified_download_does_not_corrupt_cache(http_server, logger, tmp_path):
+    body = b'A' * 12
+    url = http_server.add('/firmware.bin', body, etag='"v1"')
+    req = Request(logger=logger, cache_dir=str(tmp_path / 'cache'))
+    status, path = req.download(url, str(tmp_path / 'a'))
+    assert status is True
+    with open(path, 'r+b') as f:
+        f.write(b'B' * 10)
+    status, path = req.download(url, str(tmp_path / 'b'))
+    assert status is True
+    assert _read(path) == body
+    assert req.download_cache.stats()['hits'] == 1
+
+
+def test_hit_defers_index_write(logger, tmp_path):
+    source = tmp_path / 'file.bin'
+    source.write_bytes(b'x')
+    cache = DownloadCache(str(tmp_path / 'cache'), flush_interval=3600, logger=logger)
+    cache.store('http://a/file.bin', str(source), etag='"v1"')
+    with open(cache.index_path) as f:
+        atime = json.load(f)['http://a/file.bin']['atime']
+    for _ in range(10):
+        cache.hit('http://a/file.bin')
+    with open(cache.index_path) as f:
+        assert json.load(f)['http://a/file.bin']['atime'] == atime
+    cache.flush()
+    with open(cache.index_path) as f:
+        assert json.load(f)['http://a/file.bin']['atime'] > atime
+
+
+def test_lru_eviction(logger, tmp_path):
+    cache = DownloadCache(str(tmp_path / 'cache'), max_bytes=2500, logger=logger)
+
+    def _store(name):
+        path = tmp_path / name
+        path.write_bytes(b'x' * 1000)
+        cache.store('http://host/' + name, str(path), etag=name)
+
+    _store('a')
+    _store('b')
+    cache.hit('http://host/a')
+    _store('c')
+    # b最久未使用被淘汰
+    assert cache.lookup('http://host/b') is None
+    assert cache.lookup('http://host/a') is not None
+    assert cache.lookup('http://host/c') is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_json_cache_single_flight(http_server, logger):
+    url = http_server.add('/updates.json', b'{"version": "1.0.0"}', delay=0.3)
+    req = Request(logger=logger, json_cache_ttl=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(req.get_json_info(url))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [(0, {'version': '1.0.0'})] * 8
+    assert len(http_server.requests_for('/updates.json')) == 1
+    assert req.json_cache.stats()['misses'] == 1
+
+
+def test_stale_while_revalidate():
+    calls = []
+    refreshed = threading.Event()
+
+    def _loader():
+        calls.append(time.time())
+        if len(calls) > 1:
+            refreshed.set()
+        return 0, len(calls)
+
+    cache = ResponseCache(ttl=0.05)
+    assert cache.get('key', _loader) == (0, 1)
+    time.sleep(0.1)
+    # 过期后立即返回旧值，后台刷新
+    assert cache.get('key', _loader) == (0, 1)
+    assert refreshed.wait(2)
+    for _ in range(100):
+        if cache.get('key', _loader) == (0, 2):
+            break
+        time.sleep(0.01)
+    assert cache.get('key', _loader)[1] >= 2
+    assert cache.stats()['stale_hits'] >= 1
+
+
+def test_stale_ttl_zero_reloads_synchronously():
+    values = iter(range(10))
+    cache = ResponseCache(ttl=0.01, stale_ttl=0)
+    assert cache.get('key', lambda: (0, next(values))) == (0, 0)
+    time.sleep(0.05)
+    assert cache.get('key', lambda: (0, next(values))) == (0, 1)
+    assert cache.stats()['stale_hits'] == 0
+
+
+def test_failed_load_is_not_cached():
+    cache = ResponseCache(ttl=60)
+    assert cache.get('key', lambda: (-2, {})) == (-2, {})
+    assert cache.get('key', lambda: (0, {'a': 1})) == (0, {'a': 1})
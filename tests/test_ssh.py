@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import os
+import time
+import threading
+import paramiko
+from vm_components.common.transport import SSHTransport
+
+
+def _collect(items):
+    result = {'stdout': [], 'stderr': [], 'exit': []}
+    for stream, data in items:
+        result[stream].append(data)
+    return result
+
+
+def test_exec_command_stream_lines_and_exit_status(ssh_server, logger):
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        result = _collect(transport.exec_command_stream("printf 'a\\nb\\r\\nc'; echo err >&2; exit 3"))
+    assert result == {'stdout': ['a', 'b', 'c'], 'stderr': ['err'], 'exit': [3]}
+
+
+def test_exec_command_stream_reads_both_pipes(ssh_server, logger):
+    # stderr输出远大于通道窗口，只读stdout会互相阻塞
+    cmd = "head -c 3000000 /dev/zero | tr '\\0' e >&2; head -c 3000000 /dev/zero | tr '\\0' o"
+    sizes = {'stdout': 0, 'stderr': 0}
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        for stream, data in transport.exec_command_stream(cmd, lines=False, timeout=10):
+            if stream == 'exit':
+                assert data == 0
+            else:
+                assert isinstance(data, bytes)
+                sizes[stream] += len(data)
+    assert sizes == {'stdout': 3000000, 'stderr': 3000000}
+
+
+def test_exec_command_stream_splits_long_lines(ssh_server, logger):
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        result = _collect(transport.exec_command_stream("head -c 2500 /dev/zero | tr '\\0' x", max_line=1000))
+    assert [len(line) for line in result['stdout']] == [1000, 1000, 500]
+
+
+def test_exec_command_stream_timeout(ssh_server, logger):
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        start = time.time()
+        result = _collect(transport.exec_command_stream('echo start; sleep 3', timeout=0.3))
+        assert time.time() - start < 2
+        assert result['stdout'] == ['start']
+        assert result['exit'] == [-1]
+        # 超时只关闭该通道，连接可以继续使用
+        assert list(transport.exec_command('echo ok')) == [{'stdout': ['ok'], 'stderr': []}]
+    assert ssh_server.stats()['connections'] == 1
+
+
+def test_exec_command_batch(ssh_server, logger):
+    cmds = ['sleep 0.3; echo {}'.format(i) for i in range(6)] + ['echo err >&2; exit 2']
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        start = time.time()
+        results = sorted(transport.exec_command_batch(cmds, max_channels=6), key=lambda item: item['index'])
+        assert time.time() - start < 1.5
+    assert [result['stdout'] for result in results[:6]] == [[str(i)] for i in range(6)]
+    assert (results[6]['stderr'], results[6]['status']) == (['err'], 2)
+    assert ssh_server.stats()['connections'] == 1
+
+
+def test_exec_command_batch_failure_only_closes_its_channel(ssh_server, logger, monkeypatch):
+    exec_command = paramiko.Channel.exec_command
+
+    def _exec_command(channel, command):
+        if 'broken' in command:
+            raise paramiko.SSHException('channel request failed')
+        return exec_command(channel, command)
+    monkeypatch.setattr(paramiko.Channel, 'exec_command', _exec_command)
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        cmds = ['sleep 0.5; echo a', 'broken', 'sleep 0.5; echo b']
+        results = sorted(transport.exec_command_batch(cmds), key=lambda item: item['index'])
+        assert [(result['stdout'], result['status']) for result in results] == [(['a'], 0), ([], -1), (['b'], 0)]
+        assert list(transport.exec_command('echo ok')) == [{'stdout': ['ok'], 'stderr': []}]
+    assert ssh_server.stats()['connections'] == 1
+
+
+def test_concurrent_lazy_connect(ssh_server, logger):
+    transport = SSHTransport(ssh_server.config, logger=logger)
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(transport.ssh)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(id(client) for client in clients)) == 1
+    transport.close()
+    assert ssh_server.stats()['connections'] == 1
+
+
+def test_metadata_cache_disabled_by_default(ssh_server, logger):
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        assert transport.metadata is None
+        with open(os.path.join(ssh_server.root, 'f.txt'), 'wb') as f:
+            f.write(b'x')
+        assert transport.stat('f.txt').st_size == 1
+        os.remove(os.path.join(ssh_server.root, 'f.txt'))
+        assert transport.stat('f.txt') is None
+
+
+def test_exec_command_invalidates_metadata(ssh_server, logger, tmp_path):
+    local = tmp_path / 'f.txt'
+    local.write_bytes(b'x')
+    with SSHTransport(ssh_server.config, logger=logger, metadata_ttl=60) as transport:
+        run = [
+            lambda cmd: list(transport.exec_command(cmd)),
+            lambda cmd: list(transport.exec_command_stream(cmd)),
+            lambda cmd: list(transport.exec_command_batch([cmd])),
+        ]
+        for execute in run:
+            transport.upload(str(local), 'f.txt', subdirectory='dir', callback=None)
+            assert transport.stat('dir/f.txt').st_size == 1
+            assert transport.metadata.has_dir(os.path.join(ssh_server.root, 'dir'))
+            execute('rm -r dir')
+            # 命令修改了远程文件，缓存的stat和目录都不再使用
+            assert transport.stat('dir/f.txt') is None
+            assert not transport.metadata.has_dir(os.path.join(ssh_server.root, 'dir'))
+
+
+def test_mkdir_and_upload_change_sftp_cwd_without_metadata_cache(ssh_server, logger, tmp_path):
+    local = tmp_path / 'f.txt'
+    local.write_bytes(b'x')
+    root = os.path.realpath(ssh_server.root)
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        assert transport.mkdir('a/b') == 0
+        assert transport.sftp.getcwd() == os.path.join(root, 'a', 'b')
+        # 调用方可以继续通过sftp使用相对路径
+        assert transport.sftp.listdir('.') == []
+        assert transport.mkdir('a/b') == 0
+        transport.upload(str(local), 'f.txt', subdirectory='c', callback=None)
+        assert transport.sftp.getcwd() == os.path.join(root, 'c')
+        assert transport.sftp.listdir('.') == ['f.txt']
+    with SSHTransport(ssh_server.config, logger=logger, metadata_ttl=60) as transport:
+        assert transport.mkdir('d') == 0
+        assert transport.sftp.getcwd() is None
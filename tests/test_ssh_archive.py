@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import os
+import logging
+import threading
+import pytest
+from vm_components.common.transport import SSHTransport
+from vm_components.common.transport import ssh as ssh_module
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+@pytest.fixture
+def error_logger():
+    logger = logging.getLogger('vm_components.tests.archive')
+    logger.setLevel(logging.ERROR)
+    handler = _ListHandler()
+    logger.addHandler(handler)
+    logger.messages = handler.messages
+    yield logger
+    logger.removeHandler(handler)
+
+
+def _make_tree(root, count=50):
+    files = {}
+    for i in range(count):
+        rel = os.path.join('d{}'.format(i % 5), 'f{}.txt'.format(i))
+        files[rel] = ('file {}\n'.format(i) * (i + 1)).encode('ascii')
+        path = os.path.join(str(root), rel)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(files[rel])
+    return files
+
+
+def _read_tree(root):
+    result = {}
+    for base, _, names in os.walk(str(root)):
+        for name in names:
+            with open(os.path.join(base, name), 'rb') as f:
+                result[os.path.relpath(os.path.join(base, name), str(root))] = f.read()
+    return result
+
+
+@pytest.mark.parametrize('compress', [None, 'gz'])
+def test_archive_round_trip(ssh_server, logger, tmp_path, compress):
+    files = _make_tree(tmp_path / 'src')
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        result = transport.upload_archive(str(tmp_path / 'src'), 'dst', compress=compress)
+        assert (result['code'], result['files']) == (0, len(files))
+        assert _read_tree(os.path.join(ssh_server.root, 'dst')) == files
+        result = transport.download_archive('dst', str(tmp_path / 'back'), compress=compress)
+        assert (result['code'], result['files']) == (0, len(files))
+    assert _read_tree(tmp_path / 'back') == files
+
+
+def test_download_archive_drains_stderr(ssh_server, logger, tmp_path, monkeypatch):
+    files = _make_tree(os.path.join(ssh_server.root, 'src'), count=5)
+    # 压缩命令先向stderr输出远大于通道窗口的内容，只在结束后读取stderr时两端会互相等待
+    noisy = "sh -c 'head -c 1000000 /dev/zero | tr \"\\0\" w >&2; exec gzip \"$@\"' sh"
+    monkeypatch.setitem(ssh_module.COMPRESSORS, 'gz', ('z', noisy))
+    results = []
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        t = threading.Thread(target=lambda: results.append(
+            transport.download_archive('src', str(tmp_path / 'back'), window_size=65536)))
+        t.daemon = True
+        t.start()
+        t.join(10)
+        assert results and results[0]['code'] == 0
+    assert _read_tree(tmp_path / 'back') == files
+
+
+def test_download_archive_logs_stderr_on_failure(ssh_server, error_logger, tmp_path):
+    with SSHTransport(ssh_server.config, logger=error_logger) as transport:
+        result = transport.download_archive('missing', str(tmp_path / 'back'), compress=None)
+    assert result['code'] == -1
+    failed = [message for message in error_logger.messages if message.startswith('[Failed] download archive')]
+    assert len(failed) == 1
+    assert 'missing' in failed[0].split('stderr=', 1)[1]
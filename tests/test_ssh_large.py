@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import os
+from vm_components.common.transport import SSHTransport
+
+
+def _read(path):
+    with open(str(path), 'rb') as f:
+        return f.read()
+
+
+def test_upload_and_download_large(ssh_server, logger, tmp_path):
+    data = os.urandom(1000000 + 123)
+    (tmp_path / 'big.bin').write_bytes(data)
+    progress = []
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        result = transport.upload_large(str(tmp_path / 'big.bin'), 'big.bin', subdirectory='dst', block_size=100000,
+                                        max_channels=3, callback=lambda done, total: progress.append((done, total)))
+        assert (result['code'], result['bytes']) == (0, len(data))
+        assert _read(os.path.join(ssh_server.root, 'dst', 'big.bin')) == data
+        assert progress[-1] == (len(data), len(data))
+
+        result = transport.download_large('big.bin', str(tmp_path / 'back.bin'), subdirectory='dst',
+                                          block_size=100000, max_channels=3, callback=None)
+        assert (result['code'], result['bytes']) == (0, len(data))
+    assert _read(tmp_path / 'back.bin') == data
+    # 并发通道共用一个连接
+    assert ssh_server.stats()['connections'] == 1
+
+
+def test_large_transfer_empty_file(ssh_server, logger, tmp_path):
+    (tmp_path / 'empty.bin').write_bytes(b'')
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        assert transport.upload_large(str(tmp_path / 'empty.bin'), 'empty.bin', callback=None)['code'] == 0
+        assert transport.download_large('empty.bin', str(tmp_path / 'back.bin'), callback=None)['code'] == 0
+    assert _read(os.path.join(ssh_server.root, 'empty.bin')) == b''
+    assert _read(tmp_path / 'back.bin') == b''
+
+
+def test_download_large_missing_file(ssh_server, logger, tmp_path):
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        result = transport.download_large('missing.bin', str(tmp_path / 'back.bin'), callback=None)
+    assert result['code'] == -1
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import os
+import time
+import hashlib
+from vm_components.common.transport import SSHTransport
+
+BLOCK = 64 * 1024
+
+
+def _write(path, data, mtime=None):
+    with open(str(path), 'wb') as f:
+        f.write(data)
+    if mtime is not None:
+        os.utime(str(path), (mtime, mtime))
+
+
+def _read(path):
+    with open(str(path), 'rb') as f:
+        return f.read()
+
+
+def test_sync_skips_unchanged_and_uploads_new(ssh_server, logger, tmp_path):
+    src = tmp_path / 'src'
+    (src / 'sub').mkdir(parents=True)
+    _write(src / 'a.txt', b'a' * 100)
+    _write(src / 'sub' / 'b.txt', b'b' * 100)
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        result = transport.sync(str(src), 'dst', callback=None)
+        assert (result['code'], sorted(result['uploaded']), result['skipped']) == (0, ['a.txt', 'sub/b.txt'], 0)
+        result = transport.sync(str(src), 'dst', callback=None)
+        assert (result['uploaded'], result['delta'], result['skipped'], result['bytes']) == ([], [], 2, 0)
+        # 内容相同只是修改时间不同，只同步修改时间
+        os.utime(str(src / 'a.txt'), (time.time() + 100, time.time() + 100))
+        result = transport.sync(str(src), 'dst', callback=None)
+        assert (result['uploaded'], result['skipped'], result['bytes']) == ([], 2, 0)
+        os.remove(str(src / 'sub' / 'b.txt'))
+        result = transport.sync(str(src), 'dst', delete=True, callback=None)
+        assert result['deleted'] == ['sub/b.txt']
+    assert not os.path.exists(os.path.join(ssh_server.root, 'dst', 'sub', 'b.txt'))
+
+
+def test_sync_uploads_only_changed_blocks(ssh_server, logger, tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    data = bytearray(os.urandom(BLOCK * 5))
+    _write(src / 'big.bin', bytes(data), mtime=time.time() - 100)
+    remote = os.path.join(ssh_server.root, 'dst', 'big.bin')
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        assert transport.sync(str(src), 'dst', block_size=BLOCK, delta_threshold=0, callback=None)['uploaded'] == ['big.bin']
+        inode = os.stat(remote).st_ino
+        data[BLOCK * 2 + 10] ^= 0xff
+        data.extend(b'tail')
+        _write(src / 'big.bin', bytes(data))
+        result = transport.sync(str(src), 'dst', block_size=BLOCK, delta_threshold=0, callback=None)
+        assert (result['code'], result['delta'], result['uploaded']) == (0, ['big.bin'], [])
+        assert result['bytes'] == BLOCK + 4
+    assert _read(remote) == bytes(data)
+    assert int(os.stat(remote).st_mtime) == int(os.stat(str(src / 'big.bin')).st_mtime)
+    # 写入临时文件后替换，远程文件不会被原地修改
+    assert os.stat(remote).st_ino != inode
+    assert os.listdir(os.path.dirname(remote)) == ['big.bin']
+
+
+def test_sync_delta_truncates(ssh_server, logger, tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    data = os.urandom(BLOCK * 4)
+    _write(src / 'big.bin', data, mtime=time.time() - 100)
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        transport.sync(str(src), 'dst', block_size=BLOCK, delta_threshold=0, callback=None)
+        _write(src / 'big.bin', data[:BLOCK * 2 + 5])
+        result = transport.sync(str(src), 'dst', block_size=BLOCK, delta_threshold=0, callback=None)
+        assert (result['delta'], result['bytes']) == (['big.bin'], 5)
+    assert _read(os.path.join(ssh_server.root, 'dst', 'big.bin')) == data[:BLOCK * 2 + 5]
+
+
+def test_sync_delta_failure_keeps_remote_file(ssh_server, logger, tmp_path, monkeypatch):
+    src = tmp_path / 'src'
+    src.mkdir()
+    old = os.urandom(BLOCK * 3)
+    _write(src / 'big.bin', old, mtime=time.time() - 100)
+    remote = os.path.join(ssh_server.root, 'dst', 'big.bin')
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        transport.sync(str(src), 'dst', block_size=BLOCK, delta_threshold=0, callback=None)
+        new = old[:BLOCK] + os.urandom(BLOCK) + old[BLOCK * 2:]
+        _write(src / 'big.bin', new)
+
+        def _rename(oldpath, newpath):
+            assert _read(remote) == old
+            raise IOError('rename failed')
+        monkeypatch.setattr(transport.sftp, 'posix_rename', _rename)
+        result = transport.sync(str(src), 'dst', block_size=BLOCK, delta_threshold=0, callback=None)
+        # 分块上传失败后完整上传
+        assert (result['code'], result['delta'], result['uploaded']) == (0, [], ['big.bin'])
+    assert _read(remote) == new
+    assert os.listdir(os.path.dirname(remote)) == ['big.bin']
+
+
+def test_remote_digests_split_long_commands(ssh_server, logger):
+    paths = []
+    for i in range(30):
+        path = os.path.join(ssh_server.root, 'file with space {}.txt'.format(i))
+        _write(path, str(i).encode('ascii'))
+        paths.append(path)
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        digests = transport.remote_digests(paths, max_arg_length=300)
+        assert digests == dict((path, hashlib.sha256(str(i).encode('ascii')).hexdigest())
+                               for i, path in enumerate(paths))
+        exec_count = ssh_server.stats()['exec']
+        assert exec_count > 1
+        blocks = transport._remote_block_digests(paths, BLOCK, max_arg_length=600)
+        assert blocks == dict((path, [hashlib.sha1(str(i).encode('ascii')).hexdigest()])
+                              for i, path in enumerate(paths))
+        assert ssh_server.stats()['exec'] - exec_count > 1
+
+
+def test_remote_digests_special_names(ssh_server, logger):
+    names = ['back\\slash.txt', 'new\nline.txt', '*star.txt', ' lead and trail ', 'plain.txt']
+    paths = []
+    for i, name in enumerate(names):
+        path = os.path.join(ssh_server.root, name)
+        _write(path, str(i).encode('ascii'))
+        paths.append(path)
+    expected = dict((path, hashlib.md5(str(i).encode('ascii')).hexdigest()) for i, path in enumerate(paths))
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        assert transport.remote_digests(paths, algorithm='md5') == expected
+        assert transport.verify(expected, algorithm='md5')['code'] == 0
+
+
+def test_parse_digest_line():
+    parse = SSHTransport._parse_digest_line
+    assert parse('abc  name with  spaces ') == ('name with  spaces ', 'abc')
+    assert parse('abc *binary') == ('binary', 'abc')
+    assert parse('\\abc  a\\\\b\\nc\\rd') == ('a\\b\nc\rd', 'abc')
+    assert parse('abc') is None
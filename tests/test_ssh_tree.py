@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import os
+from vm_components.common.transport import SSHTransport
+
+
+def _make_tree(root):
+    files = {
+        'a.txt': b'a' * 10,
+        'empty.bin': b'',
+        'sub/b.bin': os.urandom(300000),
+        'sub/deep/c.txt': b'c' * 1000,
+    }
+    for rel, data in files.items():
+        path = os.path.join(str(root), *rel.split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+    os.makedirs(os.path.join(str(root), 'empty_dir'))
+    return files
+
+
+def _read_tree(root):
+    result = {}
+    for base, _, names in os.walk(str(root)):
+        for name in names:
+            path = os.path.join(base, name)
+            with open(path, 'rb') as f:
+                result[os.path.relpath(path, str(root)).replace(os.sep, '/')] = f.read()
+    return result
+
+
+def test_upload_and_download_tree(ssh_server, logger, tmp_path):
+    files = _make_tree(tmp_path / 'src')
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        result = transport.upload_tree(str(tmp_path / 'src'), 'dst', max_workers=3, callback=None, verify=True)
+        assert (result['code'], result['files'], result['failed'], result['mismatched']) == (0, 4, [], [])
+        assert result['bytes'] == sum(len(data) for data in files.values())
+        assert _read_tree(os.path.join(ssh_server.root, 'dst')) == files
+        assert os.path.isdir(os.path.join(ssh_server.root, 'dst', 'empty_dir'))
+
+        result = transport.download_tree('dst', str(tmp_path / 'back'), max_workers=3, callback=None, verify='md5')
+        assert (result['code'], result['files'], result['failed'], result['mismatched']) == (0, 4, [], [])
+    assert _read_tree(tmp_path / 'back') == files
+    assert os.path.isdir(str(tmp_path / 'back' / 'empty_dir'))
+    assert ssh_server.stats()['connections'] == 1
+
+
+def test_upload_tree_progress(ssh_server, logger, tmp_path):
+    files = _make_tree(tmp_path / 'src')
+    progress = []
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        transport.upload_tree(str(tmp_path / 'src'), 'dst', callback=lambda done, total: progress.append((done, total)))
+    total = sum(len(data) for data in files.values())
+    assert progress[-1] == (total, total)
+    assert [done for done, _ in progress] == sorted(done for done, _ in progress)
+
+
+def test_download_tree_missing_dir(ssh_server, logger, tmp_path):
+    with SSHTransport(ssh_server.config, logger=logger) as transport:
+        result = transport.download_tree('missing', str(tmp_path / 'back'), callback=None)
+    assert (result['code'], result['files']) == (-1, 0)
@@ -1 +1,4 @@
 from .request import Request
+from .async_request import AsyncRequest
+from .cache import DownloadCache, ResponseCache
+from .mirror import MirrorStats, MirrorSelector
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, Vinman, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.cub@gmail.com>
+
+import os
+import sys
+import stat
+import json
+import asyncio
+import logging
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncRequest(object):
+    def __init__(self, logger=None, concurrency=100, limit=100, limit_per_host=0, keep_alive=True):
+        """
+        异步网络请求类，接口和返回值与Request一致，所有请求共用一个连接池
+        依赖aiohttp
+
+        :param logger: 指定日志输出
+        :param concurrency: 同时进行的请求数上限
+        :param limit: 连接池的连接总数上限，0表示不限制
+        :param limit_per_host: 每个host的连接数上限，0表示不限制
+        :param keep_alive: 是否保持长连接
+        """
+        if aiohttp is None:
+            raise ImportError('AsyncRequest requires aiohttp, please install it first: pip install aiohttp')
+        self._concurrency = concurrency
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._keep_alive = keep_alive
+        self._session = None
+        self._semaphore = None
+        self._loop = None
+        if isinstance(logger, logging.Logger):
+            self.logger = logger
+        else:
+            self.logger = logging.Logger(__name__)
+            if not self.logger.handlers:
+                stream_hander = logging.StreamHandler(sys.stdout)
+                stream_hander.setLevel(logging.DEBUG)
+                self.logger.addHandler(stream_hander)
+            self.logger.setLevel(logging.DEBUG)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @property
+    def headers(self):
+        headers = {
+            'User-Agent': 'Mozilla/4.0 (compatible; MSIE 5.5; Windows NT)',
+        }
+        if not self._keep_alive:
+            headers['Connection'] = 'close'
+        return headers
+
+    def _check_loop(self):
+        # ClientSession和Semaphore绑定创建时的事件循环，在新的事件循环(如再次asyncio.run)中使用时重新创建
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._session = None
+            self._semaphore = None
+
+    @property
+    def session(self):
+        """
+        共享的ClientSession，在每个事件循环中首次使用时创建
+        """
+        self._check_loop()
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._limit, limit_per_host=self._limit_per_host,
+                                             force_close=not self._keep_alive)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    @property
+    def semaphore(self):
+        self._check_loop()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        return self._semaphore
+
+    async def close(self):
+        """
+        关闭ClientSession及其连接池
+        """
+        session, self._session = self._session, None
+        self._semaphore = None
+        self._loop = None
+        if session is not None and not session.closed:
+            await session.close()
+
+    @staticmethod
+    def _convert_kwargs(kwargs):
+        # 兼容requests风格的参数
+        kwargs.pop('stream', None)
+        timeout = kwargs.pop('timeout', None)
+        if timeout is not None and not isinstance(timeout, aiohttp.ClientTimeout):
+            if isinstance(timeout, (tuple, list)):
+                timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+            else:
+                timeout = aiohttp.ClientTimeout(total=timeout)
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        if 'allow_redirects' not in kwargs:
+            kwargs['allow_redirects'] = True
+        return kwargs
+
+    async def _request(self, method, url, **kwargs):
+        headers = self.headers
+        headers.update(kwargs.pop('headers', None) or {})
+        kwargs = self._convert_kwargs(kwargs)
+        async with self.semaphore:
+            r = await self.session.request(method, url, headers=headers, **kwargs)
+            try:
+                await r.read()
+            finally:
+                r.release()
+            return r
+
+    async def get(self, url, params=None, **kwargs):
+        """
+        Get请求
+
+        :param url: 要请求的URL
+        :param params: get请求的查询参数
+        :param kwargs: aiohttp.ClientSession.request的关键字参数(timeout支持requests风格的数字)
+        :return: (code, r)
+            code: 成功返回0，失败返回-1
+            r: 成功返回响应对象(内容已读取，可await r.text()/r.json())，失败返回None
+        """
+        try:
+            return 0, await self._request('GET', url, params=params, **kwargs)
+        except Exception as e:
+            self.logger.error('aiohttp get error, {}'.format(e))
+            return -1, None
+
+    async def post(self, url, data=None, json=None, **kwargs):
+        """
+        Post请求
+
+        :param url: 要请求的URL
+        :param data: 要post的数据，需要序列化，和json参数二选一
+        :param json: 要post的json数据，不需序列化，和data参数二选一
+        :param kwargs: aiohttp.ClientSession.request的关键字参数
+        :return: (code, r)
+            code: 成功返回0，失败返回-1
+            r: 成功返回响应对象，失败返回None
+        """
+        try:
+            return 0, await self._request('POST', url, data=data, json=json, **kwargs)
+        except Exception as e:
+            self.logger.error('aiohttp post error, {}'.format(e))
+            return -1, None
+
+    async def get_json_info(self, url, **kwargs):
+        """
+        请求URL获取JSON数据
+
+        :param url: 要请求的url
+        :param kwargs: get的关键字参数
+        :return: (code, info)
+            code: 0表示成功，-1表示请求异常，-2表示状态码不为200，-3表示json数据解析有问题
+            info: 字典(失败时info为{})
+        """
+        code, r = await self.get(url, **kwargs)
+        if code == 0:
+            if r.status == 200:
+                try:
+                    return 0, json.loads(await r.text())
+                except Exception as e:
+                    self.logger.error('json.loads error, {}'.format(e))
+                    return -3, {}
+            else:
+                self.logger.error('get_json_info failed, status_code={}'.format(r.status))
+                return -2, {}
+        return code, {}
+
+    async def download(self, url, target_path, target_name=None, use_cache=True, chunk_size=64 * 1024,
+                       write_size=1024 * 1024):
+        """
+        下载内容保存到指定路径
+        :param url: 要下载的URL
+        :param target_path: 保存目标文件夹
+        :param target_name: 保存目标文件名，默认使用从URL分割出来的名字
+        :param use_cache: 是否使用缓存，即保存的文件路径已经存在且大小一致则不重新下载，默认为True
+            响应没有Content-Length(如chunked)时长度未知，不使用缓存
+        :param chunk_size: 每次读取的字节数
+        :param write_size: 数据累积到该字节数后在线程池中写入文件，不阻塞事件循环
+        :return: (status，path)
+            status: 成功返回True，失败返回False
+            path: 成功返回保存的文件路径，失败返回None
+        """
+        if target_name is None:
+            target_name = url.split('/')[-1]
+        if not os.path.exists(target_path):
+            try:
+                os.makedirs(target_path)
+            except Exception as e:
+                self.logger.error('[Failed][Download] make dirs failed: {}'.format(e))
+                return False, None
+        target_file_path = os.path.abspath(os.path.join(target_path, target_name))
+        async with self.semaphore:
+            try:
+                r = await self.session.get(url, headers=self.headers, timeout=aiohttp.ClientTimeout(sock_connect=10, sock_read=10))
+            except Exception as e:
+                self.logger.error('aiohttp get error, {}'.format(e))
+                return False, None
+            try:
+                if r.status != 200:
+                    self.logger.error('download failed, status_code={}'.format(r.status))
+                    if os.path.exists(target_file_path):
+                        self.logger.info('[Success][Download] use cache {}, no check size'.format(target_name))
+                        return True, target_file_path
+                    return False, None
+                # chunked响应没有Content-Length，长度未知
+                length = r.headers.get('Content-Length')
+                length = int(length) if length is not None else None
+                if length is not None and os.path.exists(target_file_path):
+                    size = os.stat(target_file_path)[stat.ST_SIZE]
+                    if use_cache and size == length:
+                        self.logger.info('[Success][Download] use cache {}, check size={}'.format(target_name, length))
+                        return True, target_file_path
+                try:
+                    size = await self._save_stream(r, target_file_path, chunk_size, write_size)
+                except Exception as e:
+                    self.logger.error('[Failed][Download] save error: {}'.format(e))
+                    return False, None
+            finally:
+                r.release()
+        if length is None or length == size:
+            self.logger.info('[Success][Download] download {} success, size={}'.format(target_name, size))
+            return True, target_file_path
+        self.logger.info('[Failed][Download] download {} failed, {}/{}'.format(target_name, size, length))
+        if os.path.exists(target_file_path):
+            try:
+                os.remove(target_file_path)
+            except Exception as e:
+                self.logger.error('[Failed][Download] remove cache failed after download: {}'.format(e))
+        return False, None
+
+    @staticmethod
+    async def _save_stream(r, path, chunk_size, write_size):
+        """
+        接收响应内容写入文件，文件的打开、写入和关闭都在线程池中执行
+
+        :return: 写入的字节数
+        """
+        loop = asyncio.get_running_loop()
+        f = await loop.run_in_executor(None, open, path, 'wb')
+        size = 0
+        try:
+            buffer = []
+            buffered = 0
+            async for content in r.content.iter_chunked(chunk_size):
+                buffer.append(content)
+                buffered += len(content)
+                if buffered >= write_size:
+                    await loop.run_in_executor(None, f.write, b''.join(buffer))
+                    size += buffered
+                    buffer, buffered = [], 0
+            if buffer:
+                await loop.run_in_executor(None, f.write, b''.join(buffer))
+                size += buffered
+        finally:
+            await loop.run_in_executor(None, f.close)
+        return size
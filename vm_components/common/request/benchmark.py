@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, Vinman, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.cub@gmail.com>
+
+"""
+Request性能测试：对比每次请求新建连接和Session连接池两种模式
+
+用法:
+    python -m vm_components.common.request.benchmark
+    python -m vm_components.common.request.benchmark --url http://xxx.com/releases/updates.json -n 100 -t 8
+不指定--url时会在本地启动一个HTTP/1.1服务用于测试
+"""
+
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .request import Request
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    body = json.dumps({'version': '1.0.0', 'files': ['a', 'b', 'c']}).encode('utf-8')
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_local_server(host='127.0.0.1', port=0):
+    """
+    启动本地测试服务
+
+    :return: (server, url)
+    """
+    server = _ThreadingHTTPServer((host, port), _JsonHandler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server, 'http://{}:{}/updates.json'.format(*server.server_address[:2])
+
+
+def run(req, url, count, threads):
+    """
+    使用指定的Request实例请求count次
+
+    :return: {'total': 总耗时(秒), 'avg_ms': 平均每次耗时(毫秒), 'qps': 每秒请求数, 'failed': 失败次数}
+    """
+    failed = [0]
+    lock = threading.Lock()
+
+    def _once(_):
+        code, info = req.get_json_info(url, timeout=10)
+        if code != 0:
+            with lock:
+                failed[0] += 1
+
+    start = time.time()
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(_once, range(count)))
+    else:
+        for i in range(count):
+            _once(i)
+    total = time.time() - start
+    return {
+        'total': round(total, 4),
+        'avg_ms': round(total * 1000 / count, 3),
+        'qps': round(count / total, 2) if total > 0 else 0,
+        'failed': failed[0],
+    }
+
+
+def benchmark(url=None, count=200, threads=1):
+    """
+    对比两种模式的请求耗时
+
+    :param url: 请求的URL，为None则启动本地测试服务
+    :param count: 每种模式的请求次数
+    :param threads: 并发线程数，多个线程共用同一个Request实例
+    :return: {'per_call': {...}, 'session': {...}}
+    """
+    server = None
+    if url is None:
+        server, url = start_local_server()
+    logger = logging.getLogger(__name__)
+    try:
+        result = {'url': url, 'count': count, 'threads': threads}
+        result['per_call'] = run(Request(logger=logger), url, count, threads)
+        with Request(logger=logger, use_session=True, pool_maxsize=max(threads, 10)) as req:
+            result['session'] = run(req, url, count, threads)
+        return result
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Request benchmark: per-call connection vs pooled session')
+    parser.add_argument('--url', default=None, help='url to request, default start a local server')
+    parser.add_argument('-n', '--count', type=int, default=200, help='requests per mode')
+    parser.add_argument('-t', '--threads', type=int, default=1, help='concurrent threads')
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.url, args.count, args.threads), indent=2))
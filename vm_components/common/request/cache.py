@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, Vinman, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.cub@gmail.com>
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+
+class DownloadCache(object):
+    INDEX_NAME = 'index.json'
+
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024, flush_interval=30, logger=None):
+        """
+        下载缓存，缓存目录下保存文件内容和索引(index.json)
+        索引记录 URL -> {file, etag, last_modified, size, digest, atime}，
+        通过ETag/Last-Modified条件请求校验缓存，超过max_bytes时按最近最少使用淘汰
+
+        :param cache_dir: 缓存目录
+        :param max_bytes: 缓存总大小上限(字节)
+        :param flush_interval: 命中时只在内存中更新最近使用时间，距上次写索引超过该时间(秒)才写入index.json，
+            存入、删除缓存和flush时立即写入
+        :param logger: 指定日志输出
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._index = {}
+        self._dirty = False
+        self._saved = time.time()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'fallbacks': 0,
+            'stores': 0,
+            'evictions': 0,
+        }
+        if isinstance(logger, logging.Logger):
+            self.logger = logger
+        else:
+            self.logger = logging.Logger(__name__)
+            if not self.logger.handlers:
+                stream_hander = logging.StreamHandler(sys.stdout)
+                stream_hander.setLevel(logging.DEBUG)
+                self.logger.addHandler(stream_hander)
+            self.logger.setLevel(logging.DEBUG)
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self._load_index()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.cache_dir, self.INDEX_NAME)
+
+    @property
+    def total_bytes(self):
+        with self._lock:
+            return sum(entry['size'] for entry in self._index.values())
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except Exception as e:
+            self.logger.error('[DownloadCache] load index failed: {}'.format(e))
+            return
+        for url, entry in index.items():
+            path = os.path.join(self.cache_dir, entry.get('file', ''))
+            if os.path.isfile(path) and os.path.getsize(path) == entry.get('size'):
+                self._index[url] = entry
+
+    def _save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._index, f)
+            os.replace(tmp_path, self.index_path)
+            self._dirty = False
+            self._saved = time.time()
+        except Exception as e:
+            self.logger.error('[DownloadCache] save index failed: {}'.format(e))
+
+    def flush(self):
+        """
+        把命中时更新的最近使用时间写入index.json
+        """
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def path(self, entry):
+        return os.path.join(self.cache_dir, entry['file'])
+
+    def lookup(self, url):
+        """
+        查找缓存项
+
+        :return: 缓存项字典的拷贝，没有或缓存文件已失效返回None
+        """
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is None:
+                return None
+            path = self.path(entry)
+            if not os.path.isfile(path) or os.path.getsize(path) != entry['size']:
+                self._index.pop(url, None)
+                self._save_index()
+                return None
+            return dict(entry)
+
+    @staticmethod
+    def conditional_headers(entry):
+        """
+        根据缓存项生成条件请求头，服务器内容未变化时返回304
+        """
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def hit(self, url):
+        with self._lock:
+            self._stats['hits'] += 1
+            if url in self._index:
+                self._index[url]['atime'] = time.time()
+                self._dirty = True
+                if time.time() - self._saved >= self.flush_interval:
+                    self._save_index()
+
+    def miss(self, url):
+        with self._lock:
+            self._stats['misses'] += 1
+
+    def fallback(self, url):
+        with self._lock:
+            self._stats['fallbacks'] += 1
+
+    def copy_to(self, url, target_file_path, chunk_size=1024 * 1024, hasher=None):
+        """
+        把缓存文件拷贝到目标路径
+
+        :param hasher: hashlib对象，指定后在拷贝过程中计算摘要
+        :return: 成功返回True
+        """
+        entry = self.lookup(url)
+        if entry is None:
+            return False
+        tmp_path = target_file_path + '.tmp'
+        try:
+            with open(self.path(entry), 'rb') as src, open(tmp_path, 'wb') as dst:
+                while True:
+                    content = src.read(chunk_size)
+                    if not content:
+                        break
+                    if hasher is not None:
+                        hasher.update(content)
+                    dst.write(content)
+            if os.path.exists(target_file_path):
+                os.remove(target_file_path)
+            os.rename(tmp_path, target_file_path)
+            return True
+        except Exception as e:
+            self.logger.error('[DownloadCache] copy {} to {} failed: {}'.format(url, target_file_path, e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+    def store(self, url, file_path, etag=None, last_modified=None, digest=None, chunk_size=1024 * 1024):
+        """
+        把下载完成的文件存入缓存，没有ETag和Last-Modified的响应无法校验，不缓存
+        缓存保存单独的拷贝(不使用硬链接)，调用方之后修改下载的文件不会影响缓存内容
+
+        :param url: 文件URL
+        :param file_path: 下载完成的文件路径
+        :param etag: 响应头ETag
+        :param last_modified: 响应头Last-Modified
+        :param digest: 文件的sha256，为None时不记录(不为此再读取一遍文件)
+        :param chunk_size: 拷贝时每次读写的字节数
+        :return: 成功返回True
+        """
+        if not etag and not last_modified:
+            return False
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        path = os.path.join(self.cache_dir, name)
+        tmp_path = path + '.tmp'
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self._copy(file_path, tmp_path, chunk_size)
+            size = os.path.getsize(tmp_path)
+            with self._lock:
+                os.replace(tmp_path, path)
+                self._index[url] = {
+                    'file': name,
+                    'etag': etag,
+                    'last_modified': last_modified,
+                    'size': size,
+                    'digest': digest,
+                    'atime': time.time(),
+                }
+                self._stats['stores'] += 1
+                self._evict(keep=url)
+                self._save_index()
+            return True
+        except Exception as e:
+            self.logger.error('[DownloadCache] store {} failed: {}'.format(url, e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+    @staticmethod
+    def _copy(src_path, dst_path, chunk_size):
+        with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+            while True:
+                content = src.read(chunk_size)
+                if not content:
+                    break
+                dst.write(content)
+
+    def _evict(self, keep=None):
+        total = sum(entry['size'] for entry in self._index.values())
+        for url, entry in sorted(self._index.items(), key=lambda item: item[1]['atime']):
+            if total <= self.max_bytes:
+                break
+            if url == keep:
+                continue
+            try:
+                os.remove(self.path(entry))
+            except Exception as e:
+                self.logger.error('[DownloadCache] evict {} failed: {}'.format(url, e))
+            self._index.pop(url, None)
+            self._stats['evictions'] += 1
+            total -= entry['size']
+
+    def remove(self, url):
+        with self._lock:
+            entry = self._index.pop(url, None)
+            if entry is not None:
+                if os.path.exists(self.path(entry)):
+                    os.remove(self.path(entry))
+                self._save_index()
+
+    def clear(self):
+        with self._lock:
+            for url in list(self._index.keys()):
+                self.remove(url)
+
+    def stats(self):
+        """
+        缓存统计
+
+        :return: {'hits', 'misses', 'fallbacks', 'stores', 'evictions', 'entries', 'bytes', 'max_bytes'}
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._index)
+            stats['bytes'] = sum(entry['size'] for entry in self._index.values())
+            stats['max_bytes'] = self.max_bytes
+            return stats
+
+
+class _Flight(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+class ResponseCache(object):
+    def __init__(self, ttl=60, max_entries=256, stale_ttl=None, logger=None):
+        """
+        进程内响应缓存，按最近最少使用淘汰
+        过期(超过ttl)但仍在stale_ttl内的缓存项会直接返回旧值，同时在后台线程刷新；
+        同一个key的并发未命中只发起一次请求(single-flight)，其余调用等待该请求的结果
+
+        :param ttl: 缓存项有效时间(秒)
+        :param max_entries: 最大缓存项数
+        :param stale_ttl: 过期后仍可返回旧值的时间(秒)，None表示一直可用直到被淘汰，0表示不返回旧值
+        :param logger: 指定日志输出
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'evictions': 0,
+        }
+        if isinstance(logger, logging.Logger):
+            self.logger = logger
+        else:
+            self.logger = logging.Logger(__name__)
+            if not self.logger.handlers:
+                stream_hander = logging.StreamHandler(sys.stdout)
+                stream_hander.setLevel(logging.DEBUG)
+                self.logger.addHandler(stream_hander)
+            self.logger.setLevel(logging.DEBUG)
+
+    def _is_usable_stale(self, expire, now):
+        if self.stale_ttl is None:
+            return True
+        return now < expire + self.stale_ttl
+
+    def get(self, key, loader):
+        """
+        获取缓存值，未命中时调用loader加载
+
+        :param key: 缓存key
+        :param loader: 加载函数，返回(code, value)，只有code为0的结果会被缓存
+        :return: (code, value)，命中时value是缓存的同一个对象，调用方不要修改
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expire = entry
+                if now < expire:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return 0, value
+                if self._is_usable_stale(expire, now):
+                    self._entries.move_to_end(key)
+                    self._stats['stale_hits'] += 1
+                    if key not in self._flights:
+                        self._flights[key] = _Flight()
+                        self._stats['refreshes'] += 1
+                        t = threading.Thread(target=self._load, args=(key, loader, self._flights[key]))
+                        t.daemon = True
+                        t.start()
+                    return 0, value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._stats['misses'] += 1
+        if leader:
+            return self._load(key, loader, flight)
+        flight.event.wait()
+        return flight.result
+
+    def _load(self, key, loader, flight):
+        try:
+            flight.result = loader()
+        except Exception as e:
+            self.logger.error('[ResponseCache] load {} error: {}'.format(key, e))
+            flight.result = (-1, None)
+        with self._lock:
+            if flight.result[0] == 0:
+                self._entries[key] = (flight.result[1], time.time() + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats['evictions'] += 1
+            self._flights.pop(key, None)
+        flight.event.set()
+        return flight.result
+
+    def invalidate(self, key=None):
+        """
+        删除指定key的缓存，key为None时清空
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """
+        缓存统计
+
+        :return: {'hits', 'stale_hits', 'misses', 'refreshes', 'evictions', 'entries', 'max_entries'}
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['max_entries'] = self.max_entries
+            return stats
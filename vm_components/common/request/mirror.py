@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, Vinman, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.cub@gmail.com>
+
+import math
+import time
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MirrorStats(object):
+    def __init__(self, mirrors, window=50, failure_penalty=10):
+        """
+        镜像延迟统计，记录每个镜像最近window次请求的耗时和失败情况，用于镜像排序和计算对冲等待时间
+
+        :param mirrors: 等价的镜像基础URL列表，如['http://a.com/releases/', 'http://b.com/releases/']
+        :param window: 每个镜像保留的样本数
+        :param failure_penalty: 排序时失败率为100%的镜像额外增加的得分(秒)
+        """
+        self.mirrors = [self.normalize(mirror) for mirror in mirrors]
+        self.failure_penalty = failure_penalty
+        self._lock = threading.Lock()
+        self._latencies = dict((mirror, deque(maxlen=window)) for mirror in self.mirrors)
+        self._results = dict((mirror, deque(maxlen=window)) for mirror in self.mirrors)
+        self._pending = dict((mirror, []) for mirror in self.mirrors)
+
+    @staticmethod
+    def normalize(mirror):
+        return mirror if mirror.endswith('/') else mirror + '/'
+
+    def match(self, url):
+        """
+        查找URL所属的镜像
+
+        :return: (mirror, path)，不属于任何镜像时返回(None, url)
+        """
+        for mirror in self.mirrors:
+            if url.startswith(mirror):
+                return mirror, url[len(mirror):]
+        return None, url
+
+    def begin(self, mirror):
+        """
+        记录一次请求开始，请求未完成时其已耗时也参与排序，避免卡住的镜像因为没有样本一直被优先选择
+
+        :return: 开始时间，传给record
+        """
+        start = time.time()
+        with self._lock:
+            if mirror in self._pending:
+                self._pending[mirror].append(start)
+        return start
+
+    def record(self, mirror, latency=None, failed=False, start=None):
+        """
+        记录一次请求结果
+
+        :param mirror: 镜像基础URL
+        :param latency: 响应耗时(秒)，失败时可为None
+        :param failed: 是否失败
+        :param start: begin返回的开始时间
+        """
+        with self._lock:
+            if mirror not in self._results:
+                return
+            if start is not None and start in self._pending[mirror]:
+                self._pending[mirror].remove(start)
+            self._results[mirror].append(not failed)
+            if not failed and latency is not None:
+                self._latencies[mirror].append(latency)
+
+    @staticmethod
+    def _percentile(samples, pct):
+        samples = sorted(samples)
+        index = max(0, int(math.ceil(pct / 100.0 * len(samples))) - 1)
+        return samples[index]
+
+    def percentile(self, mirror, pct, min_samples=1):
+        """
+        镜像响应耗时的百分位数
+
+        :return: 秒，样本数不足min_samples时返回None
+        """
+        with self._lock:
+            samples = list(self._latencies.get(mirror, []))
+        if len(samples) < max(min_samples, 1):
+            return None
+        return self._percentile(samples, pct)
+
+    def failure_rate(self, mirror):
+        with self._lock:
+            results = self._results.get(mirror)
+            if not results:
+                return 0.0
+            return 1.0 - float(sum(results)) / len(results)
+
+    def score(self, mirror):
+        # 没有样本也没有进行中请求的镜像得分为0，会被优先尝试一次以获得样本
+        median = self.percentile(mirror, 50) or 0.0
+        with self._lock:
+            pending = self._pending.get(mirror)
+            elapsed = time.time() - min(pending) if pending else 0.0
+        failure_rate = self.failure_rate(mirror)
+        return max(median, elapsed) * (1 + 4 * failure_rate) + failure_rate * self.failure_penalty
+
+    def ordered(self):
+        """
+        按中位延迟和失败率排序后的镜像列表
+        """
+        scores = dict((mirror, self.score(mirror)) for mirror in self.mirrors)
+        return sorted(self.mirrors, key=lambda mirror: scores[mirror])
+
+    def stats(self):
+        """
+        镜像统计
+
+        :return: {mirror: {'samples', 'p50', 'p95', 'failure_rate'}}
+        """
+        result = {}
+        for mirror in self.mirrors:
+            with self._lock:
+                samples = len(self._latencies[mirror])
+            result[mirror] = {
+                'samples': samples,
+                'p50': self.percentile(mirror, 50),
+                'p95': self.percentile(mirror, 95),
+                'failure_rate': self.failure_rate(mirror),
+            }
+        return result
+
+
+class MirrorSelector(object):
+    def __init__(self, mirrors, ttl=300, probe_bytes=64 * 1024, timeout=5, stats=None, max_entries=256):
+        """
+        镜像测速选择器，并发向各镜像发送HEAD请求测量RTT，再用小范围的Range GET测量吞吐量，
+        按吞吐量排序选出最快的下载源，排序结果按路径缓存ttl秒
+
+        :param mirrors: 等价的镜像基础URL列表
+        :param ttl: 排序结果的缓存时间(秒)
+        :param probe_bytes: 测量吞吐量时下载的字节数
+        :param timeout: 单个镜像测速的超时(秒)
+        :param stats: MirrorStats，指定后测得的RTT会记录到其中
+        :param max_entries: 最多缓存的路径数，超过时淘汰最久未使用的
+        """
+        self.mirrors = [MirrorStats.normalize(mirror) for mirror in mirrors]
+        self.ttl = ttl
+        self.probe_bytes = probe_bytes
+        self.timeout = timeout
+        self.stats = stats
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._rankings = OrderedDict()
+
+    def _probe_one(self, mirror, path, send):
+        url = mirror + path
+        result = {'mirror': mirror, 'ok': False, 'rtt': None, 'throughput': None, 'ranges': False,
+                  'length': None, 'etag': None, 'last_modified': None}
+        try:
+            start = time.time()
+            r = send('HEAD', url, timeout=self.timeout, allow_redirects=True)
+            rtt = time.time() - start
+            r.close()
+            if r.status_code >= 400:
+                return result
+            result['rtt'] = rtt
+            result['ranges'] = r.headers.get('Accept-Ranges', '').lower() == 'bytes'
+            # 用于确认各镜像上是同一个文件
+            length = r.headers.get('Content-Length')
+            result['length'] = int(length) if length is not None and length.isdigit() else None
+            result['etag'] = r.headers.get('ETag')
+            result['last_modified'] = r.headers.get('Last-Modified')
+            if self.stats is not None:
+                self.stats.record(mirror, rtt)
+            start = time.time()
+            r = send('GET', url, headers={'Range': 'bytes=0-{}'.format(self.probe_bytes - 1)},
+                     stream=True, timeout=self.timeout)
+            size = 0
+            try:
+                if r.status_code >= 400:
+                    return result
+                # 服务器忽略Range时只读取probe_bytes
+                for content in r.iter_content(16 * 1024):
+                    size += len(content)
+                    if size >= self.probe_bytes:
+                        break
+            finally:
+                r.close()
+            result['throughput'] = size / max(time.time() - start, 1e-6)
+            result['ranges'] = result['ranges'] or r.status_code == 206
+            result['ok'] = True
+        except Exception:
+            if self.stats is not None:
+                self.stats.record(mirror, failed=True)
+        return result
+
+    def probe(self, path, send):
+        """
+        并发测速所有镜像
+
+        :param path: 用于测速的文件在镜像下的相对路径
+        :param send: 发送请求的函数，send(method, url, **kwargs)返回requests.Response
+        :return: 测速结果列表 [{'mirror', 'ok', 'rtt', 'throughput'(字节/秒), 'ranges'(是否支持Range),
+            'length', 'etag', 'last_modified'(HEAD响应的Content-Length/ETag/Last-Modified)}]
+        """
+        with ThreadPoolExecutor(max_workers=len(self.mirrors)) as executor:
+            return list(executor.map(lambda mirror: self._probe_one(mirror, path, send), self.mirrors))
+
+    def rank(self, path, send, refresh=False):
+        """
+        镜像排序，该路径的缓存未过期时直接返回缓存结果
+
+        :param path: 用于测速的文件在镜像下的相对路径
+        :param send: 发送请求的函数
+        :param refresh: 是否忽略缓存重新测速
+        :return: 可用镜像的测速结果列表，按吞吐量从高到低排序
+        """
+        with self._lock:
+            item = self._rankings.get(path)
+            if not refresh and item is not None and time.time() < item[0]:
+                self._rankings.move_to_end(path)
+                return item[1]
+        results = [result for result in self.probe(path, send) if result['ok']]
+        results.sort(key=lambda result: (-result['throughput'], result['rtt']))
+        if results:
+            with self._lock:
+                self._rankings.pop(path, None)
+                self._rankings[path] = (time.time() + self.ttl, results)
+                while len(self._rankings) > self.max_entries:
+                    self._rankings.popitem(last=False)
+        return results
+
+    def invalidate(self, path=None):
+        """
+        删除指定路径的排序缓存，path为None时清空
+        """
+        with self._lock:
+            if path is None:
+                self._rankings.clear()
+            else:
+                self._rankings.pop(path, None)
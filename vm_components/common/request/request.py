@@ -12,12 +12,61 @@ import sys
 import stat
 import json
 import shutil
+import time
+import hashlib
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import requests
+from requests.compat import urlparse
+from requests.adapters import HTTPAdapter
+from .cache import DownloadCache, ResponseCache
+from .mirror import MirrorStats, MirrorSelector
 
 
 class Request(object):
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, use_session=False, pool_connections=10, pool_maxsize=10,
+                 keep_alive=True, max_retries=0, cache_dir=None, cache_max_bytes=1024 * 1024 * 1024,
+                 json_cache_ttl=None, json_cache_max_entries=256, json_cache_stale_ttl=None,
+                 mirrors=None, hedge_delay=1.0, hedge_percentile=95, hedge_workers=16, mirror_timeout=30,
+                 mirror_probe_ttl=300):
+        """
+        网络请求类
+
+        :param logger: 指定日志输出
+        :param use_session: 是否使用共享的Session(连接池)，默认False，即每次请求都新建连接
+        :param pool_connections: Session模式下缓存的连接池个数(每个host一个连接池)
+        :param pool_maxsize: Session模式下每个连接池(host)保持的最大连接数
+        :param keep_alive: 是否保持长连接，为False时请求头带上Connection: close
+        :param max_retries: Session模式下连接失败的重试次数
+        :param cache_dir: 下载缓存目录，指定后download通过ETag/Last-Modified条件请求校验缓存
+        :param cache_max_bytes: 下载缓存总大小上限(字节)，超过后按最近最少使用淘汰
+        :param json_cache_ttl: get_json_info结果的缓存时间(秒)，默认None不缓存
+        :param json_cache_max_entries: get_json_info最大缓存项数
+        :param json_cache_stale_ttl: 缓存过期后仍返回旧值并在后台刷新的时间(秒)，None表示不限
+        :param mirrors: 等价的镜像基础URL列表，以其中任一镜像开头的GET/HEAD请求会按镜像延迟排序后对冲请求:
+            先请求最优的镜像，超过对冲等待时间仍未响应时再请求下一个镜像，使用最先响应的结果，失败时立即切换下一个镜像
+        :param hedge_delay: 对冲等待时间(秒)的初始值，镜像样本不足时使用
+        :param hedge_percentile: 对冲等待时间取首选镜像响应耗时的百分位数
+        :param hedge_workers: 对冲请求的线程池大小
+        :param mirror_timeout: 镜像请求没有指定timeout时使用的默认超时(秒)
+        :param mirror_probe_ttl: download测速选择镜像的结果缓存时间(秒)
+        """
+        self._use_session = use_session
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._keep_alive = keep_alive
+        self._max_retries = max_retries
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._hedge_delay = hedge_delay
+        self._hedge_percentile = hedge_percentile
+        self._hedge_workers = hedge_workers
+        self._mirror_timeout = mirror_timeout
+        self._hedge_executor = None
+        self.mirror_stats = MirrorStats(mirrors) if mirrors else None
+        self.mirror_selector = MirrorSelector(mirrors, ttl=mirror_probe_ttl, stats=self.mirror_stats) if mirrors else None
         if isinstance(logger, logging.Logger):
             self.logger = logger
         else:
@@ -28,12 +77,186 @@ class Request(object):
                 stream_hander.setLevel(logging.DEBUG)
                 self.logger.addHandler(stream_hander)
             self.logger.setLevel(logging.DEBUG)
+        self.download_cache = DownloadCache(cache_dir, max_bytes=cache_max_bytes, logger=self.logger) if cache_dir else None
+        self.json_cache = ResponseCache(ttl=json_cache_ttl, max_entries=json_cache_max_entries,
+                                        stale_ttl=json_cache_stale_ttl, logger=self.logger) if json_cache_ttl else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     @property
     def headers(self):
-        return {
+        headers = {
             'User-Agent': 'Mozilla/4.0 (compatible; MSIE 5.5; Windows NT)',
         }
+        if not self._keep_alive:
+            headers['Connection'] = 'close'
+        return headers
+
+    @property
+    def session(self):
+        """
+        共享的Session，惰性创建，多线程共用同一个Request实例时也只会创建一个
+        
+        :return: use_session为False时返回None
+        """
+        if not self._use_session:
+            return None
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self._pool_connections,
+                                          pool_maxsize=self._pool_maxsize,
+                                          max_retries=self._max_retries)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    def close(self):
+        """
+        关闭Session及其连接池，并把下载缓存的最近使用时间写入索引
+        """
+        if self.download_cache is not None:
+            self.download_cache.flush()
+        with self._session_lock:
+            session, self._session = self._session, None
+            executor, self._hedge_executor = self._hedge_executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        if session is not None:
+            try:
+                session.close()
+            except Exception as e:
+                self.logger.error('session close error, {}'.format(e))
+
+    def _send(self, method, url, **kwargs):
+        session = self.session
+        if session is not None:
+            return session.request(method, url, **kwargs)
+        return requests.request(method, url, **kwargs)
+
+    def _request(self, method, url, **kwargs):
+        hedge = kwargs.pop('hedge', True)
+        if hedge and self.mirror_stats is not None and method in ('GET', 'HEAD'):
+            mirror, path = self.mirror_stats.match(url)
+            if mirror is not None:
+                kwargs.setdefault('timeout', self._mirror_timeout)
+                return self._hedged_request(method, path, **kwargs)
+        return self._send(method, url, **kwargs)
+
+    @property
+    def hedge_executor(self):
+        if self._hedge_executor is None:
+            with self._session_lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(max_workers=self._hedge_workers)
+        return self._hedge_executor
+
+    def hedge_delay(self, mirror):
+        """
+        对冲等待时间，取镜像最近响应耗时的hedge_percentile百分位数，样本不足时使用hedge_delay
+        """
+        delay = self.mirror_stats.percentile(mirror, self._hedge_percentile, min_samples=5)
+        return self._hedge_delay if delay is None else delay
+
+    def _timed_send(self, mirror, method, url, **kwargs):
+        start = self.mirror_stats.begin(mirror)
+        try:
+            r = self._send(method, url, **kwargs)
+        except Exception:
+            self.mirror_stats.record(mirror, failed=True, start=start)
+            raise
+        self.mirror_stats.record(mirror, time.time() - start, failed=r.status_code >= 500, start=start)
+        return r
+
+    def _probe_send(self, method, url, **kwargs):
+        headers = self.headers
+        headers.update(kwargs.pop('headers', {}))
+        return self._send(method, url, headers=headers, **kwargs)
+
+    def select_sources(self, url, refresh=False):
+        """
+        测速选择下载源
+
+        :param url: 要下载的URL
+        :param refresh: 是否忽略缓存重新测速
+        :return: 按吞吐量排序的等价URL测速结果 [{'url', 'mirror', 'rtt', 'throughput', 'ranges'}]，
+            URL不属于任何镜像或全部测速失败时返回空列表
+        """
+        if self.mirror_selector is None:
+            return []
+        mirror, path = self.mirror_stats.match(url)
+        if mirror is None:
+            return []
+        sources = []
+        for result in self.mirror_selector.rank(path, self._probe_send, refresh=refresh):
+            source = dict(result)
+            source['url'] = result['mirror'] + path
+            sources.append(source)
+        return sources
+
+    @staticmethod
+    def _close_response(future):
+        try:
+            if not future.cancelled() and future.exception() is None:
+                future.result().close()
+        except Exception:
+            pass
+
+    def _hedged_request(self, method, path, **kwargs):
+        """
+        对冲请求，依次向排序后的镜像发起请求，返回最先得到的有效响应，其余请求被取消或在完成后关闭
+        """
+        mirrors = self.mirror_stats.ordered()
+        futures = {}
+        error = None
+        index = 0
+        while True:
+            if index < len(mirrors) and (not futures or error is not None):
+                # 首次请求或上一个镜像失败时立即请求下一个镜像
+                error = None
+                mirror = mirrors[index]
+                index += 1
+                futures[self.hedge_executor.submit(self._timed_send, mirror, method, mirror + path, **kwargs)] = mirror
+            if not futures:
+                break
+            # 对冲等待时间以首选镜像为准，不受后面较慢镜像的统计影响
+            timeout = self.hedge_delay(mirrors[0]) if index < len(mirrors) else None
+            done, _ = wait(list(futures.keys()), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                mirror = mirrors[index]
+                index += 1
+                self.logger.debug('[Hedge] no response after {:.3f}s, request {}'.format(timeout, mirror + path))
+                futures[self.hedge_executor.submit(self._timed_send, mirror, method, mirror + path, **kwargs)] = mirror
+                continue
+            for future in done:
+                mirror = futures.pop(future)
+                try:
+                    r = future.result()
+                except Exception as e:
+                    self.logger.error('[Hedge] {} error, {}'.format(mirror + path, e))
+                    error = e
+                    continue
+                if r.status_code >= 500 and (futures or index < len(mirrors)):
+                    self.logger.error('[Hedge] {} status_code={}'.format(mirror + path, r.status_code))
+                    r.close()
+                    error = r.status_code
+                    continue
+                for other in futures:
+                    other.cancel()
+                    other.add_done_callback(self._close_response)
+                for other in done:
+                    if other is not future:
+                        self._close_response(other)
+                return r
+        if isinstance(error, Exception):
+            raise error
+        raise requests.ConnectionError('all mirrors failed: {}'.format(path))
 
     def get(self, url, params=None, **kwargs):
         """
@@ -41,7 +264,7 @@ class Request(object):
         
         :param url: 要请求的URL
         :param params: get请求的查询参数
-        :param kwargs: requests.get方法的关键字参数
+        :param kwargs: requests.get方法的关键字参数，另外支持hedge=False不使用镜像对冲
         :return: (code, r)
             code: 成功返回0，失败返回-1
             r: 成功返回请求对象，失败返回None
@@ -49,7 +272,7 @@ class Request(object):
         try:
             headers = self.headers
             headers.update(kwargs.pop('headers', {}))
-            r = requests.get(url=url, params=params, headers=headers, **kwargs)
+            r = self._request('GET', url, params=params, headers=headers, **kwargs)
             return 0, r
         except Exception as e:
             self.logger.error('requests.get error, {}'.format(e))
@@ -70,21 +293,29 @@ class Request(object):
         try:
             headers = self.headers
             headers.update(kwargs.pop('headers', {}))
-            return 0, requests.post(url=url, data=data, json=json, headers=headers, **kwargs)
+            return 0, self._request('POST', url, data=data, json=json, headers=headers, **kwargs)
         except Exception as e:
             self.logger.error('requests.post error, {}'.format(e))
             return -1, None
 
-    def get_json_info(self, url, **kwargs):
+    def get_json_info(self, url, use_cache=True, **kwargs):
         """
         请求URL获取JSON数据
         
         :param url: 要请求的url
+        :param use_cache: 指定了json_cache_ttl时是否使用缓存(按url和params缓存)，默认True
         :param kwargs: requests.get的关键字参数
         :return: (code, info)
             code: 0表示成功，-1表示请求异常，-2表示状态码不为200，-3表示json数据解析有问题
-            info: 字典(失败时info为{})
+            info: 字典(失败时info为{})，使用缓存时多次调用返回的是同一个对象，不要修改
         """
+        if use_cache and self.json_cache is not None:
+            key = requests.Request('GET', url, params=kwargs.get('params')).prepare().url
+            code, info = self.json_cache.get(key, lambda: self._get_json_info(url, **kwargs))
+            return code, info if code == 0 else {}
+        return self._get_json_info(url, **kwargs)
+
+    def _get_json_info(self, url, **kwargs):
         code, r = self.get(url, **kwargs)
         if code == 0:
             if r.status_code == 200:
@@ -101,13 +332,31 @@ class Request(object):
                 return -2, {}
         return code, {}
 
-    def download(self, url, target_path, target_name=None, use_cache=True):
+    def download(self, url, target_path, target_name=None, use_cache=True, segments=1, segment_size=None,
+                 resume=False, digest=None, digest_type='sha256', chunk_size=64 * 1024, preallocate=True,
+                 mirror_spread=1):
         """
         下载内容保存到指定路径
         :param url: 要下载的URL
         :param target_path: 保存目标文件夹
         :param target_name: 保存目标文件名，默认使用从URL分割出来的名字
-        :param use_cache: 是否使用缓存，即保存的文件路径已经存在则不重新下载，默认为True
+        :param use_cache: 是否使用缓存，默认为True
+            指定了cache_dir时通过条件请求校验下载缓存，服务器返回304时直接使用缓存内容；
+            否则保存的文件已存在且大小和Content-Length一致时不重新下载
+        :param segments: 分段下载的并发连接数，大于1且服务器支持Range(Accept-Ranges: bytes)时启用分段下载，
+            否则使用单连接流式下载
+        :param segment_size: 每段的字节数，默认按segments平均分段
+        :param resume: 是否断点续传，默认False
+            启用后先写入target_name.part，同时在target_name.part.json记录url/ETag/Last-Modified/长度，
+            下次调用时通过Range + If-Range从断点继续下载，下载完成后才重命名为目标文件(此模式不分段)
+        :param digest: 期望的文件摘要(十六进制字符串)，指定后在下载过程中增量计算并校验，不一致视为下载失败
+            分段下载时各段乱序写入，在下载完成后再读取文件计算；续传时需先读取已下载的部分
+        :param digest_type: 摘要算法，hashlib支持的名字，如sha256/md5
+        :param chunk_size: 每次读取写入的字节数
+        :param preallocate: 已知文件长度时是否预分配目标文件空间(续传模式不预分配)
+        :param mirror_spread: 配置了mirrors时，分段下载分散到测速最快的几个镜像
+            (需镜像支持Range，且测速时的长度和ETag/Last-Modified与下载源一致)
+            配置了mirrors时下载前会测速选择吞吐量最高的镜像作为下载源，测速失败时使用镜像对冲
         :return: (status，path)
             status: 成功返回True，失败返回False
             path: 成功返回保存的文件路径，失败返回None
@@ -119,21 +368,41 @@ class Request(object):
                 os.makedirs(target_path)
             except Exception as e:
                 self.logger.error('[Failed][Download] make dirs failed: {}'.format(e))
-                return False
+                return False, None
         target_file_path = os.path.abspath(os.path.join(target_path, target_name))
-        code, r = self.get(url, stream=True, timeout=10)
+        cache = self.download_cache if use_cache else None
+        entry = cache.lookup(url) if cache is not None else None
+        cache_headers = DownloadCache.conditional_headers(entry)
+        sources = self.select_sources(url)
+        source_url = sources[0]['url'] if sources else url
+        if resume:
+            return self._download_resume(url, target_file_path, target_name, use_cache, cache_headers,
+                                         digest=digest, digest_type=digest_type, chunk_size=chunk_size,
+                                         source_url=source_url)
+        code, r = self.get(source_url, headers=cache_headers, stream=True, timeout=10, hedge=not sources)
         if code == 0:
+            if r.status_code == 304 and entry is not None:
+                r.close()
+                return self._use_download_cache(url, target_file_path, target_name,
+                                                digest=digest, digest_type=digest_type)
             if r.status_code != 200:
                 self.logger.error('download failed, status_code={}'.format(r.status_code))
                 r.close()
+                if entry is not None:
+                    cache.fallback(url)
+                    return self._use_download_cache(url, target_file_path, target_name, validated=False,
+                                                    digest=digest, digest_type=digest_type)
                 if os.path.exists(target_file_path):
                     self.logger.info('[Success][Download] use cache {}, no check size'.format(target_name))
                     return True, target_file_path
                 return False, None
             length = int(r.headers['Content-Length'])
+            if cache is not None:
+                cache.miss(url)
             if os.path.exists(target_file_path):
                 size = os.stat(target_file_path)[stat.ST_SIZE]
-                if use_cache and size == length:
+                if use_cache and cache is None and size == length and \
+                        (digest is None or self._file_digest(target_file_path, digest_type, chunk_size) == digest.lower()):
                     r.close()
                     self.logger.info('[Success][Download] use cache {}, check size={}'.format(target_name, length))
                     return True, target_file_path
@@ -143,20 +412,38 @@ class Request(object):
                     except Exception as e:
                         self.logger.error('[Failed][Download] remove cache failed before download: {}'.format(e))
 
-            try:
-                with open(target_file_path, 'wb') as f:
-                    for content in r.iter_content(1024):
-                        f.write(content)
-            except Exception as e:
-                self.logger.error('[Failed][Download] save error: {}'.format(e))
-                return False, None
-            r.close()
-            size = os.stat(target_file_path)[stat.ST_SIZE]
-            if length == size:
+            if segments > 1 and length > 0 and self._accept_ranges(r):
+                r.close()
+                segment_sources = self._segment_sources(source_url, r, length, sources[:mirror_spread])
+                if not self._download_segments(segment_sources, target_file_path, length, segments, segment_size,
+                                               chunk_size):
+                    self._remove_file(target_file_path)
+                    return False, None
+                size = length
+                actual_digest = self._file_digest(target_file_path, digest_type, chunk_size) if digest else None
+            else:
+                hasher = hashlib.new(digest_type) if digest else None
+                try:
+                    with open(target_file_path, 'wb') as f:
+                        if preallocate and length > 0:
+                            self._preallocate(f, length)
+                        size = self._write_stream(r, f, chunk_size, hasher)
+                except Exception as e:
+                    self.logger.error('[Failed][Download] save error: {}'.format(e))
+                    self._remove_file(target_file_path)
+                    return False, None
+                finally:
+                    r.close()
+                actual_digest = hasher.hexdigest() if hasher else None
+            if length == size and self._check_digest(target_name, digest, actual_digest):
                 self.logger.info('[Success][Download] download {} success, size={}'.format(target_name, length))
+                if cache is not None:
+                    cache.store(url, target_file_path, r.headers.get('ETag'), r.headers.get('Last-Modified'),
+                                digest=actual_digest if digest_type == 'sha256' else None, chunk_size=chunk_size)
                 return True, target_file_path
             else:
-                self.logger.info('[Failed][Download] download {} failed, {}/{}'.format(target_name, size, length))
+                if length != size:
+                    self.logger.info('[Failed][Download] download {} failed, {}/{}'.format(target_name, size, length))
                 if os.path.exists(target_file_path):
                     try:
                         os.remove(target_file_path)
@@ -167,6 +454,350 @@ class Request(object):
         else:
             return False, None
 
+    def download_many(self, items, target_path=None, max_workers=8, max_per_host=4, **kwargs):
+        """
+        生成器，批量并发下载，按完成顺序返回每一项的结果
+        
+        :param items: 下载项列表，每项为URL字符串或download的关键字参数字典(必须包含url)
+        :param target_path: 默认的保存目标文件夹，下载项没有指定target_path时使用
+        :param max_workers: 同时进行的下载总数上限，小于1时按1处理
+        :param max_per_host: 每个host同时进行的下载数上限，小于1时按1处理，Session模式下pool_maxsize应不小于该值
+        :param kwargs: 所有下载项默认的download关键字参数(use_cache/segments/resume等)，下载项中的同名参数优先
+        :return: (item, (status, path))
+            item: 传入的下载项
+            status, path: 和download的返回值一致
+        """
+        max_workers = max(1, max_workers)
+        max_per_host = max(1, max_per_host)
+        pending = deque()
+        for item in items:
+            params = dict(kwargs)
+            params.update({'url': item} if isinstance(item, str) else item)
+            params.setdefault('target_path', target_path)
+            if params['target_path'] is None:
+                self.logger.error('[Failed][Download] no target_path for {}'.format(params['url']))
+                yield item, (False, None)
+                continue
+            pending.append((item, params, urlparse(params['url']).netloc))
+        running = {}
+        host_count = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                for _ in range(len(pending)):
+                    if len(running) >= max_workers:
+                        break
+                    item, params, host = pending.popleft()
+                    if host_count.get(host, 0) >= max_per_host:
+                        pending.append((item, params, host))
+                        continue
+                    host_count[host] = host_count.get(host, 0) + 1
+                    running[executor.submit(self.download, **params)] = (item, host)
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    item, host = running.pop(future)
+                    host_count[host] -= 1
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self.logger.error('[Failed][Download] {} error: {}'.format(item, e))
+                        result = (False, None)
+                    if not isinstance(result, tuple):
+                        result = (bool(result), None)
+                    yield item, result
+
+    def _load_part_meta(self, meta_path, part_path, url):
+        if not os.path.exists(meta_path) or not os.path.exists(part_path):
+            return None
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        except Exception as e:
+            self.logger.error('[Download] load resume meta failed: {}'.format(e))
+            return None
+        if meta.get('url') != url or not (meta.get('etag') or meta.get('last_modified')):
+            return None
+        return meta
+
+    def _use_download_cache(self, url, target_file_path, target_name, validated=True, digest=None, digest_type='sha256'):
+        hasher = hashlib.new(digest_type) if digest else None
+        if not self.download_cache.copy_to(url, target_file_path, hasher=hasher):
+            return False, None
+        if not self._check_digest(target_name, digest, hasher.hexdigest() if hasher else None):
+            self.download_cache.remove(url)
+            self._remove_file(target_file_path)
+            return False, None
+        if validated:
+            self.download_cache.hit(url)
+            self.logger.info('[Success][Download] use cache {}, not modified'.format(target_name))
+        else:
+            self.logger.info('[Success][Download] use cache {}, not validated'.format(target_name))
+        return True, target_file_path
+
+    def _download_resume(self, url, target_file_path, target_name, use_cache, cache_headers=None,
+                         digest=None, digest_type='sha256', chunk_size=64 * 1024, source_url=None):
+        """
+        断点续传下载，数据先写入.part文件，完成后再重命名为目标文件
+        """
+        cache = self.download_cache if use_cache else None
+        part_path = target_file_path + '.part'
+        meta_path = part_path + '.json'
+        meta = self._load_part_meta(meta_path, part_path, url)
+        offset = os.stat(part_path)[stat.ST_SIZE] if meta else 0
+        headers = dict(cache_headers or {})
+        if offset > 0:
+            headers['Range'] = 'bytes={}-'.format(offset)
+            headers['If-Range'] = meta.get('etag') or meta.get('last_modified')
+        code, r = self.get(source_url or url, headers=headers, stream=True, timeout=10, hedge=source_url in (None, url))
+        if code != 0:
+            return False, None
+        if r.status_code == 304 and cache_headers:
+            r.close()
+            self._remove_file(part_path)
+            self._remove_file(meta_path)
+            return self._use_download_cache(url, target_file_path, target_name, digest=digest, digest_type=digest_type)
+        if r.status_code == 416 and offset > 0:
+            # 续传位置无效(服务器文件已变短或.part已完整但未重命名)，清理后重新下载
+            r.close()
+            if offset == meta.get('length') and \
+                    (digest is None or self._file_digest(part_path, digest_type, chunk_size) == digest.lower()):
+                return self._finish_part(part_path, meta_path, target_file_path, target_name, offset)
+            self._remove_file(part_path)
+            self._remove_file(meta_path)
+            return self._download_resume(url, target_file_path, target_name, use_cache, cache_headers,
+                                         digest=digest, digest_type=digest_type, chunk_size=chunk_size)
+        if r.status_code == 206 and offset > 0:
+            content_range = r.headers.get('Content-Range', '')
+            length = meta.get('length')
+            if not content_range.startswith('bytes {}-'.format(offset)) or not content_range.endswith('/{}'.format(length)):
+                self.logger.error('[Failed][Download] unexpected Content-Range: {}'.format(content_range))
+                r.close()
+                return False, None
+            mode = 'ab'
+            # 续传时摘要需要包含已下载的部分
+            hasher = self._file_digest(part_path, digest_type, chunk_size, hexdigest=False) if digest else None
+            self.logger.info('[Download] resume {} from {}/{}'.format(target_name, offset, length))
+        elif r.status_code == 200:
+            length = int(r.headers['Content-Length'])
+            if cache is not None:
+                cache.miss(url)
+            if os.path.exists(target_file_path):
+                if use_cache and cache is None and os.stat(target_file_path)[stat.ST_SIZE] == length and \
+                        (digest is None or self._file_digest(target_file_path, digest_type, chunk_size) == digest.lower()):
+                    r.close()
+                    self.logger.info('[Success][Download] use cache {}, check size={}'.format(target_name, length))
+                    return True, target_file_path
+            offset = 0
+            mode = 'wb'
+            hasher = hashlib.new(digest_type) if digest else None
+            meta = {
+                'url': url,
+                'etag': r.headers.get('ETag'),
+                'last_modified': r.headers.get('Last-Modified'),
+                'length': length,
+            }
+            try:
+                with open(meta_path, 'w') as f:
+                    json.dump(meta, f)
+            except Exception as e:
+                self.logger.error('[Failed][Download] save resume meta error: {}'.format(e))
+        else:
+            self.logger.error('download failed, status_code={}'.format(r.status_code))
+            r.close()
+            if cache is not None and cache_headers:
+                cache.fallback(url)
+                return self._use_download_cache(url, target_file_path, target_name, validated=False,
+                                                digest=digest, digest_type=digest_type)
+            if os.path.exists(target_file_path):
+                self.logger.info('[Success][Download] use cache {}, no check size'.format(target_name))
+                return True, target_file_path
+            return False, None
+        try:
+            with open(part_path, mode) as f:
+                self._write_stream(r, f, chunk_size, hasher)
+        except Exception as e:
+            # 保留.part和元数据，下次调用时续传
+            self.logger.error('[Failed][Download] save error, keep {} for resume: {}'.format(part_path, e))
+            return False, None
+        finally:
+            r.close()
+        size = os.stat(part_path)[stat.ST_SIZE]
+        if size != length:
+            self.logger.info('[Failed][Download] download {} interrupted, {}/{}'.format(target_name, size, length))
+            if size > length:
+                self._remove_file(part_path)
+                self._remove_file(meta_path)
+            return False, None
+        if not self._check_digest(target_name, digest, hasher.hexdigest() if hasher else None):
+            self._remove_file(part_path)
+            self._remove_file(meta_path)
+            return False, None
+        status, path = self._finish_part(part_path, meta_path, target_file_path, target_name, length)
+        if status and cache is not None:
+            cache.store(url, target_file_path, meta.get('etag'), meta.get('last_modified'), chunk_size=chunk_size)
+        return status, path
+
+    def _finish_part(self, part_path, meta_path, target_file_path, target_name, length):
+        try:
+            if os.path.exists(target_file_path):
+                os.remove(target_file_path)
+            os.rename(part_path, target_file_path)
+        except Exception as e:
+            self.logger.error('[Failed][Download] rename {} error: {}'.format(part_path, e))
+            return False, None
+        self._remove_file(meta_path)
+        self.logger.info('[Success][Download] download {} success, size={}'.format(target_name, length))
+        return True, target_file_path
+
+    @staticmethod
+    def _write_stream(r, f, chunk_size, hasher=None):
+        size = 0
+        for content in r.iter_content(chunk_size):
+            if hasher is not None:
+                hasher.update(content)
+            f.write(content)
+            size += len(content)
+        return size
+
+    @staticmethod
+    def _preallocate(f, length):
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f.fileno(), 0, length)
+                return
+            except OSError:
+                # 文件系统不支持时退化为truncate
+                pass
+        f.truncate(length)
+
+    @staticmethod
+    def _file_digest(path, digest_type, chunk_size, hexdigest=True):
+        hasher = hashlib.new(digest_type)
+        with open(path, 'rb') as f:
+            while True:
+                content = f.read(chunk_size)
+                if not content:
+                    break
+                hasher.update(content)
+        return hasher.hexdigest() if hexdigest else hasher
+
+    def _check_digest(self, target_name, digest, actual_digest):
+        if digest is None or digest.lower() == actual_digest:
+            return True
+        self.logger.error('[Failed][Download] {} digest mismatch, expect={}, actual={}'.format(target_name, digest, actual_digest))
+        return False
+
+    @staticmethod
+    def _accept_ranges(r):
+        if r.headers.get('Accept-Ranges', '').lower() != 'bytes':
+            return False
+        # 压缩传输时Content-Length和Range都是针对压缩后的内容，无法按偏移写入
+        return r.headers.get('Content-Encoding', 'identity').lower() == 'identity'
+
+    @staticmethod
+    def _split_ranges(length, segments, segment_size=None):
+        if not segment_size:
+            segment_size = -(-length // segments)
+        return [(start, min(start + segment_size, length) - 1) for start in range(0, length, segment_size)]
+
+    def _remove_file(self, path):
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except Exception as e:
+                self.logger.error('[Failed][Download] remove {} failed: {}'.format(path, e))
+
+    @staticmethod
+    def _if_range(etag, last_modified):
+        # If-Range只能使用强ETag，弱ETag时使用Last-Modified
+        if etag and not etag.startswith('W/'):
+            return etag
+        return last_modified
+
+    def _segment_sources(self, source_url, r, length, sources):
+        """
+        分段下载的下载源，镜像的长度和校验值(ETag/Last-Modified)都与下载源的响应一致时才使用，
+        避免把不同版本的文件(如落后一个版本的镜像)拼接在一起
+
+        :param r: 下载源的响应
+        :param sources: select_sources的测速结果
+        :return: [(url, If-Range的值)]，下载源排在第一个
+        """
+        validator = self._if_range(r.headers.get('ETag'), r.headers.get('Last-Modified'))
+        result = [(source_url, validator)]
+        if validator is None:
+            # 无法确认镜像上是同一个文件，只使用下载源
+            return result
+        for source in sources:
+            if source['url'] == source_url or not source['ranges']:
+                continue
+            if source.get('length') != length or \
+                    self._if_range(source.get('etag'), source.get('last_modified')) != validator:
+                self.logger.info('[Download] skip mirror {}, length={}, etag={}, last_modified={} differ from source'.format(
+                    source['url'], source.get('length'), source.get('etag'), source.get('last_modified')))
+                continue
+            result.append((source['url'], validator))
+        return result
+
+    def _download_range(self, sources, path, start, end, length, chunk_size=64 * 1024):
+        # 依次尝试各个下载源
+        for url, if_range in sources:
+            if self._download_range_from(url, path, start, end, length, if_range, chunk_size):
+                return True
+        return False
+
+    def _download_range_from(self, url, path, start, end, length, if_range=None, chunk_size=64 * 1024):
+        headers = {'Range': 'bytes={}-{}'.format(start, end)}
+        if if_range:
+            # 文件已变化时服务器返回200完整内容而不是206，该段视为失败
+            headers['If-Range'] = if_range
+        code, r = self.get(url, headers=headers, stream=True, timeout=10, hedge=False)
+        if code != 0:
+            return False
+        try:
+            if r.status_code != 206:
+                self.logger.error('[Failed][Download] range {}-{} from {} status_code={}'.format(
+                    start, end, url, r.status_code))
+                return False
+            content_range = r.headers.get('Content-Range', '')
+            if content_range != 'bytes {}-{}/{}'.format(start, end, length):
+                self.logger.error('[Failed][Download] range {}-{} from {} unexpected Content-Range: {}'.format(
+                    start, end, url, content_range))
+                return False
+            with open(path, 'r+b') as f:
+                f.seek(start)
+                size = self._write_stream(r, f, chunk_size)
+            if size != end - start + 1:
+                self.logger.error('[Failed][Download] range {}-{} incomplete, {}/{}'.format(start, end, size, end - start + 1))
+                return False
+            return True
+        except Exception as e:
+            self.logger.error('[Failed][Download] range {}-{} save error: {}'.format(start, end, e))
+            return False
+        finally:
+            r.close()
+
+    def _download_segments(self, sources, path, length, segments, segment_size=None, chunk_size=64 * 1024):
+        """
+        分段并发下载，每段通过Range请求直接写入预分配文件的对应偏移
+        
+        :param sources: 下载源列表[(url, If-Range的值)]，各段轮流分配到不同的下载源，失败时换下一个下载源重试
+        
+        :return: 全部分段成功返回True
+        """
+        ranges = self._split_ranges(length, segments, segment_size)
+        try:
+            with open(path, 'wb') as f:
+                self._preallocate(f, length)
+        except Exception as e:
+            self.logger.error('[Failed][Download] preallocate error: {}'.format(e))
+            return False
+        self.logger.debug('[Download] {} segments, size={}, sources={}'.format(len(ranges), length, len(sources)))
+        with ThreadPoolExecutor(max_workers=min(segments, len(ranges))) as executor:
+            futures = [executor.submit(self._download_range, sources[i % len(sources):] + sources[:i % len(sources)],
+                                       path, start, end, length, chunk_size)
+                       for i, (start, end) in enumerate(ranges)]
+            return all(future.result() for future in futures)
+
 
 if __name__ == '__main__':
     req = Request()
@@ -1 +1,8 @@
 from .ssh import SSHTransport
+from .pool import SSHConnectionPool
+from .fleet import FleetExecutor
+from .follow import RemoteFollower
+from .cache import RemoteMetadataCache
+from .reader import RemoteFileReader
+from .async_ssh import AsyncSSHTransport
+from .mux import SSHMuxServer, MuxClient
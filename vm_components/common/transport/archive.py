@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import os
+import bz2
+import zlib
+import queue
+import tarfile
+import threading
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+# 压缩方式 -> (远程tar解压参数, 远程压缩命令)
+COMPRESSORS = {
+    None: ('', None),
+    'gz': ('z', 'gzip'),
+    'bz2': ('j', 'bzip2'),
+    'xz': ('J', 'xz'),
+}
+
+
+def create_compressor(compress, level):
+    if compress is None:
+        return None
+    if compress == 'gz':
+        # wbits=31输出gzip格式
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+    if compress == 'bz2':
+        return bz2.BZ2Compressor(max(1, level))
+    if compress == 'xz':
+        if lzma is None:
+            raise ImportError('xz compress requires lzma module')
+        return lzma.LZMACompressor(preset=level)
+    raise ValueError('unsupported compress: {}'.format(compress))
+
+
+class ArchiveWriter(object):
+    def __init__(self, compress=None, level=6, chunk_size=256 * 1024, max_chunks=16):
+        """
+        tarfile的输出文件对象，数据压缩后按chunk_size分块放入有界队列，由发送线程取出，
+        打包和发送在不同线程中同时进行，队列满时打包线程等待(背压)
+
+        :param compress: 压缩方式，None/'gz'/'bz2'/'xz'
+        :param level: 压缩级别
+        :param chunk_size: 队列中每块数据的字节数
+        :param max_chunks: 队列中最多缓存的块数
+        """
+        self._compressor = create_compressor(compress, level)
+        self._chunk_size = chunk_size
+        self._buffer = []
+        self._buffered = 0
+        self.queue = queue.Queue(maxsize=max_chunks)
+        self.stopped = threading.Event()
+        self.raw_bytes = 0
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise IOError('archive receiver stopped')
+
+    def _flush(self):
+        if self._buffered:
+            data = b''.join(self._buffer)
+            self._buffer = []
+            self._buffered = 0
+            self._put(data)
+
+    def write(self, data):
+        size = len(data)
+        self.raw_bytes += size
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        if data:
+            self._buffer.append(data)
+            self._buffered += len(data)
+            if self._buffered >= self._chunk_size:
+                self._flush()
+        return size
+
+    def close(self, error=None):
+        """
+        结束写入，队列中放入None(正常结束)或异常对象
+        """
+        try:
+            if error is None and self._compressor is not None:
+                self._buffer.append(self._compressor.flush())
+                self._buffered += len(self._buffer[-1])
+            if error is None:
+                self._flush()
+        finally:
+            if not self.stopped.is_set():
+                self._put(error)
+
+
+def pack_dir(local_dir, writer):
+    """
+    把本地目录打包写入writer，在后台线程中执行
+
+    :return: {'files': 文件数, 'bytes': 文件总字节数}
+    """
+    result = {'files': 0, 'bytes': 0}
+    try:
+        # PAX格式会为非整数的修改时间给每个文件额外写一个扩展头
+        with tarfile.open(fileobj=writer, mode='w|', format=tarfile.GNU_FORMAT) as tar:
+            for root, dirnames, filenames in os.walk(local_dir):
+                dirnames.sort()
+                rel = os.path.relpath(root, local_dir)
+                for name in sorted(dirnames):
+                    tar.add(os.path.join(root, name), arcname=os.path.normpath(os.path.join(rel, name)),
+                            recursive=False)
+                for name in sorted(filenames):
+                    path = os.path.join(root, name)
+                    tar.add(path, arcname=os.path.normpath(os.path.join(rel, name)), recursive=False)
+                    if os.path.isfile(path):
+                        result['files'] += 1
+                        result['bytes'] += os.path.getsize(path)
+    except Exception as e:
+        writer.close(error=e)
+        return result
+    writer.close()
+    return result
+
+
+def extract_stream(fileobj, local_dir, compress=None):
+    """
+    从流中边读边解包到本地目录
+
+    :return: {'files': 文件数, 'bytes': 文件总字节数}
+    """
+    result = {'files': 0, 'bytes': 0}
+    mode = 'r|' + (compress or '')
+    with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+        kwargs = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+        for member in tar:
+            if not kwargs and (member.name.startswith('/') or '..' in member.name.split('/')):
+                # 没有extraction filter的python版本上拒绝解包到目标目录之外
+                continue
+            tar.extract(member, local_dir, **kwargs)
+            if member.isfile():
+                result['files'] += 1
+                result['bytes'] += member.size
+    return result
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import socket
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from posixpath import join as urljoin
+from .ssh import SSHTransport
+
+
+class AsyncSSHTransport(object):
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    def __init__(self, config, logger=None, pool=None, metadata_ttl=None, executor=None):
+        """
+        异步SSH通信类，接口和返回值与SSHTransport一致
+        命令输出通过事件循环监听通道的文件描述符读取，不占用线程，可以同时进行大量主机和通道的命令；
+        连接、SFTP等阻塞调用在所有实例共享的有界线程池中执行，同一实例的SFTP操作按顺序执行
+
+        :param config: SSH连接的配置，同SSHTransport
+        :param logger: 指定日志输出
+        :param pool: 连接池，同SSHTransport，多个实例(包括同步实例)可以共用同一个连接池
+        :param metadata_ttl: 远程元数据缓存的有效期(秒)，默认None不缓存，同SSHTransport
+        :param executor: 执行阻塞调用的线程池，为None使用共享的默认线程池
+        """
+        self.transport = SSHTransport(config, logger=logger, pool=pool, metadata_ttl=metadata_ttl)
+        self.executor = executor or self.default_executor()
+        self._sftp_lock = None
+
+    @classmethod
+    def default_executor(cls, max_workers=32):
+        """
+        进程内共享的默认线程池
+        """
+        if cls._executor is None:
+            with cls._executor_lock:
+                if cls._executor is None:
+                    cls._executor = ThreadPoolExecutor(max_workers=max_workers)
+        return cls._executor
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @property
+    def config(self):
+        return self.transport.config
+
+    @property
+    def logger(self):
+        return self.transport.logger
+
+    @property
+    def sftp_lock(self):
+        if self._sftp_lock is None:
+            self._sftp_lock = asyncio.Lock()
+        return self._sftp_lock
+
+    async def _run(self, func, *args, **kwargs):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _run_sftp(self, func, *args, **kwargs):
+        # 同一个SFTPClient上的请求按顺序执行
+        async with self.sftp_lock:
+            return await self._run(func, *args, **kwargs)
+
+    async def connect(self):
+        return await self._run(self.transport.connect)
+
+    async def close(self, discard=False):
+        return await self._run(self.transport.close, discard=discard)
+
+    async def home(self):
+        return await self._run_sftp(lambda: self.transport.home)
+
+    def _open_channel(self, cmd, window_size, get_pty, environment):
+        self.transport._exec_invalidate()
+        if self.transport.ssh is None:
+            return None
+        channel = self.transport.ssh.get_transport().open_session(window_size=window_size)
+        if get_pty:
+            channel.get_pty()
+        if environment:
+            channel.update_environment(environment)
+        channel.exec_command(cmd)
+        return channel
+
+    @staticmethod
+    async def _wait_readable(channel, timeout):
+        """
+        等待通道有数据或EOF，paramiko通道的fileno在stdout或stderr有数据以及通道关闭时可读
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        fd = channel.fileno()
+        try:
+            loop.add_reader(fd, lambda: future.done() or future.set_result(None))
+        except NotImplementedError:
+            # 不支持add_reader的事件循环(如Windows的ProactorEventLoop)退化为轮询
+            await asyncio.sleep(0.05 if timeout is None else min(timeout, 0.05))
+            return
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            loop.remove_reader(fd)
+
+    async def exec_command_stream(self, cmd, lines=True, chunk_size=32768, max_line=65536, window_size=None,
+                                  timeout=None, get_pty=False, environment=None, password=None):
+        """
+        异步生成器，流式执行SSH命令，参数和返回值同SSHTransport.exec_command_stream
+
+        :return: (stream, data)，最后返回('exit', 退出码)
+        """
+        async for item in self._exec_stream(cmd, lines=lines, chunk_size=chunk_size, max_line=max_line,
+                                            window_size=window_size, timeout=timeout, get_pty=get_pty,
+                                            environment=environment, password=password):
+            yield item
+
+    async def _exec_stream(self, cmd, lines=True, chunk_size=32768, max_line=65536, window_size=None, timeout=None,
+                           get_pty=False, environment=None, password=None, discard=True, state=None):
+        """
+        exec_command_stream的实现
+
+        :param discard: 出错时是否关闭(丢弃)整个连接，多个通道共享连接时为False，只关闭出错的通道
+        :param state: 传入字典时，命令已经在远程开始执行后设置state['started']为True
+        """
+        if password is None:
+            password = self.config.get('password', None)
+        cmd = SSHTransport._sudo_cmd(cmd, password)
+        loop = asyncio.get_event_loop()
+        channel = None
+        try:
+            channel = await self._run(self._open_channel, cmd, window_size, get_pty, environment)
+            if channel is None:
+                yield 'exit', -1
+                return
+            if state is not None:
+                state['started'] = True
+            buffers = {'stdout': b'', 'stderr': b''}
+            readers = {'stdout': channel.recv, 'stderr': channel.recv_stderr}
+            ready = {'stdout': channel.recv_ready, 'stderr': channel.recv_stderr_ready}
+            last_active = loop.time()
+            while True:
+                active = False
+                for stream in ('stdout', 'stderr'):
+                    while ready[stream]():
+                        data = readers[stream](chunk_size)
+                        if not data:
+                            break
+                        active = True
+                        # 数据持续到达时每读取一块也让出一次事件循环
+                        await asyncio.sleep(0)
+                        if not lines:
+                            yield stream, data
+                            continue
+                        items, buffers[stream] = SSHTransport._split_lines(buffers[stream] + data, max_line)
+                        for line in items:
+                            yield stream, line
+                if active:
+                    last_active = loop.time()
+                    continue
+                if channel.eof_received or channel.closed:
+                    if not channel.recv_ready() and not channel.recv_stderr_ready():
+                        break
+                    continue
+                wait = None if timeout is None else timeout - (loop.time() - last_active)
+                if wait is not None and wait <= 0:
+                    raise socket.timeout('no output for {}s'.format(timeout))
+                await self._wait_readable(channel, wait)
+            for stream in ('stdout', 'stderr'):
+                if buffers[stream]:
+                    yield stream, buffers[stream].rstrip(b'\r\n').decode('utf-8', 'replace')
+            if channel.exit_status_ready():
+                status = channel.recv_exit_status()
+            else:
+                status = await self._run(channel.recv_exit_status)
+            yield 'exit', status
+        except Exception as e:
+            self.logger.error('ExecCmdStreamErr: cmd={}, err={}'.format(cmd, e))
+            if discard and not isinstance(e, socket.timeout):
+                await self.close(discard=True)
+            yield 'exit', -1
+        finally:
+            if channel is not None:
+                channel.close()
+            self.transport._exec_invalidate()
+
+    async def _exec_one(self, index, cmd, **kwargs):
+        result = {'index': index, 'cmd': cmd, 'stdout': [], 'stderr': [], 'status': -1}
+        if not isinstance(cmd, str):
+            self.logger.error('only support string cmd, cmd={}, type={}'.format(cmd, type(cmd)))
+            return result
+        async for stream, data in self._exec_stream(cmd, **kwargs):
+            if stream == 'exit':
+                result['status'] = data
+            elif len(data.strip()):
+                result[stream].append(data.strip())
+        return result
+
+    async def exec_command(self, cmds, **kwargs):
+        """
+        执行SSH命令，参数同SSHTransport.exec_command，连接或打开通道失败时重试(最多3次)，命令开始执行后不重试
+
+        :return: [{'stdout': [...], 'stderr': [...]}, ...]，执行失败的命令不在结果中
+        """
+        kwargs.pop('bufsize', None)
+        if isinstance(cmds, str):
+            cmds = [cmds]
+        results = []
+        for index, cmd in enumerate(cmds):
+            for _ in range(3):
+                state = {}
+                result = await self._exec_one(index, cmd, state=state, **kwargs)
+                # 只在连接或打开通道失败时重试，命令已经开始执行(包括超时、没有退出码)时重试会重复执行
+                if result['status'] != -1 or state.get('started') or not isinstance(cmd, str):
+                    break
+            if result['status'] != -1:
+                results.append({'stdout': result['stdout'], 'stderr': result['stderr']})
+        return results
+
+    async def exec_command_batch(self, cmds, max_channels=4, **kwargs):
+        """
+        异步生成器，在同一个连接上同时打开多个通道并发执行命令，按完成顺序返回，参数和返回值同SSHTransport.exec_command_batch
+
+        :return: {'index', 'cmd', 'stdout', 'stderr', 'status'}
+        """
+        kwargs.pop('bufsize', None)
+        if isinstance(cmds, str):
+            cmds = [cmds]
+        # 先建立连接，避免各通道同时发现未连接
+        if await self._run_sftp(lambda: self.transport.ssh) is None:
+            for index, cmd in enumerate(cmds):
+                yield {'index': index, 'cmd': cmd, 'stdout': [], 'stderr': [], 'status': -1}
+            return
+        semaphore = asyncio.Semaphore(max(1, max_channels))
+
+        async def _run(index, cmd):
+            async with semaphore:
+                # 其他通道还在使用同一个连接，出错时只关闭自己的通道
+                return await self._exec_one(index, cmd, discard=False, **kwargs)
+
+        for future in asyncio.as_completed([_run(index, cmd) for index, cmd in enumerate(cmds)]):
+            yield await future
+        client = self.transport._ssh
+        if client is not None and not client.get_transport().is_active():
+            # 所有通道结束后再丢弃已断开的连接
+            await self.close(discard=True)
+
+    async def follow(self, remote_name, subdirectory=None, specific_remote_path=None, backlog=0, **kwargs):
+        """
+        异步生成器，持续返回远程文件新追加的内容，参数和返回值同SSHTransport.follow
+        多个文件可以在同一个事件循环中同时跟踪，每个文件一个通道，不占用线程
+        """
+        remote_path = await self._run_sftp(self.transport._remote_base, specific_remote_path)
+        if subdirectory is not None:
+            remote_path = urljoin(remote_path, subdirectory)
+        target_path = urljoin(remote_path, remote_name)
+        stream_output = self.exec_command_stream(SSHTransport._follow_cmd(target_path, backlog), **kwargs)
+        try:
+            async for stream, data in stream_output:
+                if stream == 'stdout':
+                    yield data
+                elif stream == 'stderr':
+                    self.logger.info('follow {}: {}'.format(
+                        target_path, data.decode('utf-8', 'replace').strip() if isinstance(data, bytes) else data))
+                elif data != 0:
+                    self.logger.error('follow {} exit: {}'.format(target_path, data))
+        finally:
+            await stream_output.aclose()
+
+    async def upload(self, *args, **kwargs):
+        """同SSHTransport.upload"""
+        return await self._run_sftp(self.transport.upload, *args, **kwargs)
+
+    async def download(self, *args, **kwargs):
+        """同SSHTransport.download"""
+        return await self._run_sftp(self.transport.download, *args, **kwargs)
+
+    async def upload_large(self, *args, **kwargs):
+        """同SSHTransport.upload_large"""
+        return await self._run_sftp(self.transport.upload_large, *args, **kwargs)
+
+    async def download_large(self, *args, **kwargs):
+        """同SSHTransport.download_large"""
+        return await self._run_sftp(self.transport.download_large, *args, **kwargs)
+
+    async def upload_tree(self, *args, **kwargs):
+        """同SSHTransport.upload_tree"""
+        return await self._run_sftp(self.transport.upload_tree, *args, **kwargs)
+
+    async def download_tree(self, *args, **kwargs):
+        """同SSHTransport.download_tree"""
+        return await self._run_sftp(self.transport.download_tree, *args, **kwargs)
+
+    async def upload_archive(self, *args, **kwargs):
+        """同SSHTransport.upload_archive"""
+        return await self._run_sftp(self.transport.upload_archive, *args, **kwargs)
+
+    async def download_archive(self, *args, **kwargs):
+        """同SSHTransport.download_archive"""
+        return await self._run_sftp(self.transport.download_archive, *args, **kwargs)
+
+    async def sync(self, *args, **kwargs):
+        """同SSHTransport.sync"""
+        return await self._run_sftp(self.transport.sync, *args, **kwargs)
+
+    async def remote_digests(self, *args, **kwargs):
+        """同SSHTransport.remote_digests"""
+        return await self._run(self.transport.remote_digests, *args, **kwargs)
+
+    async def remote_digest(self, *args, **kwargs):
+        """同SSHTransport.remote_digest"""
+        return await self._run_sftp(self.transport.remote_digest, *args, **kwargs)
+
+    async def verify(self, *args, **kwargs):
+        """同SSHTransport.verify"""
+        return await self._run(self.transport.verify, *args, **kwargs)
+
+    async def stat(self, *args, **kwargs):
+        """同SSHTransport.stat"""
+        return await self._run_sftp(self.transport.stat, *args, **kwargs)
+
+    async def mkdir(self, *args, **kwargs):
+        """同SSHTransport.mkdir"""
+        return await self._run_sftp(self.transport.mkdir, *args, **kwargs)
+
+    async def chdir(self, *args, **kwargs):
+        """同SSHTransport.chdir"""
+        return await self._run_sftp(self.transport.chdir, *args, **kwargs)
+
+    async def listdir(self, *args, **kwargs):
+        """同SSHTransport.listdir"""
+        return await self._run_sftp(self.transport.listdir, *args, **kwargs)
+
+    async def rmdir(self, *args, **kwargs):
+        """同SSHTransport.rmdir"""
+        return await self._run_sftp(self.transport.rmdir, *args, **kwargs)
+
+    async def remove(self, *args, **kwargs):
+        """同SSHTransport.remove"""
+        return await self._run_sftp(self.transport.remove, *args, **kwargs)
+
+    async def rename(self, *args, **kwargs):
+        """同SSHTransport.rename"""
+        return await self._run_sftp(self.transport.rename, *args, **kwargs)
+
+    async def chmod(self, *args, **kwargs):
+        """同SSHTransport.chmod"""
+        return await self._run_sftp(self.transport.chmod, *args, **kwargs)
+
+    async def chown(self, *args, **kwargs):
+        """同SSHTransport.chown"""
+        return await self._run_sftp(self.transport.chown, *args, **kwargs)
@@ -0,0 +1,573 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+"""
+SSHTransport性能测试：在进程内启动paramiko实现的SSH/SFTP服务，可选注入延迟和限制带宽，
+测试连接耗时、命令执行延迟和吞吐量、上传下载速度以及mkdir/listdir等操作的SFTP往返次数，输出JSON报告
+
+用法:
+    python -m vm_components.common.transport.benchmark
+    python -m vm_components.common.transport.benchmark --latency 20 --bandwidth 50 -n 10 --output report.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import paramiko
+from paramiko.sftp import CMD_NAMES
+from .ssh import SSHTransport
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    def __init__(self, server):
+        self.server = server
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if password == self.server.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_exec_request(self, channel, command):
+        self.server.count('exec')
+        t = threading.Thread(target=self.server.run_exec, args=(channel, command))
+        t.daemon = True
+        t.start()
+        return True
+
+    def check_channel_env_request(self, channel, name, value):
+        return True
+
+    def check_global_request(self, kind, msg):
+        return True
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        try:
+            if attr._flags & attr.FLAG_SIZE:
+                self.readfile.truncate(attr.st_size)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+
+class _SFTPInterface(paramiko.SFTPServerInterface):
+    def __init__(self, server, benchmark_server, *args, **kwargs):
+        super(_SFTPInterface, self).__init__(server, *args, **kwargs)
+        self.root = benchmark_server.root
+
+    def list_folder(self, path):
+        try:
+            result = []
+            for name in os.listdir(path):
+                attr = paramiko.SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)))
+                attr.filename = name
+                result.append(attr)
+            return result
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.lstat(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(path, flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        handle = _SFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def _call(self, func, *args):
+        try:
+            func(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def remove(self, path):
+        return self._call(os.remove, path)
+
+    def rename(self, oldpath, newpath):
+        return self._call(os.rename, oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.rename, oldpath, newpath)
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, path)
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, path)
+
+    def chattr(self, path, attr):
+        try:
+            if attr._flags & attr.FLAG_PERMISSIONS:
+                os.chmod(path, attr.st_mode)
+            if attr._flags & attr.FLAG_AMTIME:
+                os.utime(path, (attr.st_atime, attr.st_mtime))
+            if attr._flags & attr.FLAG_SIZE:
+                with open(path, 'r+b') as f:
+                    f.truncate(attr.st_size)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def canonicalize(self, path):
+        if not path or path == '.':
+            return self.root
+        return os.path.normpath(path if path.startswith('/') else os.path.join(self.root, path))
+
+
+class _CountingSFTPServer(paramiko.SFTPServer):
+    def __init__(self, channel, name, server, sftp_si, benchmark_server, *args, **kwargs):
+        self.benchmark_server = benchmark_server
+        super(_CountingSFTPServer, self).__init__(channel, name, server, sftp_si, benchmark_server, *args, **kwargs)
+
+    def _process(self, t, request_number, msg):
+        # 统计每种SFTP请求的次数，每个请求对应客户端的一次往返
+        self.benchmark_server.count('sftp')
+        self.benchmark_server.count('sftp_' + CMD_NAMES.get(t, str(t)).replace('CMD_', '').lower())
+        return super(_CountingSFTPServer, self)._process(t, request_number, msg)
+
+
+class _ShapingProxy(object):
+    def __init__(self, target, latency=0, bandwidth=None):
+        """
+        TCP代理，为每个方向注入单向延迟并限制带宽
+
+        :param target: 目标地址(host, port)
+        :param latency: 单向延迟(秒)
+        :param bandwidth: 每个方向的带宽(字节/秒)，None表示不限制
+        """
+        self.target = target
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(64)
+        self.address = self.sock.getsockname()
+        t = threading.Thread(target=self._accept)
+        t.daemon = True
+        t.start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+                upstream = socket.create_connection(self.target)
+            except Exception:
+                return
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._pipe(client, upstream)
+            self._pipe(upstream, client)
+
+    def _pipe(self, src, dst):
+        pending = queue.Queue()
+        state = {'free': 0.0}
+
+        def _read():
+            while True:
+                try:
+                    data = src.recv(65536)
+                except Exception:
+                    data = b''
+                now = time.time()
+                if self.bandwidth and data:
+                    # 数据按带宽依次发出，再经过延迟到达
+                    state['free'] = max(now, state['free']) + float(len(data)) / self.bandwidth
+                    now = state['free']
+                pending.put((now + self.latency, data))
+                if not data:
+                    break
+
+        def _write():
+            while True:
+                deliver, data = pending.get()
+                wait = deliver - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                if not data:
+                    try:
+                        dst.shutdown(socket.SHUT_WR)
+                    except Exception:
+                        pass
+                    break
+                try:
+                    dst.sendall(data)
+                except Exception:
+                    break
+
+        for target in (_read, _write):
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+
+    def close(self):
+        self.sock.close()
+
+
+class BenchmarkServer(object):
+    def __init__(self, root=None, latency=0, bandwidth=None, password='benchmark'):
+        """
+        进程内的SSH/SFTP测试服务，命令在本机通过shell执行，SFTP直接操作本机文件系统，home为root目录
+
+        :param root: 测试目录，为None创建临时目录(close时删除)
+        :param latency: 注入的单向延迟(秒)，RTT为其两倍
+        :param bandwidth: 每个方向的带宽(字节/秒)，None表示不限制
+        :param password: 登录密码
+        """
+        self._own_root = root is None
+        self.root = os.path.realpath(root or tempfile.mkdtemp(prefix='vm_ssh_benchmark_'))
+        self.password = password
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._transports = []
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(64)
+        t = threading.Thread(target=self._accept)
+        t.daemon = True
+        t.start()
+        self.proxy = None
+        address = self.sock.getsockname()
+        if latency or bandwidth:
+            self.proxy = _ShapingProxy(address, latency, bandwidth)
+            address = self.proxy.address
+        self.address = address
+
+    @property
+    def config(self):
+        """
+        连接该服务的SSHTransport配置
+        """
+        return {
+            'hostname': self.address[0],
+            'port': self.address[1],
+            'username': 'benchmark',
+            'password': self.password,
+            'look_for_keys': False,
+            'allow_agent': False,
+            'load_system_host_keys': False,
+        }
+
+    def count(self, key, value=1):
+        with self._lock:
+            self._stats[key] = self._stats.get(key, 0) + value
+
+    def stats(self, reset=False):
+        """
+        服务端统计: 'connections', 'exec', 'sftp'(SFTP请求总数)以及每种SFTP请求的次数
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            if reset:
+                self._stats.clear()
+        return stats
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except Exception:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.count('connections')
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', _CountingSFTPServer, _SFTPInterface, self)
+            try:
+                transport.start_server(server=_ServerInterface(self))
+            except Exception:
+                continue
+            self._transports.append(transport)
+
+    def run_exec(self, channel, command):
+        process = subprocess.Popen(command.decode('utf-8'), shell=True, cwd=self.root,
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        def _stdin():
+            try:
+                while True:
+                    data = channel.recv(65536)
+                    if not data:
+                        break
+                    process.stdin.write(data)
+                    process.stdin.flush()
+            except Exception:
+                pass
+            try:
+                process.stdin.close()
+            except Exception:
+                pass
+
+        def _output(pipe, send):
+            try:
+                while True:
+                    data = os.read(pipe.fileno(), 65536)
+                    if not data:
+                        break
+                    send(data)
+            except Exception:
+                pass
+
+        threads = [threading.Thread(target=_stdin),
+                   threading.Thread(target=_output, args=(process.stdout, channel.sendall)),
+                   threading.Thread(target=_output, args=(process.stderr, channel.sendall_stderr))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        threads[1].join()
+        threads[2].join()
+        try:
+            channel.send_exit_status(process.wait())
+            channel.close()
+        except Exception:
+            pass
+
+    def close(self):
+        self.sock.close()
+        if self.proxy is not None:
+            self.proxy.close()
+        for transport in self._transports:
+            transport.close()
+        if self._own_root:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+def _timings(func, count):
+    """
+    执行count次并统计耗时
+
+    :return: {'count', 'avg_ms', 'min_ms', 'p50_ms', 'max_ms'}
+    """
+    samples = []
+    for _ in range(count):
+        start = time.time()
+        func()
+        samples.append((time.time() - start) * 1000)
+    samples.sort()
+    return {
+        'count': count,
+        'avg_ms': round(sum(samples) / count, 3),
+        'min_ms': round(samples[0], 3),
+        'p50_ms': round(samples[(count - 1) // 2], 3),
+        'max_ms': round(samples[-1], 3),
+    }
+
+
+def _mb_s(size, elapsed):
+    return round(size / 1024.0 / 1024.0 / max(elapsed, 1e-6), 3)
+
+
+def bench_connect(server, count, logger):
+    def _connect():
+        transport = SSHTransport(server.config, logger=logger)
+        if transport.connect() != 0:
+            raise IOError('connect failed')
+        transport.close()
+    return _timings(_connect, count)
+
+
+def bench_exec(server, count, logger, batch_channels=8, output_bytes=16 * 1024 * 1024):
+    """
+    命令执行: 单条命令延迟、顺序执行和exec_command_batch并发执行的吞吐量，以及命令输出的吞吐量
+    """
+    with SSHTransport(server.config, logger=logger) as transport:
+        transport.connect()
+        result = {
+            'latency': _timings(lambda: list(transport.exec_command('true')), count),
+            'stream_latency': _timings(lambda: list(transport.exec_command_stream('true')), count),
+        }
+        cmds = ['echo {}'.format(i) for i in range(count * 4)]
+        start = time.time()
+        list(transport.exec_command(cmds))
+        elapsed = time.time() - start
+        result['sequential'] = {'count': len(cmds), 'total': round(elapsed, 4), 'cmds_per_sec': round(len(cmds) / elapsed, 2)}
+        start = time.time()
+        list(transport.exec_command_batch(cmds, max_channels=batch_channels))
+        elapsed = time.time() - start
+        result['batch'] = {'count': len(cmds), 'channels': batch_channels, 'total': round(elapsed, 4),
+                           'cmds_per_sec': round(len(cmds) / elapsed, 2)}
+        received = 0
+        start = time.time()
+        for stream, data in transport.exec_command_stream('head -c {} /dev/zero'.format(output_bytes), lines=False):
+            if stream == 'stdout':
+                received += len(data)
+        result['output'] = {'bytes': received, 'mb_s': _mb_s(received, time.time() - start)}
+    return result
+
+
+def bench_transfer(server, sizes, logger, large_channels=4):
+    """
+    上传下载速度，1MB以上的文件同时测试upload_large/download_large
+    """
+    results = []
+    local_dir = tempfile.mkdtemp(prefix='vm_ssh_benchmark_local_')
+    remote_dir = os.path.join(server.root, 'transfer')
+    try:
+        with SSHTransport(server.config, logger=logger) as transport:
+            transport.connect()
+            for size in sizes:
+                path = os.path.join(local_dir, 'file_{}'.format(size))
+                with open(path, 'wb') as f:
+                    f.write(os.urandom(size))
+                item = {'size': size}
+                start = time.time()
+                transport.upload(path, 'file', specific_remote_path=remote_dir, callback=None)
+                item['upload_mb_s'] = _mb_s(size, time.time() - start)
+                start = time.time()
+                transport.download('file', path + '.down', specific_remote_path=remote_dir, callback=None)
+                item['download_mb_s'] = _mb_s(size, time.time() - start)
+                if size >= 1024 * 1024:
+                    block_size = max(256 * 1024, size // (large_channels * 2))
+                    result = transport.upload_large(path, 'file_large', specific_remote_path=remote_dir,
+                                                    block_size=block_size, max_channels=large_channels, callback=None)
+                    item['upload_large_mb_s'] = _mb_s(size, result['elapsed'])
+                    result = transport.download_large('file_large', path + '.large', specific_remote_path=remote_dir,
+                                                      block_size=block_size, max_channels=large_channels, callback=None)
+                    item['download_large_mb_s'] = _mb_s(size, result['elapsed'])
+                results.append(item)
+    finally:
+        shutil.rmtree(local_dir, ignore_errors=True)
+    return results
+
+
+def bench_roundtrips(server, logger, depth=5):
+    """
+    常用操作的SFTP请求次数(每次请求为一次往返)
+    """
+    result = {}
+    local_dir = tempfile.mkdtemp(prefix='vm_ssh_benchmark_local_')
+    path = os.path.join(local_dir, 'small')
+    with open(path, 'wb') as f:
+        f.write(b'x' * 1024)
+    nested = '/'.join('d{}'.format(i) for i in range(depth))
+    try:
+        # 元数据缓存默认不启用，这里比较启用缓存后的往返次数
+        with SSHTransport(server.config, logger=logger, metadata_ttl=30) as transport:
+            transport.connect()
+            transport.home
+            operations = [
+                ('mkdir_cold', lambda: transport.mkdir(nested, specific_remote_path=server.root)),
+                ('mkdir_warm', lambda: transport.mkdir(nested, specific_remote_path=server.root)),
+                ('listdir', lambda: transport.listdir('.', specific_remote_path=server.root)),
+                ('upload_first', lambda: transport.upload(path, 'small', subdirectory=nested,
+                                                          specific_remote_path=server.root, callback=None)),
+                ('upload_repeat', lambda: transport.upload(path, 'small2', subdirectory=nested,
+                                                           specific_remote_path=server.root, callback=None)),
+                ('stat_cold', lambda: transport.stat('small', specific_remote_path=os.path.join(server.root, nested),
+                                                     use_cache=False)),
+                ('stat_warm', lambda: transport.stat('small2', specific_remote_path=os.path.join(server.root, nested))),
+            ]
+            for name, operation in operations:
+                server.stats(reset=True)
+                operation()
+                stats = server.stats(reset=True)
+                result[name] = dict((key[5:], value) for key, value in stats.items() if key.startswith('sftp_'))
+                result[name]['total'] = stats.get('sftp', 0)
+    finally:
+        shutil.rmtree(local_dir, ignore_errors=True)
+    return result
+
+
+def benchmark(latency=0, bandwidth=None, count=20, sizes=(64 * 1024, 1024 * 1024, 16 * 1024 * 1024)):
+    """
+    运行所有测试
+
+    :param latency: 注入的单向延迟(秒)
+    :param bandwidth: 每个方向的带宽(字节/秒)，None表示不限制
+    :param count: 延迟类测试的重复次数
+    :param sizes: 上传下载测试的文件大小列表(字节)
+    :return: 测试报告字典
+    """
+    logger = logging.getLogger(__name__)
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler(sys.stderr))
+    logger.setLevel(logging.ERROR)
+    server = BenchmarkServer(latency=latency, bandwidth=bandwidth)
+    try:
+        report = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'params': {'latency_ms': latency * 1000, 'bandwidth': bandwidth, 'count': count, 'sizes': list(sizes)},
+            'env': {'python': platform.python_version(), 'paramiko': paramiko.__version__, 'platform': platform.platform()},
+        }
+        report['connect'] = bench_connect(server, max(1, count // 4), logger)
+        report['exec'] = bench_exec(server, count, logger)
+        report['transfer'] = bench_transfer(server, sizes, logger)
+        report['roundtrips'] = bench_roundtrips(server, logger)
+        return report
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SSHTransport benchmark with an in-process paramiko server')
+    parser.add_argument('--latency', type=float, default=0, help='injected one-way latency in milliseconds')
+    parser.add_argument('--bandwidth', type=float, default=0, help='bandwidth limit per direction in MB/s, 0 means unlimited')
+    parser.add_argument('-n', '--count', type=int, default=20, help='repeat count of latency tests')
+    parser.add_argument('--sizes', default='65536,1048576,16777216', help='comma separated transfer sizes in bytes')
+    parser.add_argument('--output', default=None, help='write json report to file')
+    args = parser.parse_args()
+    report = benchmark(latency=args.latency / 1000.0, bandwidth=args.bandwidth * 1024 * 1024 or None, count=args.count,
+                       sizes=[int(size) for size in args.sizes.split(',') if size])
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import stat
+import time
+import posixpath
+import threading
+from collections import OrderedDict
+
+
+class RemoteMetadataCache(object):
+    def __init__(self, ttl=30, max_entries=4096):
+        """
+        远程元数据缓存，缓存已知存在的目录、stat结果和home等解析结果，避免重复的SFTP往返
+        只缓存绝对路径，通过SSHTransport修改远程文件时会自动失效对应的条目，通过SSHTransport执行命令时全部失效，
+        其他连接或程序修改远程文件时依赖ttl过期，或调用clear/invalidate
+
+        :param ttl: 条目的有效期(秒)
+        :param max_entries: 目录和stat条目各自的数量上限，超过时淘汰最早写入的条目
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._dirs = OrderedDict()
+        self._attrs = OrderedDict()
+        self._values = {}
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+        }
+
+    @staticmethod
+    def normalize(path):
+        if not path or not path.startswith('/'):
+            return None
+        return posixpath.normpath(path)
+
+    def _get(self, table, key):
+        with self._lock:
+            item = table.get(key)
+            if item is not None and item[0] > time.time():
+                self._stats['hits'] += 1
+                return item
+            if item is not None:
+                table.pop(key, None)
+            self._stats['misses'] += 1
+            return None
+
+    def _set(self, table, key, value):
+        table.pop(key, None)
+        table[key] = (time.time() + self.ttl, value)
+        while len(table) > self.max_entries:
+            table.popitem(last=False)
+
+    def get(self, name):
+        """
+        获取缓存的解析结果(如home)
+
+        :return: 未缓存或已过期返回None
+        """
+        item = self._get(self._values, name)
+        return item[1] if item is not None else None
+
+    def set(self, name, value):
+        with self._lock:
+            self._values[name] = (time.time() + self.ttl, value)
+
+    def has_dir(self, path):
+        """
+        目录是否已知存在
+        """
+        path = self.normalize(path)
+        return path is not None and self._get(self._dirs, path) is not None
+
+    def add_dir(self, path):
+        """
+        记录目录存在，其所有上级目录也一并记录
+        """
+        path = self.normalize(path)
+        if path is None:
+            return
+        with self._lock:
+            while True:
+                self._set(self._dirs, path, True)
+                parent = posixpath.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+
+    def get_attr(self, path):
+        """
+        获取缓存的stat结果
+
+        :return: paramiko.SFTPAttributes，未缓存或已过期返回None
+        """
+        path = self.normalize(path)
+        if path is None:
+            return None
+        item = self._get(self._attrs, path)
+        return item[1] if item is not None else None
+
+    def set_attr(self, path, attr):
+        path = self.normalize(path)
+        if path is None or attr is None:
+            return
+        with self._lock:
+            self._set(self._attrs, path, attr)
+        if attr.st_mode is not None and stat.S_ISDIR(attr.st_mode):
+            self.add_dir(path)
+        else:
+            self.add_dir(posixpath.dirname(path))
+
+    def invalidate(self, path, recursive=False):
+        """
+        使路径的缓存失效，同时使其上级目录的stat失效(目录的修改时间已改变)
+
+        :param path: 远程绝对路径
+        :param recursive: 是否同时使其下的所有路径失效(删除或重命名目录时)
+        """
+        path = self.normalize(path)
+        if path is None:
+            self.clear()
+            return
+        prefix = path.rstrip('/') + '/'
+        with self._lock:
+            self._stats['invalidations'] += 1
+            for table in (self._dirs, self._attrs):
+                table.pop(path, None)
+                if recursive:
+                    for key in [key for key in table if key.startswith(prefix)]:
+                        table.pop(key, None)
+            self._attrs.pop(posixpath.dirname(path), None)
+
+    def clear(self):
+        with self._lock:
+            self._dirs.clear()
+            self._attrs.clear()
+            self._values.clear()
+
+    def stats(self):
+        """
+        缓存统计
+
+        :return: {'hits', 'misses', 'invalidations', 'dirs', 'attrs'}
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['dirs'] = len(self._dirs)
+            stats['attrs'] = len(self._attrs)
+            return stats
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import sys
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .ssh import SSHTransport
+
+
+class FleetExecutor(object):
+    def __init__(self, configs, max_workers=32, timeout=30, pool=None, logger=None):
+        """
+        批量主机命令执行，每个主机在线程池中独立完成连接和执行，总耗时取决于最慢的主机
+
+        :param configs: SSHTransport配置列表
+        :param max_workers: 同时处理的主机数上限
+        :param timeout: 每个主机的超时(秒)，包括连接和执行命令，超时的主机返回超时结果并关闭其连接，超时的命令不重试
+        :param pool: 传给SSHTransport的连接池参数
+        :param logger: 指定日志输出
+        """
+        self.configs = configs
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.pool = pool
+        if isinstance(logger, logging.Logger):
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger(__name__)
+            if not self.logger.handlers:
+                stream_hander = logging.StreamHandler(sys.stdout)
+                stream_hander.setLevel(logging.DEBUG)
+                self.logger.addHandler(stream_hander)
+            self.logger.setLevel(logging.DEBUG)
+
+    @staticmethod
+    def host(config):
+        host = config.get('hostname', config.get('host'))
+        port = config.get('port', 22)
+        return host if port == 22 else '{}:{}'.format(host, port)
+
+    def _run(self, index, config, cmds, started, transports, kwargs):
+        started[index] = time.time()
+        config = dict(config)
+        if self.timeout:
+            for key in ('timeout', 'banner_timeout', 'auth_timeout'):
+                config.setdefault(key, self.timeout)
+            kwargs.setdefault('timeout', self.timeout)
+        transport = SSHTransport(config, logger=self.logger, pool=self.pool)
+        transports[index] = transport
+        try:
+            if transport.connect() != 0:
+                return {'code': -1, 'results': [], 'error': 'connect failed'}
+            results = []
+            for cmd in [cmds] if isinstance(cmds, str) else cmds:
+                if transports.get(index) is not transport:
+                    # 已超时，连接已被关闭，不再执行后面的命令(否则会重新连接)
+                    return {'code': -3, 'results': results, 'error': 'timeout'}
+                results.extend(transport.exec_command(cmd, **kwargs))
+            expect = 1 if isinstance(cmds, str) else len(cmds)
+            if len(results) < expect:
+                return {'code': -2, 'results': results, 'error': '{}/{} commands failed'.format(expect - len(results), expect)}
+            return {'code': 0, 'results': results, 'error': None}
+        except Exception as e:
+            return {'code': -1, 'results': [], 'error': str(e)}
+        finally:
+            transports.pop(index, None)
+            transport.close()
+
+    def _abort(self, index, transports):
+        """
+        关闭超时主机的连接，阻塞在读取输出上的线程随之结束，不会一直占用线程池
+        """
+        transport = transports.pop(index, None)
+        if transport is not None:
+            transport.close(discard=True)
+
+    def exec_command(self, cmds, **kwargs):
+        """
+        生成器，在所有主机上执行相同的命令，按完成顺序返回
+
+        :param cmds: 命令或命令列表
+        :param kwargs: SSHTransport.exec_command的关键字参数
+        :return: (host, result)
+            host: 主机名(端口不为22时为host:port)
+            result: {
+                'code': 0成功，-1连接失败或异常，-2部分命令执行失败，-3超时,
+                'results': exec_command返回的结果列表 [{'stdout': [...], 'stderr': [...]}, ...],
+                'error': 错误信息,
+                'elapsed': 耗时(秒)
+            }
+        """
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        started = {}
+        transports = {}
+        running = {}
+        try:
+            for index, config in enumerate(self.configs):
+                future = executor.submit(self._run, index, config, cmds, started, transports, dict(kwargs))
+                running[future] = (index, self.host(config))
+            while running:
+                now = time.time()
+                deadlines = [started[index] + self.timeout for index, _ in running.values() if index in started] if self.timeout else []
+                timeout = max(0, min(deadlines) - now) if deadlines else None
+                if self.timeout and len(deadlines) < len(running):
+                    # 还在排队的主机开始后需要重新计算超时
+                    timeout = 0.1 if timeout is None else min(timeout, 0.1)
+                done, _ = wait(list(running.keys()), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, host = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {'code': -1, 'results': [], 'error': str(e)}
+                    result['elapsed'] = time.time() - started.get(index, now)
+                    yield host, result
+                if self.timeout:
+                    now = time.time()
+                    for future, (index, host) in list(running.items()):
+                        if index in started and now - started[index] >= self.timeout:
+                            # 线程无法强制结束，关闭其连接使其尽快退出，不再等待其结果
+                            running.pop(future)
+                            self._abort(index, transports)
+                            self.logger.error('[Fleet] {} timeout after {}s'.format(host, self.timeout))
+                            yield host, {'code': -3, 'results': [], 'error': 'timeout', 'elapsed': now - started[index]}
+        finally:
+            executor.shutdown(wait=False)
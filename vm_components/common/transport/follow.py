@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import sys
+import time
+import logging
+import selectors
+from .ssh import SSHTransport
+
+
+class RemoteFollower(object):
+    def __init__(self, chunk_size=32768, max_line=65536, window_size=None, reopen=True, logger=None):
+        """
+        在一个线程中同时跟踪多个主机上的多个远程文件(类似tail -F)
+        每个文件一个长期打开的tail -F通道，通过selectors等待所有通道的数据，没有数据时不占用CPU
+
+        :param chunk_size: 每次读取的字节数
+        :param max_line: 单行的最大字节数，超过时拆分返回
+        :param window_size: SSH通道窗口大小(字节)，None使用paramiko默认值
+        :param reopen: 通道意外断开(如连接断开)时是否重新连接，并从已接收的字节位置继续跟踪，断开期间追加的内容不会丢失
+            (断开期间文件被轮转时无法继续原来的位置，可能丢失或重复部分内容)
+        :param logger: 指定日志输出
+        """
+        self.chunk_size = chunk_size
+        self.max_line = max_line
+        self.window_size = window_size
+        self.reopen = reopen
+        if isinstance(logger, logging.Logger):
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger(__name__)
+            if not self.logger.handlers:
+                stream_hander = logging.StreamHandler(sys.stdout)
+                stream_hander.setLevel(logging.DEBUG)
+                self.logger.addHandler(stream_hander)
+            self.logger.setLevel(logging.DEBUG)
+        self._selector = selectors.DefaultSelector()
+        self._follows = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def host(config):
+        host = config.get('hostname', config.get('host'))
+        port = config.get('port', 22)
+        return host if port == 22 else '{}:{}'.format(host, port)
+
+    def add(self, transport, path, tag=None, backlog=0):
+        """
+        添加跟踪的文件
+
+        :param transport: SSHTransport，同一个连接上的多个文件使用不同的通道
+        :param path: 远程文件绝对路径
+        :param tag: 返回数据时的标识，为None使用(host, path)
+        :param backlog: 开始时先返回文件末尾已有的行数，0只返回新内容，None从文件开头返回
+        :return: 成功返回0，失败返回-1
+        """
+        if tag is None:
+            tag = (self.host(transport.config), path)
+        if tag in self._follows:
+            self.remove(tag)
+        # offset: 下一个接收的字节在文件中的位置，重新打开时从这里继续
+        follow = {'transport': transport, 'path': path, 'tag': tag, 'channel': None, 'buffer': b'', 'offset': None}
+        if self._open(follow, backlog) != 0:
+            return -1
+        self._follows[tag] = follow
+        return 0
+
+    def _open(self, follow, backlog=0):
+        try:
+            channel, follow['offset'] = follow['transport']._follow_channel(
+                follow['path'], backlog, window_size=self.window_size, offset=follow['offset'])
+            if channel is None:
+                raise IOError('connect failed')
+        except Exception as e:
+            self.logger.error('follow {} error: {}'.format(follow['tag'], e))
+            return -1
+        follow['channel'] = channel
+        self._selector.register(channel.fileno(), selectors.EVENT_READ, follow)
+        return 0
+
+    def _close_channel(self, follow):
+        channel = follow['channel']
+        if channel is None:
+            return
+        follow['channel'] = None
+        try:
+            self._selector.unregister(channel.fileno())
+        except (KeyError, ValueError):
+            pass
+        channel.close()
+
+    def remove(self, tag):
+        """
+        停止跟踪文件，关闭对应的通道
+        """
+        follow = self._follows.pop(tag, None)
+        if follow is not None:
+            self._close_channel(follow)
+
+    @property
+    def tags(self):
+        return list(self._follows)
+
+    def _read(self, follow, items):
+        channel = follow['channel']
+        while channel.recv_ready():
+            data = channel.recv(self.chunk_size)
+            if not data:
+                break
+            follow['offset'] += len(data)
+            lines, follow['buffer'] = SSHTransport._split_lines(follow['buffer'] + data, self.max_line)
+            items.extend((follow['tag'], line) for line in lines)
+        while channel.recv_stderr_ready():
+            data = channel.recv_stderr(self.chunk_size)
+            if data:
+                # tail报告的文件轮转、截断等信息
+                message = data.decode('utf-8', 'replace').strip()
+                self.logger.info('follow {}: {}'.format(follow['tag'], message))
+                if any(word in message for word in ('truncated', 'replaced', 'appeared')):
+                    # tail从新文件(或截断后的文件)的开头继续读取
+                    follow['offset'] = 0
+        if (channel.eof_received or channel.closed) and not channel.recv_ready() and not channel.recv_stderr_ready():
+            self._finish(follow, items)
+
+    def _finish(self, follow, items):
+        channel = follow['channel']
+        if not channel.exit_status_ready():
+            # EOF可能先于退出码到达，有限等待，连接断开时通道关闭也会结束等待
+            channel.status_event.wait(1)
+        status = channel.recv_exit_status() if channel.exit_status_ready() else -1
+        self._close_channel(follow)
+        self.logger.error('follow {} exit: {}'.format(follow['tag'], status))
+        if self.reopen and status == -1:
+            # 没有退出码说明通道或连接意外断开，tail自身退出(如命令不存在)时不再重试
+            transport = follow['transport']
+            client = transport._ssh
+            if client is not None and not client.get_transport().is_active():
+                # 丢弃已断开的连接，打开通道时重新连接(复用模式下为直接连接)
+                transport.close(discard=True)
+            if self._open(follow) == 0:
+                # 从已接收的位置继续，未结束的行继续拼接
+                self.logger.info('follow {} reopened at {}'.format(follow['tag'], follow['offset']))
+                return
+        if follow['buffer']:
+            items.append((follow['tag'], follow['buffer'].rstrip(b'\r\n').decode('utf-8', 'replace')))
+            follow['buffer'] = b''
+        self._follows.pop(follow['tag'], None)
+
+    def poll(self, timeout=None):
+        """
+        等待任意文件的新内容
+
+        :param timeout: 最长等待时间(秒)，None表示一直等待到有新内容
+        :return: [(tag, line), ...]，超时返回空列表
+        """
+        if not self._follows:
+            return []
+        items = []
+        for key, _ in self._selector.select(timeout):
+            if key.data['channel'] is not None:
+                self._read(key.data, items)
+        return items
+
+    def follow(self, timeout=None):
+        """
+        生成器，持续返回所有文件新追加的行，所有文件都停止跟踪后结束
+
+        :param timeout: 超过该时间(秒)所有文件都没有新内容时结束，None表示一直跟踪
+        :return: (tag, line)
+        """
+        last_active = time.time()
+        while self._follows:
+            wait = None if timeout is None else timeout - (time.time() - last_active)
+            if wait is not None and wait <= 0:
+                return
+            items = self.poll(wait)
+            if items:
+                last_active = time.time()
+            for item in items:
+                yield item
+
+    def __iter__(self):
+        return self.follow()
+
+    def close(self):
+        """
+        停止跟踪所有文件，不关闭SSHTransport
+        """
+        for tag in list(self._follows):
+            self.remove(tag)
+        self._selector.close()
@@ -0,0 +1,601 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import os
+import sys
+import json
+import time
+import stat
+import base64
+import socket
+import struct
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+import paramiko
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+from .pool import SSHConnectionPool
+
+# 可以通过复用守护进程执行的SSHTransport方法
+MUX_METHODS = (
+    'exec_command', 'exec_command_stream', 'exec_command_batch',
+    'upload', 'download', 'upload_large', 'download_large', 'upload_tree', 'download_tree',
+    'upload_archive', 'download_archive', 'sync', 'remote_digests', 'remote_digest', 'verify', 'stat',
+    'mkdir', 'chdir', 'listdir', 'rmdir', 'remove', 'rename', 'chmod', 'chown',
+)
+
+# 方法 -> (本地路径参数的位置, 参数名)，转发前转换为绝对路径
+MUX_LOCAL_PATHS = {
+    'upload': (0, 'file_path'),
+    'download': (1, 'file_path'),
+    'upload_large': (0, 'file_path'),
+    'download_large': (1, 'file_path'),
+    'upload_tree': (0, 'local_dir'),
+    'download_tree': (1, 'local_dir'),
+    'upload_archive': (0, 'local_dir'),
+    'download_archive': (1, 'local_dir'),
+    'sync': (0, 'local_dir'),
+}
+
+class MuxError(IOError):
+    """
+    与守护进程通信失败
+    """
+
+
+class MuxSendError(MuxError):
+    """
+    请求没有发送给守护进程(无法连接、参数无法序列化或发送失败)，守护进程没有执行，可以改为直接执行
+    """
+
+
+_ATTR_FIELDS = ('st_size', 'st_uid', 'st_gid', 'st_mode', 'st_atime', 'st_mtime', 'filename')
+
+
+def default_socket_path():
+    """
+    默认的Unix socket路径，每个用户一个，优先使用只有当前用户可以访问的$XDG_RUNTIME_DIR，
+    否则使用临时目录下按uid区分的目录(所在目录必须属于当前用户且权限为0700，见check_socket_dir)
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, 'vm_ssh_mux', 'mux.sock')
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return os.path.join(tempfile.gettempdir(), 'vm_ssh_mux_{}'.format(uid), 'mux.sock')
+
+
+def check_socket_dir(directory):
+    """
+    检查socket所在目录只有当前用户可以访问，请求中包含SSH配置(密码等)，
+    防止其他用户在公共的临时目录中预先创建该目录或替换为符号链接后截获请求或冒充守护进程
+
+    :return: 安全返回None，否则返回原因
+    """
+    try:
+        st = os.lstat(directory)
+    except OSError as e:
+        return str(e)
+    if not stat.S_ISDIR(st.st_mode):
+        return '{} is not a directory'.format(directory)
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        return '{} is owned by uid {}'.format(directory, st.st_uid)
+    if stat.S_IMODE(st.st_mode) != 0o700:
+        return '{} has mode {:o}, expected 700'.format(directory, stat.S_IMODE(st.st_mode))
+    return None
+
+
+def peer_uid(sock):
+    """
+    Unix socket对端进程的uid
+
+    :return: 平台不支持SO_PEERCRED时返回None
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+
+def _same_user(sock):
+    uid = peer_uid(sock)
+    return uid is None or not hasattr(os, 'getuid') or uid == os.getuid()
+
+
+def encode(value):
+    """
+    把返回值转换为可以JSON序列化的对象
+    """
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, paramiko.SFTPAttributes):
+        return {'__attr__': dict((field, getattr(value, field, None)) for field in _ATTR_FIELDS)}
+    if isinstance(value, dict):
+        return dict((key, encode(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    return value
+
+
+def decode(value):
+    if isinstance(value, dict):
+        if '__bytes__' in value:
+            return base64.b64decode(value['__bytes__'])
+        if '__attr__' in value:
+            attr = paramiko.SFTPAttributes()
+            for field, item in value['__attr__'].items():
+                setattr(attr, field, item)
+            return attr
+        return dict((key, decode(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    return value
+
+
+class _ClientClosed(Exception):
+    pass
+
+
+def _send(sock, message):
+    sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+
+def _reply(sock, message):
+    # 服务端回复失败说明客户端已断开，和远程操作的IOError区分开
+    try:
+        _send(sock, message)
+    except socket.error as e:
+        raise _ClientClosed(e)
+
+
+class _LineReader(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b''
+
+    def read(self):
+        while b'\n' not in self.buffer:
+            data = self.sock.recv(65536)
+            if not data:
+                return None
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return json.loads(line.decode('utf-8'))
+
+
+class SSHMuxServer(object):
+    def __init__(self, socket_path=None, pool=None, idle_timeout=600, logger=None):
+        """
+        SSH连接复用守护进程(类似OpenSSH的ControlMaster)，通过Unix socket为本机的其他进程提供已认证的连接
+        协议为每行一个JSON对象:
+            请求: {'op': 'call', 'config': SSH配置, 'method': SSHTransport方法名, 'args': [...], 'kwargs': {...}}
+                 {'op': 'ping'} / {'op': 'stats'} / {'op': 'shutdown'}
+            响应: 生成器方法每个元素一行{'item': ...}，最后一行{'result': ...}或{'error': ..., 'type': 异常类名}
+        同一个客户端连接上相同配置的请求使用同一个SSHTransport，客户端断开后连接归还连接池继续保持
+
+        :param socket_path: Unix socket路径，为None使用default_socket_path()
+        :param pool: SSHConnectionPool，为None时创建一个空闲连接保持idle_timeout秒的连接池
+        :param idle_timeout: 没有客户端连接超过该时间(秒)后退出，0表示不退出
+        :param logger: 指定日志输出
+        """
+        self.socket_path = socket_path or default_socket_path()
+        self.idle_timeout = idle_timeout
+        if isinstance(logger, logging.Logger):
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger(__name__)
+            if not self.logger.handlers:
+                stream_hander = logging.StreamHandler(sys.stdout)
+                stream_hander.setLevel(logging.DEBUG)
+                self.logger.addHandler(stream_hander)
+            self.logger.setLevel(logging.DEBUG)
+        self.pool = pool or SSHConnectionPool(idle_timeout=idle_timeout or 600, logger=self.logger)
+        self._sock = None
+        self._lock = threading.Lock()
+        self._clients = 0
+        self._last_active = time.time()
+        self._stopped = threading.Event()
+        self._stats = {'clients': 0, 'requests': 0, 'errors': 0}
+
+    def _bind(self):
+        directory = os.path.dirname(self.socket_path)
+        if not os.path.lexists(directory):
+            parent = os.path.dirname(directory)
+            if parent and not os.path.exists(parent):
+                os.makedirs(parent)
+            try:
+                os.mkdir(directory, 0o700)
+            except OSError:
+                # 同时启动的其他守护进程已经创建
+                pass
+        reason = check_socket_dir(directory)
+        if reason is not None:
+            raise RuntimeError('insecure mux socket directory: {}'.format(reason))
+        if os.path.exists(self.socket_path):
+            try:
+                # 已经有守护进程在运行
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                probe.connect(self.socket_path)
+                probe.close()
+                raise RuntimeError('mux server already running at {}'.format(self.socket_path))
+            except socket.error:
+                os.remove(self.socket_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            sock.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        sock.listen(128)
+        return sock
+
+    def serve_forever(self):
+        """
+        开始服务，直到shutdown或空闲超时
+        """
+        self._sock = self._bind()
+        self._sock.settimeout(1.0)
+        self.logger.info('[SSHMuxServer] listening on {}'.format(self.socket_path))
+        try:
+            while not self._stopped.is_set():
+                try:
+                    client, _ = self._sock.accept()
+                except socket.timeout:
+                    with self._lock:
+                        idle = self._clients == 0 and time.time() - self._last_active > self.idle_timeout
+                    if self.idle_timeout and idle:
+                        self.logger.info('[SSHMuxServer] idle for {}s, exit'.format(self.idle_timeout))
+                        break
+                    continue
+                client.settimeout(None)
+                if not _same_user(client):
+                    # 只为同一个用户的进程提供连接
+                    self.logger.error('[SSHMuxServer] reject client of uid {}'.format(peer_uid(client)))
+                    client.close()
+                    continue
+                thread = threading.Thread(target=self._handle_client, args=(client,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self._sock.close()
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+            self.pool.close_all()
+
+    def shutdown(self):
+        self._stopped.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['active_clients'] = self._clients
+        stats['pool'] = self.pool.stats()
+        return stats
+
+    def _handle_client(self, client):
+        from .ssh import SSHTransport
+        with self._lock:
+            self._clients += 1
+            self._stats['clients'] += 1
+        transports = {}
+        reader = _LineReader(client)
+        try:
+            while True:
+                request = reader.read()
+                if request is None:
+                    break
+                with self._lock:
+                    self._stats['requests'] += 1
+                    self._last_active = time.time()
+                op = request.get('op')
+                if op == 'ping':
+                    _send(client, {'result': 'pong'})
+                elif op == 'stats':
+                    _send(client, {'result': self.stats()})
+                elif op == 'shutdown':
+                    _send(client, {'result': 0})
+                    self.shutdown()
+                elif op == 'call':
+                    config = request.get('config') or {}
+                    key = json.dumps(config, sort_keys=True)
+                    if key not in transports:
+                        transports[key] = SSHTransport(config, logger=self.logger, pool=self.pool)
+                    self._call(client, transports[key], request)
+                else:
+                    _send(client, {'error': 'unknown op: {}'.format(op), 'type': 'ValueError'})
+        except Exception as e:
+            self.logger.error('[SSHMuxServer] client error: {}'.format(e))
+        finally:
+            for transport in transports.values():
+                transport.close()
+            client.close()
+            with self._lock:
+                self._clients -= 1
+                self._last_active = time.time()
+
+    def _call(self, client, transport, request):
+        method = request.get('method')
+        try:
+            if method == 'home':
+                _reply(client, {'result': transport.home})
+                return
+            if method == 'connect':
+                _reply(client, {'result': 0 if transport.ssh is not None else -1})
+                return
+            if method not in MUX_METHODS:
+                raise ValueError('unsupported method: {}'.format(method))
+            kwargs = decode(request.get('kwargs') or {})
+            if 'callback' in kwargs:
+                # 进度回调无法跨进程传递
+                kwargs['callback'] = None
+            elif method in MUX_LOCAL_PATHS:
+                kwargs['callback'] = None
+            result = getattr(transport, method)(*decode(request.get('args') or []), **kwargs)
+            if method.startswith('exec_command'):
+                for item in result:
+                    _reply(client, {'item': encode(item)})
+                result = None
+            _reply(client, {'result': encode(result)})
+        except _ClientClosed:
+            raise
+        except Exception as e:
+            with self._lock:
+                self._stats['errors'] += 1
+            _reply(client, {'error': str(e), 'type': type(e).__name__})
+
+
+class _MuxConnection(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = _LineReader(sock)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+
+class MuxClient(object):
+    # 最多保留的空闲连接数
+    MAX_IDLE = 2
+
+    def __init__(self, socket_path=None, timeout=None):
+        """
+        SSH连接复用守护进程的客户端，每个进行中的请求(包括迭代中的生成器调用)独占一个到守护进程的连接，
+        依次调用时总是复用同一个连接；生成器迭代过程中或其他线程同时调用时才建立额外的连接
+
+        :param socket_path: Unix socket路径，为None使用default_socket_path()
+        :param timeout: socket超时(秒)
+        """
+        self.socket_path = socket_path or default_socket_path()
+        self.timeout = timeout
+        self._idle = []
+        self._busy = 0
+        self._lock = threading.Lock()
+
+    def connect(self, autostart=False, start_timeout=5, idle_timeout=600):
+        """
+        连接守护进程
+
+        :param autostart: 守护进程没有运行时是否在后台启动一个
+        :param start_timeout: 等待守护进程启动的时间(秒)
+        :param idle_timeout: 启动守护进程时的空闲退出时间(秒)
+        :return: 成功返回0，失败返回-1
+        """
+        if self._try_connect() == 0:
+            return 0
+        if not autostart:
+            return -1
+        directory = os.path.dirname(self.socket_path)
+        if os.path.lexists(directory) and check_socket_dir(directory) is not None:
+            # 目录不安全时守护进程也无法启动
+            return -1
+        self.spawn(self.socket_path, idle_timeout)
+        deadline = time.time() + start_timeout
+        while time.time() < deadline:
+            if self._try_connect() == 0:
+                return 0
+            time.sleep(0.05)
+        return -1
+
+    def _open(self):
+        """
+        建立一个到守护进程的连接
+
+        :return: _MuxConnection，失败返回None
+        """
+        if check_socket_dir(os.path.dirname(self.socket_path)) is not None:
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error:
+            sock.close()
+            return None
+        if not _same_user(sock):
+            # 发送SSH配置之前确认守护进程属于当前用户
+            sock.close()
+            return None
+        sock.settimeout(self.timeout)
+        return _MuxConnection(sock)
+
+    def _try_connect(self):
+        conn = self._open()
+        if conn is None:
+            return -1
+        with self._lock:
+            self._idle.append(conn)
+        return 0
+
+    @staticmethod
+    def spawn(socket_path=None, idle_timeout=600):
+        """
+        在后台启动守护进程，与当前进程的会话分离，当前进程退出后继续运行
+        """
+        cmd = [sys.executable, '-m', __name__, '--socket', socket_path or default_socket_path(),
+               '--idle-timeout', str(idle_timeout), '--quiet']
+        with open(os.devnull, 'r+b') as devnull:
+            kwargs = {'stdin': devnull, 'stdout': devnull, 'stderr': devnull, 'close_fds': True}
+            if hasattr(os, 'setsid'):
+                kwargs['start_new_session'] = True
+            return subprocess.Popen(cmd, **kwargs)
+
+    @property
+    def connected(self):
+        with self._lock:
+            return self._busy > 0 or any(not conn.closed for conn in self._idle)
+
+    def close(self):
+        """
+        关闭空闲的连接，进行中的请求结束后归还的连接可以继续使用
+        """
+        with self._lock:
+            conns, self._idle = self._idle, []
+        for conn in conns:
+            conn.close()
+
+    def _checkout(self):
+        """
+        取出一个空闲连接，没有时建立新的连接
+        """
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if not conn.closed:
+                    self._busy += 1
+                    return conn
+        conn = self._open()
+        if conn is None:
+            raise MuxSendError('mux client not connected')
+        with self._lock:
+            self._busy += 1
+        return conn
+
+    def _checkin(self, conn, reusable=True):
+        """
+        归还连接，响应没有读取完(reusable为False)或连接出错时关闭
+        """
+        with self._lock:
+            self._busy -= 1
+            if reusable and not conn.closed and len(self._idle) < self.MAX_IDLE:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _call(self, message):
+        conn = self._checkout()
+        finished = False
+        try:
+            for response in self._request(conn, message):
+                if 'error' in response:
+                    finished = True
+                    self._raise(response)
+                if 'result' in response:
+                    finished = True
+                    return decode(response['result'])
+            finished = True
+        except MuxError:
+            # 参数无法序列化时连接仍然可用，其他错误已经关闭了连接
+            finished = True
+            raise
+        finally:
+            self._checkin(conn, reusable=finished)
+
+    @staticmethod
+    def _request(conn, message):
+        try:
+            _send(conn.sock, message)
+        except (TypeError, ValueError) as e:
+            # 参数无法JSON序列化，还没有发送任何数据，连接可以继续使用
+            raise MuxSendError('mux encode error: {}'.format(e))
+        except socket.error as e:
+            conn.close()
+            raise MuxSendError('mux send error: {}'.format(e))
+        while True:
+            try:
+                response = conn.reader.read()
+            except socket.error as e:
+                response = None
+            if response is None:
+                conn.close()
+                raise MuxError('mux server closed connection')
+            yield response
+            if 'item' not in response:
+                break
+
+    @staticmethod
+    def _raise(response):
+        # 还原为内置的异常类型，其他异常统一为IOError
+        error_type = getattr(builtins, response.get('type', ''), None)
+        if not (isinstance(error_type, type) and issubclass(error_type, Exception)):
+            error_type = IOError
+        raise error_type(response['error'])
+
+    def request(self, op, **kwargs):
+        """
+        发送请求并返回结果
+
+        :return: 响应中的result，失败时抛出异常
+        """
+        return self._call(dict(kwargs, op=op))
+
+    def call(self, config, method, args=(), kwargs=None):
+        """
+        调用SSHTransport的方法
+
+        :return: 方法的返回值
+        """
+        return self._call({'op': 'call', 'config': config, 'method': method, 'args': encode(list(args)),
+                           'kwargs': encode(kwargs or {})})
+
+    def call_iter(self, config, method, args=(), kwargs=None):
+        """
+        生成器，调用SSHTransport的生成器方法，边接收边返回
+        迭代期间独占一个连接，不持有锁，迭代过程中(或其他线程)可以继续调用其他方法
+        """
+        message = {'op': 'call', 'config': config, 'method': method, 'args': encode(list(args)),
+                   'kwargs': encode(kwargs or {})}
+        conn = self._checkout()
+        finished = False
+        try:
+            for response in self._request(conn, message):
+                if 'error' in response:
+                    finished = True
+                    self._raise(response)
+                if 'item' in response:
+                    item = decode(response['item'])
+                    yield tuple(item) if isinstance(item, list) else item
+            finished = True
+        except MuxError:
+            finished = True
+            raise
+        finally:
+            # 调用方提前结束时剩余的响应无法丢弃，关闭该连接
+            self._checkin(conn, reusable=finished)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SSH connection multiplexing daemon')
+    parser.add_argument('--socket', default=None, help='unix socket path')
+    parser.add_argument('--idle-timeout', type=int, default=600, help='exit after idle seconds, 0 means never')
+    parser.add_argument('--quiet', action='store_true', help='only log errors')
+    args = parser.parse_args()
+    logger = logging.getLogger(__name__)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    logger.setLevel(logging.ERROR if args.quiet else logging.INFO)
+    SSHMuxServer(args.socket, idle_timeout=args.idle_timeout, logger=logger).serve_forever()
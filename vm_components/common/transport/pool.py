@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import sys
+import time
+import socket
+import logging
+import threading
+
+
+class _PooledConnection(object):
+    def __init__(self, key, client):
+        self.key = key
+        self.client = client
+        self.leases = 0
+        self.broken = False
+        self.created = time.time()
+        self.last_used = self.created
+
+
+class SSHConnectionPool(object):
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, max_per_host=4, idle_timeout=300, keepalive=15, probe_after=5, probe_timeout=1.0,
+                 logger=None):
+        """
+        SSH连接池，按(host, port, username)复用已认证的paramiko.SSHClient
+        同一个连接上可以同时打开多个通道，所以连接数达到max_per_host后新的使用者会共用负载最少的连接
+        连接断开的检测: 本端已知关闭的连接在取出时立即发现；对端无响应(如网络中断)的连接只能通过
+        keepalive，或空闲超过probe_after后取出时的一次往返探测(最多等待probe_timeout)发现
+
+        :param max_per_host: 每个(host, port, username)最多保持的连接数
+        :param idle_timeout: 空闲(没有使用者)超过该时间(秒)的连接会被关闭，池中有连接时由后台线程定期检查，
+            同时关闭已经断开的空闲连接，None表示不关闭空闲连接
+        :param keepalive: SSH层keepalive间隔(秒)，同时开启TCP keepalive，0表示不开启
+        :param probe_after: 连接空闲超过该时间(秒)后，取出前通过打开一个通道做一次往返探测，
+            空闲时间更短的连接不做探测，直接交给使用者
+        :param probe_timeout: 往返探测的超时(秒)，超时视为连接已断开，探测时取出连接最多因此多等待该时间
+        :param logger: 指定日志输出
+        """
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.probe_after = probe_after
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Condition()
+        self._connections = {}
+        self._creating = {}
+        self._clients = {}
+        self._sweeper = None
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'shared': 0,
+            'discarded': 0,
+            'evicted': 0,
+        }
+        if isinstance(logger, logging.Logger):
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger(__name__)
+            if not self.logger.handlers:
+                stream_hander = logging.StreamHandler(sys.stdout)
+                stream_hander.setLevel(logging.DEBUG)
+                self.logger.addHandler(stream_hander)
+            self.logger.setLevel(logging.DEBUG)
+
+    @classmethod
+    def default(cls):
+        """
+        进程内共享的默认连接池
+        """
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls()
+        return cls._default
+
+    @staticmethod
+    def key(config):
+        return (config.get('hostname', config.get('host')), config.get('port', 22), config.get('username'))
+
+    def _enable_keepalive(self, client):
+        if not self.keepalive:
+            return
+        transport = client.get_transport()
+        transport.set_keepalive(self.keepalive)
+        sock = transport.sock
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, self.keepalive // 3))
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+        except Exception:
+            # 使用代理等非socket对象时忽略
+            pass
+
+    def is_healthy(self, client, probe=False):
+        """
+        检查连接是否可用
+        先检查transport状态并发送SSH_MSG_IGNORE，只能发现本端已经知道关闭的连接(如已收到对端的FIN/RST)，
+        probe为True时再打开一个通道做一次往返，对端无响应超过probe_timeout视为断开
+
+        :return: 可用返回True
+        """
+        try:
+            transport = client.get_transport()
+            if transport is None or not transport.is_active() or not transport.is_authenticated():
+                return False
+            transport.send_ignore()
+            if probe:
+                channel = transport.open_session(timeout=self.probe_timeout)
+                channel.close()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self, config, connect):
+        """
+        取出一个可用连接
+
+        :param config: SSHTransport的配置
+        :param connect: 创建新连接的函数，返回已连接的paramiko.SSHClient，失败时抛出异常
+        :return: paramiko.SSHClient
+        """
+        key = self.key(config)
+        self._sweep()
+        while True:
+            with self._lock:
+                while True:
+                    conns = self._connections.setdefault(key, [])
+                    idle = [conn for conn in conns if conn.leases == 0]
+                    if idle:
+                        conn = max(idle, key=lambda c: c.last_used)
+                        stat_key = 'reused'
+                    elif len(conns) + self._creating.get(key, 0) >= self.max_per_host:
+                        if not conns:
+                            # 连接都还在创建中，等待创建完成后共用
+                            self._lock.wait()
+                            continue
+                        conn = min(conns, key=lambda c: c.leases)
+                        stat_key = 'shared'
+                    else:
+                        conn = None
+                        self._creating[key] = self._creating.get(key, 0) + 1
+                    break
+                if conn is not None:
+                    conn.leases += 1
+                    idle_time = time.time() - conn.last_used
+            if conn is None:
+                break
+            healthy = self.is_healthy(conn.client, probe=conn.leases == 1 and idle_time > self.probe_after)
+            with self._lock:
+                # 检查期间其他使用者可能已经丢弃了该连接
+                if healthy and not conn.broken:
+                    conn.last_used = time.time()
+                    self._stats[stat_key] += 1
+                    return conn.client
+                conn.leases -= 1
+            if healthy:
+                self.logger.debug('[SSHConnectionPool] connection to {}:{} discarded while acquiring'.format(key[0], key[1]))
+            else:
+                self.logger.debug('[SSHConnectionPool] drop dead connection to {}:{}'.format(key[0], key[1]))
+            self._discard(conn)
+        try:
+            client = connect()
+            self._enable_keepalive(client)
+        except Exception:
+            with self._lock:
+                self._creating[key] -= 1
+                self._lock.notify_all()
+            raise
+        conn = _PooledConnection(key, client)
+        conn.leases = 1
+        with self._lock:
+            self._creating[key] -= 1
+            self._connections.setdefault(key, []).append(conn)
+            self._clients[id(client)] = conn
+            self._stats['created'] += 1
+            self._lock.notify_all()
+            self._start_sweeper()
+        return client
+
+    def release(self, client, discard=False):
+        """
+        归还连接
+
+        :param client: acquire返回的连接
+        :param discard: 是否丢弃该连接(如执行命令出错时)，
+            其他使用者还在共用该连接时只标记为已损坏，不再分配给新的使用者，最后一个使用者归还后才关闭
+        """
+        with self._lock:
+            conn = self._clients.get(id(client))
+            if conn is None:
+                return
+            conn.leases = max(0, conn.leases - 1)
+            conn.last_used = time.time()
+            broken = conn.broken
+        if broken or discard or not self.is_healthy(client):
+            self._discard(conn)
+        self._sweep()
+
+    def _discard(self, conn):
+        """
+        丢弃连接，还有使用者时只标记为已损坏，没有使用者时关闭
+        """
+        with self._lock:
+            conns = self._connections.get(conn.key, [])
+            if conn in conns:
+                conns.remove(conn)
+                self._stats['discarded'] += 1
+            conn.broken = True
+            if conn.leases > 0:
+                return
+            self._clients.pop(id(conn.client), None)
+        try:
+            conn.client.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_active(client):
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def _start_sweeper(self):
+        # 调用时需持有_lock
+        if self._sweeper is not None or self.idle_timeout is None:
+            return
+        self._sweeper = threading.Thread(target=self._sweep_loop, name='SSHConnectionPool-sweeper')
+        self._sweeper.daemon = True
+        self._sweeper.start()
+
+    def _sweep_loop(self):
+        """
+        后台定期关闭空闲超时或已断开的空闲连接，池中没有连接时退出，创建新连接时再启动
+        """
+        interval = max(0.1, min(self.idle_timeout / 2.0, 30))
+        while True:
+            time.sleep(interval)
+            self._sweep()
+            with self._lock:
+                if not any(self._connections.values()) and not any(self._creating.values()):
+                    self._sweeper = None
+                    return
+
+    def _sweep(self):
+        if self.idle_timeout is None:
+            return
+        now = time.time()
+        expired = []
+        with self._lock:
+            for key, conns in self._connections.items():
+                for conn in list(conns):
+                    if conn.leases == 0 and (now - conn.last_used > self.idle_timeout or not self._is_active(conn.client)):
+                        conns.remove(conn)
+                        self._clients.pop(id(conn.client), None)
+                        self._stats['evicted'] += 1
+                        expired.append(conn)
+        for conn in expired:
+            try:
+                conn.client.close()
+            except Exception:
+                pass
+
+    def close_all(self):
+        """
+        关闭连接池中的所有连接
+        """
+        with self._lock:
+            conns = [conn for items in self._connections.values() for conn in items]
+            self._connections.clear()
+            self._clients.clear()
+        for conn in conns:
+            try:
+                conn.client.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        """
+        连接池统计
+
+        :return: {'created', 'reused', 'shared', 'discarded', 'evicted', 'connections', 'leases'}
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['connections'] = sum(len(conns) for conns in self._connections.values())
+            stats['leases'] = sum(conn.leases for conns in self._connections.values() for conn in conns)
+            return stats
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2019, UFactory, Inc.
+# All rights reserved.
+#
+# Author: Vinman <vinman.wen@ufactory.cc>
+
+import io
+import threading
+from collections import OrderedDict
+
+
+class RemoteFileReader(io.RawIOBase):
+    def __init__(self, sftp, path, block_size=256 * 1024, readahead=4, max_blocks=64, close_sftp=False):
+        """
+        远程文件的随机读取对象，支持with、seek/tell、read/readinto、readline和按行迭代
+        文件按block_size分块读取并缓存(LRU)，只读取实际访问到的块:
+            顺序读取时通过一次readv预读后续readahead个块，反向读取(reverse_lines)时预读前面的块，
+            随机跳转(如按时间二分查找)时只读取目标块
+
+        :param sftp: paramiko.SFTPClient
+        :param path: 远程文件绝对路径
+        :param block_size: 每块的字节数
+        :param readahead: 预读的块数，0表示不预读
+        :param max_blocks: 最多缓存的块数
+        :param close_sftp: close时是否同时关闭sftp(专门为该对象打开的SFTPClient)
+        """
+        super(RemoteFileReader, self).__init__()
+        self.path = path
+        self.block_size = block_size
+        self.readahead = readahead
+        self.max_blocks = max(max_blocks, readahead + 1)
+        self._sftp = sftp if close_sftp else None
+        self._file = sftp.open(path, 'rb')
+        self._size = self._file.stat().st_size
+        self._pos = 0
+        self._last_block = None
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'requests': 0,
+            'bytes': 0,
+        }
+
+    @property
+    def size(self):
+        return self._size
+
+    def refresh(self):
+        """
+        重新获取文件大小(文件在持续增长时)，最后一块的缓存失效
+
+        :return: 新的文件大小
+        """
+        with self._lock:
+            size = self._file.stat().st_size
+            if size != self._size:
+                if size < self._size:
+                    # 文件被截断，缓存全部失效
+                    self._blocks.clear()
+                else:
+                    self._blocks.pop(self._size // self.block_size, None)
+                self._size = size
+            return self._size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError('invalid whence: {}'.format(whence))
+        if pos < 0:
+            raise ValueError('negative seek position {}'.format(pos))
+        self._pos = pos
+        return pos
+
+    def _fetch(self, indexes):
+        ranges = [(index * self.block_size, min(self.block_size, self._size - index * self.block_size))
+                  for index in indexes]
+        self._stats['requests'] += 1
+        for index, data in zip(indexes, self._file.readv(ranges)):
+            self._stats['bytes'] += len(data)
+            self._blocks[index] = data
+        while len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+
+    def _block(self, index):
+        with self._lock:
+            data = self._blocks.get(index)
+            if data is not None:
+                self._stats['hits'] += 1
+                self._blocks.move_to_end(index)
+            else:
+                self._stats['misses'] += 1
+                last = (self._size - 1) // self.block_size
+                if self._last_block is None or index in (self._last_block, self._last_block + 1):
+                    indexes = range(index, min(index + self.readahead, last) + 1)
+                elif index == self._last_block - 1:
+                    indexes = range(max(index - self.readahead, 0), index + 1)
+                else:
+                    indexes = [index]
+                self._fetch([i for i in indexes if i not in self._blocks])
+                data = self._blocks[index]
+            self._last_block = index
+            return data
+
+    def _current(self):
+        """
+        当前位置所在块的数据和块内偏移，到达文件末尾返回(b'', 0)
+        """
+        if self._pos >= self._size:
+            return b'', 0
+        index = self._pos // self.block_size
+        return self._block(index), self._pos - index * self.block_size
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        count = 0
+        while count < len(view):
+            data, offset = self._current()
+            length = min(len(data) - offset, len(view) - count)
+            if length <= 0:
+                break
+            view[count:count + length] = data[offset:offset + length]
+            count += length
+            self._pos += length
+        return count
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(self._size - self._pos, 0)
+        buffer = bytearray(size)
+        count = self.readinto(buffer)
+        return bytes(buffer[:count])
+
+    def readall(self):
+        return self.read()
+
+    def readline(self, size=-1):
+        parts = []
+        count = 0
+        while size is None or size < 0 or count < size:
+            data, offset = self._current()
+            if not data:
+                break
+            end = len(data) if size is None or size < 0 else min(len(data), offset + size - count)
+            newline = data.find(b'\n', offset, end)
+            if newline >= 0:
+                end = newline + 1
+            parts.append(data[offset:end])
+            count += end - offset
+            self._pos += end - offset
+            if newline >= 0:
+                break
+        return b''.join(parts)
+
+    def reverse_lines(self):
+        """
+        生成器，从文件末尾向前逐行返回(包含换行符)，用于查看文件尾部，不改变当前读取位置
+        """
+        rest = b''
+        index = (self._size - 1) // self.block_size
+        while index >= 0:
+            buffer = self._block(index) + rest
+            stop = len(buffer)
+            while stop > 0:
+                newline = buffer.rfind(b'\n', 0, stop - 1)
+                if newline < 0:
+                    break
+                yield buffer[newline + 1:stop]
+                stop = newline + 1
+            rest = buffer[:stop]
+            index -= 1
+        if rest:
+            yield rest
+
+    def stats(self):
+        """
+        读取统计
+
+        :return: {'hits': 块缓存命中数, 'misses': 未命中数, 'requests': readv请求数, 'bytes': 从远程读取的字节数, 'blocks': 缓存的块数}
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['blocks'] = len(self._blocks)
+            return stats
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._file.close()
+            except Exception:
+                pass
+            if self._sftp is not None:
+                try:
+                    self._sftp.close()
+                except Exception:
+                    pass
+            self._blocks.clear()
+        super(RemoteFileReader, self).close()
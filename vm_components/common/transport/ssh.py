@@ -8,17 +8,115 @@
 # Author: Vinman <vinman.wen@ufactory.cc>
 
 import os
+import re
 import sys
+import stat
+import time
+import select
+import socket
+import json
+import hashlib
+import binascii
 import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import paramiko
 from paramiko.common import o777, o644
 from posixpath import join as urljoin
-from collections import Iterable
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+try:
+    from collections.abc import Iterable
+except ImportError:
+    from collections import Iterable
 from .base import AbstractTransport
+from .pool import SSHConnectionPool
+from .cache import RemoteMetadataCache
+from .reader import RemoteFileReader
+from .archive import COMPRESSORS, ArchiveWriter, pack_dir, extract_stream
+from .mux import MuxClient, MuxError, MuxSendError, MUX_LOCAL_PATHS
+
+
+# 校验算法 -> 远程计算摘要的命令
+HASH_COMMANDS = {
+    'md5': 'md5sum',
+    'sha1': 'sha1sum',
+    'sha256': 'sha256sum',
+    'sha512': 'sha512sum',
+}
+
+
+class _HashingFile(object):
+    """
+    包装文件对象，读写的同时计算摘要，传给sftp.putfo/getfo
+    """
+    def __init__(self, fileobj, hasher):
+        self.fileobj = fileobj
+        self.hasher = hasher
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hasher.update(data)
+        return data
+
+    def write(self, data):
+        self.hasher.update(data)
+        return self.fileobj.write(data)
+
+
+def _multiplexed(func):
+    """
+    复用模式下把方法转发给守护进程执行，守护进程不可用或请求没有发送出去时直接执行
+    请求已经发送后出错(如守护进程中途退出)时抛出MuxError，不再直接执行，避免非幂等的操作(命令、上传、删除等)重复执行
+    """
+    name = func.__name__
+
+    def _args(args, kwargs):
+        kwargs = dict(kwargs)
+        # 进度回调无法跨进程传递，由守护进程忽略
+        kwargs.pop('callback', None)
+        if name in MUX_LOCAL_PATHS:
+            index, key = MUX_LOCAL_PATHS[name]
+            if len(args) > index:
+                args = list(args)
+                args[index] = os.path.abspath(args[index])
+            elif key in kwargs:
+                kwargs[key] = os.path.abspath(kwargs[key])
+        return args, kwargs
+
+    if name.startswith('exec_command'):
+        @functools.wraps(func)
+        def _generator(self, *args, **kwargs):
+            if not self._mux_ready():
+                for item in func(self, *args, **kwargs):
+                    yield item
+                return
+            try:
+                for item in self._mux.call_iter(self.config, name, *_args(args, kwargs)):
+                    yield item
+            except MuxSendError as e:
+                self._mux_fallback(e)
+                for item in func(self, *args, **kwargs):
+                    yield item
+        return _generator
+
+    @functools.wraps(func)
+    def _wrapper(self, *args, **kwargs):
+        if not self._mux_ready():
+            return func(self, *args, **kwargs)
+        try:
+            return self._mux.call(self.config, name, *_args(args, kwargs))
+        except MuxSendError as e:
+            self._mux_fallback(e)
+            return func(self, *args, **kwargs)
+    return _wrapper
 
 
 class SSHTransport(AbstractTransport):
-    def __init__(self, config, logger=None):
+    def __init__(self, config, logger=None, pool=None, metadata_ttl=None, multiplexed=False):
         """
         SSH通信类
         
@@ -32,89 +130,256 @@ class SSHTransport(AbstractTransport):
                 'remotePath': sftp默认的远程目录
             }
         :param logger: 指定日志输出
+        :param pool: 连接池，None表示不使用连接池(每个实例独占一个连接)，
+            True表示使用进程内共享的默认连接池，也可以传入SSHConnectionPool实例
+        :param metadata_ttl: 远程元数据缓存(已知目录、stat结果、home)的有效期(秒)，默认None不缓存，
+            启用后通过本实例执行命令(exec_command*)时缓存全部失效，其他程序修改远程文件时依赖有效期过期
+        :param multiplexed: 复用模式，命令和SFTP操作通过本机的连接复用守护进程(SSHMuxServer)执行，
+            短时间运行的进程不需要每次都重新建立连接和认证；True使用默认的socket路径，也可以传入socket路径，
+            守护进程没有运行时自动在后台启动，不可用时退化为直接连接
         """
         self._ssh = None
         self._sftp = None
         self._home = None
+        self._pool = SSHConnectionPool.default() if pool is True else pool
+        self.metadata = RemoteMetadataCache(ttl=metadata_ttl) if metadata_ttl else None
+        self._mux = MuxClient(None if multiplexed is True else multiplexed) if multiplexed else None
+        self._check_file = None
+        # 多个线程同时使用同一个实例时(exec_command_batch等)只建立一次连接
+        self._connect_lock = threading.RLock()
         super(SSHTransport, self).__init__(config, logger)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     @property
     def ssh(self):
         if self._ssh is None:
-            self.connect()
+            with self._connect_lock:
+                if self._ssh is None:
+                    self.connect()
         return self._ssh
 
     @property
     def sftp(self):
-        if self._ssh is None:
-            self.connect()
-        if self._ssh is not None and self._sftp is None:
-            try:
-                self._sftp = paramiko.SFTPClient.from_transport(self._ssh.get_transport())
-            except Exception as e:
-                self.logger.error('sftp connect failed, {}'.format(e))
+        if self._sftp is None:
+            with self._connect_lock:
+                if self._ssh is None:
+                    self.connect()
+                if self._ssh is not None and self._sftp is None:
+                    try:
+                        self._sftp = paramiko.SFTPClient.from_transport(self._ssh.get_transport())
+                    except Exception as e:
+                        self.logger.error('sftp connect failed, {}'.format(e))
         return self._sftp
 
+    def _mux_ready(self):
+        if self._mux is None:
+            return False
+        if self._mux.connected:
+            return True
+        try:
+            json.dumps(self.config)
+        except (TypeError, ValueError):
+            self._mux_fallback('config is not serializable')
+            return False
+        if self._mux.connect(autostart=True) != 0:
+            self._mux_fallback('can not connect to {}'.format(self._mux.socket_path))
+            return False
+        return True
+
+    def _mux_fallback(self, reason):
+        self.logger.error('mux unavailable, use direct connection: {}'.format(reason))
+        if self._mux is not None:
+            self._mux.close()
+        self._mux = None
+
     @property
     def home(self):
+        if self._home is None and self._mux_ready():
+            try:
+                self._home = self._mux.call(self.config, 'home')
+            except MuxError as e:
+                self._mux_fallback(e)
+        if self._home is None and self.metadata is not None:
+            self._home = self.metadata.get('home')
+        if self._home is None:
+            try:
+                # SFTP未切换过目录时，其当前目录就是home，不需要再打开一个exec通道
+                if self.sftp is not None and self.sftp.getcwd() is None:
+                    self._home = self.sftp.normalize('.')
+            except Exception:
+                pass
         if self._home is None:
             for item in self.exec_command('pwd'):
                 if item['stdout']:
                     self._home = item['stdout'][0]
                     break
+        if self._home and self.metadata is not None:
+            self.metadata.set('home', self._home)
+            self.metadata.add_dir(self._home)
         return self._home if self._home else '/'
 
+    def _invalidate(self, path, recursive=False):
+        if self.metadata is not None:
+            self.metadata.invalidate(path, recursive=recursive)
+
+    def _exec_invalidate(self):
+        # 命令可能修改任意远程文件，无法知道具体路径，元数据缓存全部失效
+        if self.metadata is not None:
+            self.metadata.clear()
+
+    def _ensure_dir(self, path, mode=o777):
+        """
+        确保远程目录存在，已知存在的目录不产生任何往返，不存在时逐级创建
+        不使用元数据缓存时和之前一样同时把SFTP的当前目录切换到该目录(使用sftp属性和相对路径的调用方依赖这一点)，
+        使用元数据缓存时不切换当前目录
+
+        :param path: 远程目录路径
+        """
+        if self.metadata is not None and self.metadata.has_dir(path):
+            return
+        try:
+            if self.metadata is None:
+                self.sftp.chdir(path)
+                return
+            attr = self.sftp.stat(path)
+            if not stat.S_ISDIR(attr.st_mode):
+                raise IOError('{} is not a directory'.format(path))
+        except (IOError, paramiko.SFTPError):
+            try:
+                self.sftp.mkdir(path, mode=mode)
+            except IOError:
+                base_path = '/' if path.startswith('/') else ''
+                for p in path.split('/'):
+                    if not p:
+                        continue
+                    base_path = urljoin(base_path, p) if base_path else p
+                    if self.metadata is not None and self.metadata.has_dir(base_path):
+                        continue
+                    try:
+                        self.sftp.mkdir(base_path, mode=mode)
+                    except IOError:
+                        # 已存在或确实无法创建，最后再检查一次
+                        pass
+                if not stat.S_ISDIR(self.sftp.stat(path).st_mode):
+                    raise IOError('{} is not a directory'.format(path))
+        if self.metadata is not None:
+            self.metadata.add_dir(path)
+        else:
+            self.sftp.chdir(path)
+
+    @_multiplexed
+    def stat(self, path, specific_remote_path=None, use_cache=True):
+        """
+        获取远程文件属性
+
+        :param path: 文件路径
+        :param specific_remote_path: 指定远程目录, 为None使用config['remotePath']或home目录
+        :param use_cache: 是否使用元数据缓存
+        :return: 成功返回paramiko.SFTPAttributes，失败返回None
+        """
+        target_path = urljoin(self._remote_base(specific_remote_path), path)
+        if use_cache and self.metadata is not None:
+            attr = self.metadata.get_attr(target_path)
+            if attr is not None:
+                return attr
+        try:
+            attr = self.sftp.stat(target_path)
+        except Exception as e:
+            self.logger.error('stat error: {}'.format(e))
+            return None
+        if self.metadata is not None:
+            self.metadata.set_attr(target_path, attr)
+        return attr
+
+    def _create_client(self):
+        client = paramiko.SSHClient()
+        if self.config.get('load_system_host_keys', True):
+            client.load_system_host_keys()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(
+            hostname=self.config.get('hostname', self.config.get('host')),
+            port=self.config.get('port', 22),
+            username=self.config.get('username'),
+            password=self.config.get('password', None),
+            pkey=self.config.get('pkey', None),
+            key_filename=self.config.get('key_filename', None),
+            timeout=self.config.get('timeout', None),
+            allow_agent=self.config.get('allow_agent', True),
+            look_for_keys=self.config.get('look_for_keys', True),
+            compress=self.config.get('compress', False),
+            sock=self.config.get('sock', None),
+            gss_auth=self.config.get('gss_auth', False),
+            gss_kex=self.config.get('gss_kex', False),
+            gss_deleg_creds=self.config.get('gss_deleg_creds', True),
+            gss_host=self.config.get('gss_host', None),
+            banner_timeout=self.config.get('banner_timeout', None),
+            auth_timeout=self.config.get('auth_timeout', None),
+            gss_trust_dns=self.config.get('gss_trust_dns', True),
+            passphrase=self.config.get('passphrase', None),
+            # disabled_algorithms=self.config.get('disabled_algorithms', None),
+        )
+        if self.config.get('tcp_nodelay', True):
+            try:
+                # 命令和SFTP请求都是小包交互，避免Nagle算法和对端延迟ACK叠加造成每次约40ms的等待
+                client.get_transport().sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except Exception:
+                # 使用代理等非socket对象时忽略
+                pass
+        return client
+
     def connect(self):
+        if self._mux_ready():
+            try:
+                return self._mux.call(self.config, 'connect')
+            except MuxError as e:
+                self._mux_fallback(e)
+        return self._connect_direct()
+
+    def _connect_direct(self):
         try:
             self.close()
-            self._ssh = paramiko.SSHClient()
-            if self.config.get('load_system_host_keys', True):
-                self._ssh.load_system_host_keys()
-            self._ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            self._ssh.connect(
-                hostname=self.config.get('hostname', self.config.get('host')),
-                port=self.config.get('port', 22),
-                username=self.config.get('username'),
-                password=self.config.get('password', None),
-                pkey=self.config.get('pkey', None),
-                key_filename=self.config.get('key_filename', None),
-                timeout=self.config.get('timeout', None),
-                allow_agent=self.config.get('allow_agent', True),
-                look_for_keys=self.config.get('look_for_keys', True),
-                compress=self.config.get('compress', False),
-                sock=self.config.get('sock', None),
-                gss_auth=self.config.get('gss_auth', False),
-                gss_kex=self.config.get('gss_kex', False),
-                gss_deleg_creds=self.config.get('gss_deleg_creds', True),
-                gss_host=self.config.get('gss_host', None),
-                banner_timeout=self.config.get('banner_timeout', None),
-                auth_timeout=self.config.get('auth_timeout', None),
-                gss_trust_dns=self.config.get('gss_trust_dns', True),
-                passphrase=self.config.get('passphrase', None),
-                # disabled_algorithms=self.config.get('disabled_algorithms', None),
-            )
+            if self._pool is not None:
+                self._ssh = self._pool.acquire(self.config, self._create_client)
+            else:
+                self._ssh = self._create_client()
             return 0
         except Exception as e:
             self._ssh = None
             self.logger.error('SSH connect failed, {}'.format(e))
             return -1
 
-    def close(self):
+    def close(self, discard=False):
+        """
+        关闭连接，使用连接池时把连接归还给连接池
+        
+        :param discard: 使用连接池时是否丢弃该连接(连接出错时)
+        """
         try:
             if self._sftp:
                 self._sftp.close()
             if self._ssh:
-                self._ssh.close()
+                if self._pool is not None:
+                    self._pool.release(self._ssh, discard=discard)
+                else:
+                    self._ssh.close()
         except:
             pass
         finally:
             self._ssh = None
             self._sftp = None
             self._home = None
+            if self._mux is not None:
+                self._mux.close()
 
+    @_multiplexed
     def exec_command(self, cmds, **kwargs):
         """
-        生成器，执行SSH命令
+        生成器，执行SSH命令，出错时重新连接并重试(最多3次)，超时的命令不重试
         
         :param cmds: 命令或命令列表
         :param kwargs: 关键字参数
@@ -132,11 +397,8 @@ class SSHTransport(AbstractTransport):
             if not isinstance(cmd, str):
                 self.logger.error('only support string cmd, cmd={}, type={}'.format(cmd, type(cmd)))
                 continue
-            _cmds = cmd.split(';')
-            for i in range(len(_cmds)):
-                if _cmds[i].startswith('sudo'):
-                    _cmds[i] = 'echo "{}" | sudo -S {}'.format(password, _cmds[i])
-            cmd = ';'.join(_cmds)
+            cmd = self._sudo_cmd(cmd, password)
+            self._exec_invalidate()
             count = 3
             while count > 0:
                 count -= 1
@@ -151,11 +413,274 @@ class SSHTransport(AbstractTransport):
                         'stderr': err_lines
                     }
                     break
+                except socket.timeout as e:
+                    # 超时的命令可能已经执行或仍在执行，重试会重复执行并成倍增加等待时间
+                    self.logger.error('ExecCmdTimeout: cmd={}, err={}'.format(cmd, e))
+                    self.close(discard=True)
+                    break
                 except Exception as e:
                     self.logger.error('ExecCmdErr: cmd={}, err={}'.format(cmd, e))
-                    self.close()
+                    self.close(discard=True)
+            self._exec_invalidate()
+
+    @staticmethod
+    def _sudo_cmd(cmd, password):
+        _cmds = cmd.split(';')
+        for i in range(len(_cmds)):
+            if _cmds[i].startswith('sudo'):
+                _cmds[i] = 'echo "{}" | sudo -S {}'.format(password, _cmds[i])
+        return ';'.join(_cmds)
+
+    @staticmethod
+    def _split_lines(buffer, max_line):
+        """
+        从缓冲区中拆分出完整的行，超过max_line的行按max_line拆分
+
+        :return: (lines, rest)
+        """
+        lines = []
+        while True:
+            index = buffer.find(b'\n')
+            if index < 0 and len(buffer) < max_line:
+                break
+            end = index + 1 if 0 <= index < max_line else max_line
+            line, buffer = buffer[:end], buffer[end:]
+            lines.append(line.rstrip(b'\r\n').decode('utf-8', 'replace'))
+        return lines, buffer
+
+    @_multiplexed
+    def exec_command_stream(self, cmd, lines=True, chunk_size=32768, max_line=65536, window_size=None,
+                            timeout=None, get_pty=False, environment=None, password=None):
+        """
+        生成器，流式执行SSH命令，stdout和stderr在同一个循环中同时读取，边读边返回，不会因为其中一个管道写满而阻塞
+        内存占用受SSH窗口大小限制: 调用方没有消费数据时，远端会因为窗口耗尽而暂停输出
+        
+        :param cmd: 命令
+        :param lines: True按行返回(str，去掉行尾换行)，False按数据块返回(bytes)
+        :param chunk_size: 每次读取的字节数
+        :param max_line: 按行返回时单行的最大字节数，超过时拆分返回
+        :param window_size: SSH通道窗口大小(字节)，None使用paramiko默认值
+        :param timeout: 超过该时间(秒)没有收到任何数据时结束执行，None表示不超时
+        :param get_pty: 是否请求伪终端
+        :param environment: 环境变量字典
+        :param password: 执行sudo命令的密码
+        :return: (stream, data)
+            stream为'stdout'或'stderr'时data为一行或一个数据块，
+            最后返回('exit', 退出码)，执行出错或超时时退出码为-1
+        """
+        for item in self._exec_stream(cmd, lines=lines, chunk_size=chunk_size, max_line=max_line,
+                                      window_size=window_size, timeout=timeout, get_pty=get_pty,
+                                      environment=environment, password=password):
+            yield item
+
+    def _exec_stream(self, cmd, lines=True, chunk_size=32768, max_line=65536, window_size=None, timeout=None,
+                     get_pty=False, environment=None, password=None, discard=True):
+        """
+        exec_command_stream的实现
+
+        :param discard: 出错时是否关闭(丢弃)整个连接，多个通道共享连接时为False，只关闭出错的通道
+        """
+        if password is None:
+            password = self.config.get('password', None)
+        cmd = self._sudo_cmd(cmd, password)
+        channel = None
+        self._exec_invalidate()
+        try:
+            if self.ssh is None:
+                yield 'exit', -1
+                return
+            channel = self.ssh.get_transport().open_session(window_size=window_size)
+            if get_pty:
+                channel.get_pty()
+            if environment:
+                channel.update_environment(environment)
+            channel.exec_command(cmd)
+            buffers = {'stdout': b'', 'stderr': b''}
+            readers = {'stdout': channel.recv, 'stderr': channel.recv_stderr}
+            ready = {'stdout': channel.recv_ready, 'stderr': channel.recv_stderr_ready}
+            last_active = time.time()
+            while True:
+                active = False
+                for stream in ('stdout', 'stderr'):
+                    while ready[stream]():
+                        data = readers[stream](chunk_size)
+                        if not data:
+                            break
+                        active = True
+                        if not lines:
+                            yield stream, data
+                            continue
+                        items, buffers[stream] = self._split_lines(buffers[stream] + data, max_line)
+                        for line in items:
+                            yield stream, line
+                if active:
+                    last_active = time.time()
+                    continue
+                if channel.eof_received or channel.closed:
+                    if not channel.recv_ready() and not channel.recv_stderr_ready():
+                        break
+                    continue
+                if timeout is not None and time.time() - last_active > timeout:
+                    raise socket.timeout('no output for {}s'.format(timeout))
+                # stderr数据不会唤醒select，使用较短的等待时间
+                select.select([channel], [], [], 0.05)
+            for stream in ('stdout', 'stderr'):
+                if buffers[stream]:
+                    yield stream, buffers[stream].rstrip(b'\r\n').decode('utf-8', 'replace')
+            yield 'exit', channel.recv_exit_status()
+        except Exception as e:
+            self.logger.error('ExecCmdStreamErr: cmd={}, err={}'.format(cmd, e))
+            if discard and not isinstance(e, socket.timeout):
+                self.close(discard=True)
+            yield 'exit', -1
+        finally:
+            if channel is not None:
+                channel.close()
+            # 执行期间其他线程可能又缓存了命令修改前的结果
+            self._exec_invalidate()
+
+    @staticmethod
+    def _follow_cmd(path, backlog=0, offset=None):
+        # -F按文件名跟踪，文件被轮转(重建)或截断后继续读取
+        if offset is not None:
+            # 从指定的字节位置开始
+            return 'tail -F -c +{} -- {}'.format(int(offset) + 1, quote(path))
+        return 'tail -F -n {} -- {}'.format('+1' if backlog is None else int(backlog), quote(path))
+
+    def follow(self, remote_name, subdirectory=None, specific_remote_path=None, backlog=0, lines=True,
+               chunk_size=32768, max_line=65536, window_size=None, timeout=None):
+        """
+        生成器，持续返回远程文件新追加的内容(类似tail -F)，整个过程只使用一个长期打开的通道，
+        不会重复执行命令和重复传输已读取的数据，文件被轮转或截断后继续跟踪
+        同时跟踪多个主机的多个文件时使用RemoteFollower
+
+        :param remote_name: 远程文件名字
+        :param subdirectory: 远程子目录
+        :param specific_remote_path: 远程目录，为None使用config['remotePath']或home目录
+        :param backlog: 开始时先返回文件末尾已有的行数，0只返回新内容，None从文件开头返回
+        :param lines: True按行返回(str，去掉行尾换行)，False按数据块返回(bytes)
+        :param chunk_size: 每次读取的字节数
+        :param max_line: 按行返回时单行的最大字节数
+        :param window_size: SSH通道窗口大小(字节)，None使用paramiko默认值
+        :param timeout: 超过该时间(秒)没有新内容时结束，None表示一直跟踪
+        :return: 新增的行或数据块，调用方停止迭代(或close生成器)时关闭通道
+        """
+        remote_path = self._remote_base(specific_remote_path)
+        if subdirectory is not None:
+            remote_path = urljoin(remote_path, subdirectory)
+        target_path = urljoin(remote_path, remote_name)
+        if self._ssh is None and self._mux is not None:
+            # 复用模式下长期打开的通道会一直占用与守护进程的连接，使用直接连接
+            self._connect_direct()
+        cmd = self._follow_cmd(target_path, backlog)
+        stream_output = self._exec_stream(cmd, lines=lines, chunk_size=chunk_size, max_line=max_line,
+                                          window_size=window_size, timeout=timeout)
+        try:
+            for stream, data in stream_output:
+                if stream == 'stdout':
+                    yield data
+                elif stream == 'stderr':
+                    # tail报告的文件轮转、截断等信息
+                    self.logger.info('follow {}: {}'.format(
+                        target_path, data.decode('utf-8', 'replace').strip() if isinstance(data, bytes) else data))
+                elif data != 0:
+                    self.logger.error('follow {} exit: {}'.format(target_path, data))
+        finally:
+            stream_output.close()
+
+    def _follow_channel(self, path, backlog=0, window_size=None, offset=None):
+        """
+        打开一个执行tail -F的通道，供RemoteFollower使用，复用模式下需要直接连接
 
-    def upload(self, file_path, target_filename, subdirectory=None, specific_remote_path=None, callback=-1):
+        :param offset: 开始返回的字节位置，为None时通过SFTP找到文件末尾backlog行的起始位置
+        :return: (channel, offset)，失败时channel为None
+        """
+        if self._ssh is None and self._mux is not None:
+            self._connect_direct()
+        if self.ssh is None:
+            return None, offset
+        if offset is None:
+            offset = self._follow_offset(path, backlog)
+        channel = self.ssh.get_transport().open_session(window_size=window_size)
+        channel.exec_command(self._follow_cmd(path, offset=offset))
+        return channel, offset
+
+    def _follow_offset(self, path, backlog=0):
+        """
+        文件末尾backlog行的起始字节位置，backlog为None或文件不存在时为0
+        """
+        if backlog is None:
+            return 0
+        try:
+            reader = RemoteFileReader(self.sftp, path, block_size=64 * 1024, readahead=0)
+        except IOError:
+            return 0
+        with reader:
+            offset = reader.size
+            if backlog > 0:
+                for count, line in enumerate(reader.reverse_lines(), 1):
+                    offset -= len(line)
+                    if count >= backlog:
+                        break
+        return offset
+
+    @_multiplexed
+    def exec_command_batch(self, cmds, max_channels=4, **kwargs):
+        """
+        生成器，在同一个连接上同时打开多个通道并发执行相互独立的命令，按完成顺序返回
+        
+        :param cmds: 命令列表
+        :param max_channels: 同时打开的通道数上限
+        :param kwargs: 关键字参数
+            timeout: 超过该时间(秒)没有输出时结束该命令
+            get_pty: False,
+            environment: None
+            password: 执行sudo命令的密码
+        :return: {'index': 命令在cmds中的序号, 'cmd': 命令, 'stdout': [...], 'stderr': [...], 'status': 退出码(失败为-1)}
+        """
+        for item in self._exec_batch(cmds, max_channels=max_channels, **kwargs):
+            yield item
+
+    def _exec_batch(self, cmds, max_channels=4, strip=True, **kwargs):
+        """
+        exec_command_batch的实现
+
+        :param strip: 是否去掉每行首尾的空白并忽略空行，为False时保留原始的行(文件名等可能以空白开头或结尾)
+        """
+        kwargs.pop('bufsize', None)
+        if isinstance(cmds, str):
+            cmds = [cmds]
+        if self.ssh is None:
+            for index, cmd in enumerate(cmds):
+                yield {'index': index, 'cmd': cmd, 'stdout': [], 'stderr': [], 'status': -1}
+            return
+
+        def _run(index, cmd):
+            result = {'index': index, 'cmd': cmd, 'stdout': [], 'stderr': [], 'status': -1}
+            if not isinstance(cmd, str):
+                self.logger.error('only support string cmd, cmd={}, type={}'.format(cmd, type(cmd)))
+                return result
+            # 其他通道还在使用同一个连接，出错时只关闭自己的通道
+            for stream, data in self._exec_stream(cmd, discard=False, **kwargs):
+                if stream == 'exit':
+                    result['status'] = data
+                elif not strip:
+                    result[stream].append(data)
+                elif len(data.strip()):
+                    result[stream].append(data.strip())
+            return result
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_channels, len(cmds)))) as executor:
+            futures = [executor.submit(_run, index, cmd) for index, cmd in enumerate(cmds)]
+            for future in as_completed(futures):
+                yield future.result()
+        if self._ssh is not None and not self._ssh.get_transport().is_active():
+            # 所有通道结束后再丢弃已断开的连接
+            self.close(discard=True)
+
+    @_multiplexed
+    def upload(self, file_path, target_filename, subdirectory=None, specific_remote_path=None, callback=-1,
+               verify=None):
         """
         上传文件
         
@@ -164,7 +689,10 @@ class SSHTransport(AbstractTransport):
         :param subdirectory: 远程子目录
         :param specific_remote_path: 指定远程目录，为None使用config['remotePath']或home目录
         :param callback: 上传进度回调, -1使用默认的
-        :return: 
+        :param verify: 校验算法('md5'/'sha1'/'sha256'/'sha512'，True表示'sha256')，上传时同时计算本地摘要，
+            完成后在同一个连接上获取远程摘要比较，为None不校验
+        :return: 不校验时无返回值，校验时一致返回0，不一致或无法获取远程摘要返回-1
+        未启用元数据缓存时SFTP的当前目录切换到远程目录，启用时不切换
         """
         if specific_remote_path is not None:
             remote_path = specific_remote_path
@@ -174,30 +702,30 @@ class SSHTransport(AbstractTransport):
             remote_path = urljoin(remote_path, subdirectory)
         target_path = urljoin(remote_path, target_filename)
         self.logger.info('Start upload from {}'.format(file_path))
-        try:
-            self.sftp.chdir(remote_path)
-        except IOError:
-            try:
-                self.sftp.mkdir(remote_path)
-            except:
-                paths = remote_path.split('/')
-                remote_path = '/'
-                for p in paths:
-                    if p:
-                        remote_path = urljoin(remote_path, p)
-                        try:
-                            self.sftp.chdir(remote_path)
-                        except IOError:
-                            self.sftp.mkdir(remote_path)
-            self.sftp.chdir(remote_path)
+        self._ensure_dir(remote_path)
+        self._invalidate(target_path)
         if isinstance(callback, Iterable) or callback == -1:
             info = {'progress': -1}
-            self.sftp.put(file_path, target_path, callback=callback if isinstance(callback, Iterable) else functools.partial(self.upload_progressbar, info=info))
+            callback = callback if isinstance(callback, Iterable) else functools.partial(self.upload_progressbar, info=info)
+        else:
+            callback = None
+        algorithm = self._verify_algorithm(verify)
+        if algorithm is None:
+            attr = self.sftp.put(file_path, target_path, callback=callback)
         else:
-            self.sftp.put(file_path, target_path)
+            hasher = hashlib.new(algorithm)
+            with open(file_path, 'rb') as f:
+                attr = self.sftp.putfo(_HashingFile(f, hasher), target_path, file_size=os.path.getsize(file_path),
+                                       callback=callback)
+        if self.metadata is not None:
+            self.metadata.set_attr(target_path, attr)
         self.logger.info('[Success] upload to {} finish'.format(target_path))
+        if algorithm is not None:
+            return self._verify_digest(target_path, hasher.hexdigest(), algorithm)
 
-    def download(self, remote_name, file_path, subdirectory=None, specific_remote_path=None, callback=-1):
+    @_multiplexed
+    def download(self, remote_name, file_path, subdirectory=None, specific_remote_path=None, callback=-1,
+                 verify=None):
         """
         下载文件
         
@@ -206,7 +734,8 @@ class SSHTransport(AbstractTransport):
         :param subdirectory: 远程子目录
         :param specific_remote_path: 远程目录，为None使用config['remotePath']或home目录
         :param callback: 下载进度回调
-        :return: 
+        :param verify: 校验算法，同upload，写入本地文件时同时计算摘要
+        :return: 不校验时无返回值，校验时一致返回0，不一致或无法获取远程摘要返回-1
         """
         if specific_remote_path is not None:
             remote_path = specific_remote_path
@@ -218,11 +747,970 @@ class SSHTransport(AbstractTransport):
         self.logger.info('Start download from {}'.format(target_path))
         if isinstance(callback, Iterable) or callback == -1:
             info = {'progress': -1}
-            self.sftp.get(target_path, file_path, callback=callback if isinstance(callback, Iterable) else functools.partial(self.download_progressbar, info=info))
+            callback = callback if isinstance(callback, Iterable) else functools.partial(self.download_progressbar, info=info)
         else:
-            self.sftp.get(target_path, file_path)
+            callback = None
+        algorithm = self._verify_algorithm(verify)
+        if algorithm is None:
+            self.sftp.get(target_path, file_path, callback=callback)
+        else:
+            hasher = hashlib.new(algorithm)
+            with open(file_path, 'wb') as f:
+                self.sftp.getfo(target_path, _HashingFile(f, hasher), callback=callback)
         self.logger.info('[Success] download to {} finish'.format(target_path))
+        if algorithm is not None:
+            return self._verify_digest(target_path, hasher.hexdigest(), algorithm)
+
+    @staticmethod
+    def _verify_algorithm(verify):
+        if not verify:
+            return None
+        algorithm = 'sha256' if verify is True else verify
+        if algorithm not in HASH_COMMANDS:
+            raise ValueError('unsupported verify algorithm: {}'.format(algorithm))
+        return algorithm
+
+    def _verify_digest(self, remote_path, local_digest, algorithm):
+        remote_digest = self.remote_digest(remote_path, algorithm)
+        if remote_digest is None:
+            self.logger.error('[Failed] verify {}: can not get remote {}'.format(remote_path, algorithm))
+            return -1
+        if remote_digest != local_digest:
+            self.logger.error('[Failed] verify {}: {} mismatch, local={}, remote={}'.format(
+                remote_path, algorithm, local_digest, remote_digest))
+            return -1
+        self.logger.info('[Success] verify {}: {}={}'.format(remote_path, algorithm, local_digest))
+        return 0
+
+    @_multiplexed
+    def remote_digest(self, path, algorithm='sha256'):
+        """
+        获取单个远程文件的摘要，服务端支持SFTP的check-file扩展时直接通过SFTP获取，否则在远程执行摘要命令
+
+        :param path: 远程文件绝对路径
+        :param algorithm: 'md5'/'sha1'/'sha256'/'sha512'
+        :return: 十六进制摘要，失败返回None
+        """
+        if self._check_file is not False:
+            try:
+                remote_file = self.sftp.open(path, 'rb')
+            except Exception as e:
+                self.logger.error('remote digest {} error: {}'.format(path, e))
+                return None
+            try:
+                digest = binascii.hexlify(remote_file.check(algorithm)).decode('ascii')
+                self._check_file = True
+                return digest
+            except Exception:
+                # 大部分服务端(包括OpenSSH)不支持check-file，记住结果后续直接执行命令
+                if self._check_file is None:
+                    self._check_file = False
+            finally:
+                remote_file.close()
+        return self.remote_digests([path], algorithm=algorithm).get(path)
+
+    @_multiplexed
+    def verify(self, digests, algorithm='sha256'):
+        """
+        批量校验远程文件，所有文件的远程摘要通过一次批量命令获取
+
+        :param digests: {远程文件绝对路径: 本地摘要}，本地摘要通常在传输时已经计算得到，不需要重新读取本地文件
+        :param algorithm: 'md5'/'sha1'/'sha256'/'sha512'
+        :return: {'code': 全部一致返回0，否则返回-1, 'mismatched': 摘要不一致的路径, 'missing': 无法获取远程摘要的路径}
+        """
+        remote = self.remote_digests(list(digests), algorithm=algorithm) if digests else {}
+        result = {'code': 0, 'mismatched': [], 'missing': []}
+        for path, digest in sorted(digests.items()):
+            if path not in remote:
+                result['missing'].append(path)
+            elif remote[path] != digest:
+                result['mismatched'].append(path)
+        if result['mismatched'] or result['missing']:
+            result['code'] = -1
+            self.logger.error('[Failed] verify {} files: mismatched={}, missing={}'.format(
+                len(digests), result['mismatched'], result['missing']))
+        return result
+
+    def _transfer_ranges(self, size, block_size, max_channels, window_size, progress, transfer):
+        """
+        把文件按block_size分成多个区间，由多个SFTP通道并发传输
+
+        :param transfer: transfer(client, offset, length, callback)，传输单个区间
+        :return: 失败的区间数
+        """
+        ranges = deque((offset, min(block_size, size - offset)) for offset in range(0, size, block_size))
+        if not ranges:
+            return 0
+        transport = self.ssh.get_transport()
+        clients = []
+        for _ in range(max(1, min(max_channels, len(ranges)))):
+            try:
+                clients.append(paramiko.SFTPClient.from_transport(transport, window_size=window_size))
+            except Exception as e:
+                self.logger.error('sftp connect failed, {}'.format(e))
+                break
+        if not clients:
+            return len(ranges)
+        failed = []
+
+        def _run(client):
+            while True:
+                try:
+                    offset, length = ranges.popleft()
+                except IndexError:
+                    break
+                try:
+                    transfer(client, offset, length, progress())
+                except Exception as e:
+                    self.logger.error('transfer range {}-{} error: {}'.format(offset, offset + length - 1, e))
+                    failed.append(offset)
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+                list(executor.map(_run, clients))
+        finally:
+            for client in clients:
+                try:
+                    client.close()
+                except Exception:
+                    pass
+        return len(failed)
+
+    def _large_result(self, action, path, size, failed, start):
+        elapsed = time.time() - start
+        throughput = size / max(elapsed, 1e-6)
+        code = 0 if failed == 0 else -1
+        self.logger.info('[{}] {} {}: {} bytes in {:.2f}s, {:.2f} MB/s'.format(
+            'Success' if code == 0 else 'Failed', action, path, size, elapsed, throughput / 1024 / 1024))
+        return {'code': code, 'bytes': size, 'elapsed': elapsed, 'throughput': throughput}
+
+    @_multiplexed
+    def upload_large(self, file_path, target_filename, subdirectory=None, specific_remote_path=None,
+                     block_size=8 * 1024 * 1024, max_channels=4, window_size=None, callback=-1):
+        """
+        上传大文件，文件按block_size分成多个区间，由max_channels个SFTP通道并发写入远程文件的对应位置，
+        每个通道使用流水线写(不等待每次写入的确认)，高延迟链路上吞吐量不再受单个通道窗口和往返时间的限制
+
+        :param file_path: 本地文件路径
+        :param target_filename: 远程文件名
+        :param subdirectory: 远程子目录
+        :param specific_remote_path: 指定远程目录，为None使用config['remotePath']或home目录
+        :param block_size: 每个区间的字节数
+        :param max_channels: 并发的SFTP通道数
+        :param window_size: 每个SFTP通道的窗口大小，为None使用paramiko的默认值
+        :param callback: 汇总进度回调，-1使用默认的进度条，None不显示进度，也可以传入callback(transferred, total)
+        :return: {'code': 成功返回0，失败返回-1, 'bytes': 文件大小, 'elapsed': 耗时, 'throughput': 吞吐量(字节/秒)}
+        """
+        start = time.time()
+        remote_path = self._remote_base(specific_remote_path)
+        if subdirectory is not None:
+            remote_path = urljoin(remote_path, subdirectory)
+        target_path = urljoin(remote_path, target_filename)
+        size = os.path.getsize(file_path)
+        self.logger.info('Start upload from {}'.format(file_path))
+        if self.mkdir(remote_path, specific_remote_path='/') != 0:
+            return self._large_result('upload', target_path, size, 1, start)
+        self._invalidate(target_path)
+        try:
+            with self.sftp.open(target_path, 'wb'):
+                pass
+            self.sftp.truncate(target_path, size)
+        except Exception as e:
+            self.logger.error('create {} error: {}'.format(target_path, e))
+            return self._large_result('upload', target_path, size, 1, start)
+
+        def _upload_range(client, offset, length, progress):
+            with open(file_path, 'rb') as local_file:
+                remote_file = client.open(target_path, 'r+b')
+                try:
+                    remote_file.set_pipelined(True)
+                    local_file.seek(offset)
+                    remote_file.seek(offset)
+                    transferred = 0
+                    while transferred < length:
+                        data = local_file.read(min(paramiko.SFTPFile.MAX_REQUEST_SIZE, length - transferred))
+                        if not data:
+                            break
+                        remote_file.write(data)
+                        transferred += len(data)
+                        progress(transferred, length)
+                finally:
+                    # 关闭时等待所有流水线写入的确认，写入失败会在这里抛出异常
+                    remote_file.close()
+
+        progress = self._tree_progress(size, callback, 'upload')
+        failed = self._transfer_ranges(size, block_size, max_channels, window_size, progress, _upload_range)
+        if failed == 0 and self.sftp.stat(target_path).st_size != size:
+            failed = 1
+        return self._large_result('upload', target_path, size, failed, start)
+
+    @_multiplexed
+    def download_large(self, remote_name, file_path, subdirectory=None, specific_remote_path=None,
+                       block_size=8 * 1024 * 1024, max_channels=4, window_size=None, callback=-1):
+        """
+        下载大文件，文件按block_size分成多个区间，由max_channels个SFTP通道并发读取，
+        每个区间通过readv一次发出所有读请求(预读)，数据写入本地文件的对应位置
+
+        :param remote_name: 远程文件名字
+        :param file_path: 下载保存路径
+        :param subdirectory: 远程子目录
+        :param specific_remote_path: 远程目录，为None使用config['remotePath']或home目录
+        :param block_size: 每个区间的字节数
+        :param max_channels: 并发的SFTP通道数
+        :param window_size: 每个SFTP通道的窗口大小，为None使用paramiko的默认值
+        :param callback: 汇总进度回调，同upload_large
+        :return: {'code': 成功返回0，失败返回-1, 'bytes': 文件大小, 'elapsed': 耗时, 'throughput': 吞吐量(字节/秒)}
+        """
+        start = time.time()
+        remote_path = self._remote_base(specific_remote_path)
+        if subdirectory is not None:
+            remote_path = urljoin(remote_path, subdirectory)
+        target_path = urljoin(remote_path, remote_name)
+        self.logger.info('Start download from {}'.format(target_path))
+        try:
+            size = self.sftp.stat(target_path).st_size
+            with open(file_path, 'wb') as f:
+                f.truncate(size)
+        except Exception as e:
+            self.logger.error('download {} error: {}'.format(target_path, e))
+            return self._large_result('download', target_path, 0, 1, start)
+
+        def _download_range(client, offset, length, progress):
+            chunk = paramiko.SFTPFile.MAX_REQUEST_SIZE
+            chunks = [(pos, min(chunk, offset + length - pos)) for pos in range(offset, offset + length, chunk)]
+            with open(file_path, 'r+b') as local_file:
+                remote_file = client.open(target_path, 'rb')
+                try:
+                    local_file.seek(offset)
+                    transferred = 0
+                    for data in remote_file.readv(chunks):
+                        local_file.write(data)
+                        transferred += len(data)
+                        progress(transferred, length)
+                finally:
+                    remote_file.close()
+            if transferred != length:
+                raise IOError('short read {}/{}'.format(transferred, length))
+
+        progress = self._tree_progress(size, callback, 'download')
+        failed = self._transfer_ranges(size, block_size, max_channels, window_size, progress, _download_range)
+        return self._large_result('download', target_path, size, failed, start)
+
+    def open_reader(self, remote_name, subdirectory=None, specific_remote_path=None, block_size=256 * 1024,
+                    readahead=4, max_blocks=64):
+        """
+        打开远程文件用于随机读取，不需要先下载整个文件，返回的对象支持with、seek/read/readinto和按行迭代
+        读取对象使用单独的SFTP通道(关闭读取对象时关闭)，和本实例的其他SFTP操作互不影响，
+        复用模式下读取对象需要持有SFTP句柄，使用直接连接
+
+        :param remote_name: 远程文件名字
+        :param subdirectory: 远程子目录
+        :param specific_remote_path: 远程目录，为None使用config['remotePath']或home目录
+        :param block_size: 每次读取和缓存的块大小
+        :param readahead: 顺序读取时预读的块数
+        :param max_blocks: 最多缓存的块数
+        :return: RemoteFileReader，失败返回None
+        """
+        if self._ssh is None and self._mux is not None:
+            self._connect_direct()
+        remote_path = self._remote_base(specific_remote_path)
+        if subdirectory is not None:
+            remote_path = urljoin(remote_path, subdirectory)
+        target_path = urljoin(remote_path, remote_name)
+        if self.ssh is None:
+            return None
+        sftp = None
+        try:
+            sftp = paramiko.SFTPClient.from_transport(self.ssh.get_transport())
+            return RemoteFileReader(sftp, target_path, block_size=block_size, readahead=readahead,
+                                    max_blocks=max_blocks, close_sftp=True)
+        except Exception as e:
+            self.logger.error('open reader {} error: {}'.format(target_path, e))
+            if sftp is not None:
+                sftp.close()
+            return None
+
+    def _remote_base(self, specific_remote_path=None):
+        if specific_remote_path is not None:
+            return specific_remote_path
+        return self.config.get('remotePath', self.home)
+
+    def _open_sftp_clients(self, count):
+        clients = []
+        transport = self.ssh.get_transport()
+        for _ in range(count):
+            try:
+                clients.append(paramiko.SFTPClient.from_transport(transport))
+            except Exception as e:
+                self.logger.error('sftp connect failed, {}'.format(e))
+                break
+        return clients
+
+    def _tree_progress(self, total, callback, action):
+        """
+        多个文件并发传输时汇总进度
+
+        :return: 传给sftp.put/get的单个文件回调生成函数
+        """
+        lock = threading.Lock()
+        state = {'transferred': 0, 'progress': -1}
+        progressbar = self.upload_progressbar if action == 'upload' else self.download_progressbar
+
+        def _file_callback():
+            last = [0]
+
+            def _callback(transferred, _):
+                with lock:
+                    state['transferred'] += transferred - last[0]
+                    last[0] = transferred
+                    if callback == -1:
+                        if total > 0:
+                            progressbar(state['transferred'], total, info=state)
+                    elif callable(callback):
+                        callback(state['transferred'], total)
+            return _callback
+        return _file_callback
+
+    def _walk_remote(self, root):
+        """
+        遍历远程目录，每个目录一次listdir_attr
+
+        :return: (dirs, files)
+            dirs: 子目录相对路径列表(父目录在前)
+            files: {文件相对路径: SFTPAttributes}
+        """
+        dirs = []
+        files = {}
+        pending = ['']
+        while pending:
+            rel = pending.pop(0)
+            for attr in self.sftp.listdir_attr(urljoin(root, rel) if rel else root):
+                child = urljoin(rel, attr.filename) if rel else attr.filename
+                if self.metadata is not None:
+                    self.metadata.set_attr(urljoin(root, child), attr)
+                if stat.S_ISDIR(attr.st_mode):
+                    dirs.append(child)
+                    pending.append(child)
+                elif stat.S_ISREG(attr.st_mode):
+                    files[child] = attr
+        return dirs, files
+
+    def _transfer_files(self, tasks, max_workers, action, file_callback, preserve_times=False, digests=None,
+                        algorithm='sha256'):
+        clients = self._open_sftp_clients(max(1, min(max_workers, len(tasks))))
+        if not clients:
+            return [task[0] for task in tasks]
+        idle = list(clients)
+        lock = threading.Lock()
+        failed = []
+
+        def _run(task):
+            with lock:
+                client = idle.pop()
+            try:
+                if action == 'upload':
+                    self._invalidate(task[1])
+                    if digests is None:
+                        client.put(task[0], task[1], callback=file_callback())
+                    else:
+                        hasher = hashlib.new(algorithm)
+                        with open(task[0], 'rb') as f:
+                            client.putfo(_HashingFile(f, hasher), task[1], file_size=os.path.getsize(task[0]),
+                                         callback=file_callback())
+                        digests[task[1]] = hasher.hexdigest()
+                    if preserve_times:
+                        st = os.stat(task[0])
+                        client.utime(task[1], (st.st_atime, st.st_mtime))
+                elif digests is None:
+                    client.get(task[0], task[1], callback=file_callback())
+                else:
+                    hasher = hashlib.new(algorithm)
+                    with open(task[1], 'wb') as f:
+                        client.getfo(task[0], _HashingFile(f, hasher), callback=file_callback())
+                    digests[task[0]] = hasher.hexdigest()
+            except Exception as e:
+                self.logger.error('{} {} error: {}'.format(action, task[0], e))
+                failed.append(task[0])
+            finally:
+                with lock:
+                    idle.append(client)
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+                list(executor.map(_run, tasks))
+        finally:
+            for client in clients:
+                try:
+                    client.close()
+                except Exception:
+                    pass
+        return failed
+
+    @_multiplexed
+    def upload_tree(self, local_dir, remote_dir, specific_remote_path=None, max_workers=4, callback=-1, verify=None):
+        """
+        上传整个目录，先一次性创建所有远程目录，再通过多个SFTP通道并发上传文件
+        
+        :param local_dir: 本地目录
+        :param remote_dir: 远程目录，相对路径时基于specific_remote_path
+        :param specific_remote_path: 指定远程目录，为None使用config['remotePath']或home目录
+        :param max_workers: 并发上传的SFTP通道数
+        :param callback: 汇总进度回调callback(已传输字节数, 总字节数)，-1使用默认的，None不回调
+        :param verify: 校验算法，同upload，上传时计算本地摘要，全部上传后通过一次批量命令校验
+        :return: {'code': 成功返回0，有失败返回-1, 'files': 文件数, 'bytes': 总字节数, 'failed': 失败的本地文件列表, 'elapsed': 耗时}
+            校验时额外返回'mismatched': 摘要不一致或无法获取远程摘要的远程文件列表
+        """
+        start = time.time()
+        target_root = urljoin(self._remote_base(specific_remote_path), remote_dir)
+        dirs = []
+        tasks = []
+        total = 0
+        for root, dirnames, filenames in os.walk(local_dir):
+            rel = os.path.relpath(root, local_dir)
+            remote_root = target_root if rel == '.' else urljoin(target_root, *rel.split(os.sep))
+            dirs.extend(urljoin(remote_root, name) for name in sorted(dirnames))
+            for name in sorted(filenames):
+                path = os.path.join(root, name)
+                if os.path.isfile(path):
+                    tasks.append((path, urljoin(remote_root, name)))
+                    total += os.path.getsize(path)
+        self.logger.info('Start upload tree from {}, {} files, size={}'.format(local_dir, len(tasks), total))
+        if self.mkdir(target_root, specific_remote_path='/') != 0:
+            return {'code': -1, 'files': len(tasks), 'bytes': total, 'failed': [task[0] for task in tasks],
+                    'elapsed': time.time() - start}
+        for path in dirs:
+            if self.metadata is not None and self.metadata.has_dir(path):
+                continue
+            try:
+                self.sftp.mkdir(path)
+            except IOError:
+                # 目录已存在
+                pass
+            if self.metadata is not None:
+                self.metadata.add_dir(path)
+        algorithm = self._verify_algorithm(verify)
+        digests = {} if algorithm is not None else None
+        failed = self._transfer_files(tasks, max_workers, 'upload', self._tree_progress(total, callback, 'upload'),
+                                      digests=digests, algorithm=algorithm)
+        result = {'code': -1 if failed else 0, 'files': len(tasks), 'bytes': total, 'failed': failed}
+        self._verify_tree(result, digests, algorithm)
+        if result['code'] == 0:
+            self.logger.info('[Success] upload tree to {} finish'.format(target_root))
+        result['elapsed'] = time.time() - start
+        return result
+
+    @_multiplexed
+    def download_tree(self, remote_dir, local_dir, specific_remote_path=None, max_workers=4, callback=-1,
+                      verify=None):
+        """
+        下载整个目录，遍历远程目录后通过多个SFTP通道并发下载文件
+        
+        :param remote_dir: 远程目录，相对路径时基于specific_remote_path
+        :param local_dir: 本地保存目录
+        :param specific_remote_path: 指定远程目录，为None使用config['remotePath']或home目录
+        :param max_workers: 并发下载的SFTP通道数
+        :param callback: 汇总进度回调callback(已传输字节数, 总字节数)，-1使用默认的，None不回调
+        :param verify: 校验算法，同upload，写入本地文件时计算摘要，全部下载后通过一次批量命令校验
+        :return: {'code': 成功返回0，有失败返回-1, 'files': 文件数, 'bytes': 总字节数, 'failed': 失败的远程文件列表, 'elapsed': 耗时}
+            校验时额外返回'mismatched': 摘要不一致或无法获取远程摘要的远程文件列表
+        """
+        start = time.time()
+        source_root = urljoin(self._remote_base(specific_remote_path), remote_dir)
+        try:
+            dirs, files = self._walk_remote(source_root)
+            for rel in [''] + dirs:
+                local_path = os.path.join(local_dir, *rel.split('/')) if rel else local_dir
+                if not os.path.exists(local_path):
+                    os.makedirs(local_path)
+        except Exception as e:
+            self.logger.error('download tree {} error: {}'.format(source_root, e))
+            return {'code': -1, 'files': 0, 'bytes': 0, 'failed': [source_root], 'elapsed': time.time() - start}
+        tasks = [(urljoin(source_root, rel), os.path.join(local_dir, *rel.split('/'))) for rel in sorted(files)]
+        total = sum(attr.st_size for attr in files.values())
+        self.logger.info('Start download tree from {}, {} files, size={}'.format(source_root, len(tasks), total))
+        algorithm = self._verify_algorithm(verify)
+        digests = {} if algorithm is not None else None
+        failed = self._transfer_files(tasks, max_workers, 'download', self._tree_progress(total, callback, 'download'),
+                                      digests=digests, algorithm=algorithm)
+        result = {'code': -1 if failed else 0, 'files': len(tasks), 'bytes': total, 'failed': failed}
+        self._verify_tree(result, digests, algorithm)
+        if result['code'] == 0:
+            self.logger.info('[Success] download tree to {} finish'.format(local_dir))
+        result['elapsed'] = time.time() - start
+        return result
+
+    def _verify_tree(self, result, digests, algorithm):
+        if digests is None:
+            return
+        checked = self.verify(digests, algorithm) if digests else {'mismatched': [], 'missing': []}
+        result['mismatched'] = sorted(checked['mismatched'] + checked['missing'])
+        if result['mismatched']:
+            result['code'] = -1
+
+    # 在远程计算每个文件的分块摘要，每个文件输出一行json
+    _BLOCK_DIGEST_SCRIPT = '\n'.join([
+        'import sys, json, hashlib',
+        'size = int(sys.argv[1])',
+        'for path in sys.argv[2:]:',
+        '    blocks = []',
+        '    try:',
+        '        with open(path, "rb") as f:',
+        '            data = f.read(size)',
+        '            while data:',
+        '                blocks.append(hashlib.sha1(data).hexdigest())',
+        '                data = f.read(size)',
+        '    except Exception:',
+        '        blocks = None',
+        '    print(json.dumps({"path": path, "blocks": blocks}))',
+    ])
+
+    def _remote_output(self, cmd):
+        lines = []
+        status = -1
+        for stream, data in self.exec_command_stream(cmd):
+            if stream == 'stdout':
+                lines.append(data)
+            elif stream == 'exit':
+                status = data
+        return status, lines
+
+    @_multiplexed
+    def remote_digests(self, paths, max_arg_length=65536, algorithm='sha256'):
+        """
+        批量计算远程文件的摘要，路径较多时按命令长度拆分成多条命令在并发通道中执行
+
+        :param paths: 远程文件绝对路径列表
+        :param max_arg_length: 单条命令的最大长度
+        :param algorithm: 'md5'/'sha1'/'sha256'/'sha512'
+        :return: {path: 摘要}，计算失败的文件不在结果中
+        """
+        cmds = self._split_cmds(HASH_COMMANDS[algorithm] + ' --', paths, max_arg_length)
+        digests = {}
+        for item in self._exec_batch(cmds, max_channels=4, strip=False):
+            for line in item['stdout']:
+                parsed = self._parse_digest_line(line)
+                if parsed is not None:
+                    digests[parsed[0]] = parsed[1]
+        return digests
+
+    @staticmethod
+    def _parse_digest_line(line):
+        """
+        解析md5sum/sha256sum等命令的输出行，格式为'摘要  文件名'或'摘要 *文件名'(二进制模式)，
+        文件名含有反斜杠或换行符时GNU coreutils在行首加反斜杠，并把文件名中的反斜杠、换行符(较新的版本还有回车符)
+        转义为'\\\\'、'\\n'('\\r')
 
+        :return: (文件名, 摘要)，无法解析返回None
+        """
+        escaped = line.startswith('\\')
+        if escaped:
+            line = line[1:]
+        parts = line.split(' ', 1)
+        if len(parts) != 2 or len(parts[1]) < 2 or parts[1][0] not in ' *':
+            return None
+        name = parts[1][1:]
+        if escaped:
+            name = re.sub(r'\\(.)', lambda match: {'\\': '\\', 'n': '\n', 'r': '\r'}.get(
+                match.group(1), match.group(0)), name)
+        return name, parts[0]
+
+    @staticmethod
+    def _split_cmds(command, paths, max_arg_length):
+        """
+        把路径参数追加到命令后面，按命令长度拆分成多条命令，避免超过远程的参数长度限制
+
+        :return: 命令列表
+        """
+        cmds = []
+        args = []
+        length = len(command)
+        for path in paths:
+            arg = quote(path)
+            if args and length + len(arg) + 1 > max_arg_length:
+                cmds.append(' '.join([command] + args))
+                args = []
+                length = len(command)
+            args.append(arg)
+            length += len(arg) + 1
+        if args:
+            cmds.append(' '.join([command] + args))
+        return cmds
+
+    def _remote_block_digests(self, paths, block_size, max_arg_length=65536):
+        command = 'PY=$(command -v python3 || command -v python) && "$PY" -c {} {}'.format(
+            quote(self._BLOCK_DIGEST_SCRIPT), int(block_size))
+        result = {}
+        for item in self.exec_command_batch(self._split_cmds(command, paths, max_arg_length), max_channels=4):
+            for line in item['stdout']:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('blocks') is not None:
+                    result[entry['path']] = entry['blocks']
+        return result
+
+    @staticmethod
+    def _local_digest(path, block_size=1024 * 1024):
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            data = f.read(block_size)
+            while data:
+                sha256.update(data)
+                data = f.read(block_size)
+        return sha256.hexdigest()
+
+    def _upload_delta(self, local_path, remote_path, remote_blocks, block_size):
+        """
+        只上传和远程文件不同的数据块
+        先在远程复制一份临时文件(不经过网络)，在临时文件上写入变化的块，完成后原子替换远程文件，
+        中途失败或被中断时远程文件保持原样，读取方也不会看到写了一半的文件
+
+        :return: 上传的字节数
+        """
+        sent = 0
+        size = os.path.getsize(local_path)
+        temp_path = '{}.{}.sync'.format(remote_path, binascii.hexlify(os.urandom(4)).decode('ascii'))
+        status, _ = self._remote_output('cp -p -- {} {}'.format(quote(remote_path), quote(temp_path)))
+        if status != 0:
+            raise IOError('copy {} failed, status={}'.format(remote_path, status))
+        self._invalidate(remote_path)
+        try:
+            with open(local_path, 'rb') as local_file:
+                remote_file = self.sftp.open(temp_path, 'r+b')
+                try:
+                    remote_file.set_pipelined(True)
+                    index = 0
+                    data = local_file.read(block_size)
+                    while data:
+                        if index >= len(remote_blocks) or hashlib.sha1(data).hexdigest() != remote_blocks[index]:
+                            remote_file.seek(index * block_size)
+                            remote_file.write(data)
+                            sent += len(data)
+                        index += 1
+                        data = local_file.read(block_size)
+                finally:
+                    remote_file.close()
+            self.sftp.truncate(temp_path, size)
+            st = os.stat(local_path)
+            self.sftp.utime(temp_path, (st.st_atime, st.st_mtime))
+            self.sftp.posix_rename(temp_path, remote_path)
+        except Exception:
+            try:
+                self.sftp.remove(temp_path)
+            except Exception:
+                pass
+            raise
+        return sent
+
+    @_multiplexed
+    def sync(self, local_dir, remote_dir, specific_remote_path=None, delete=False, block_size=1024 * 1024,
+             delta_threshold=8 * 1024 * 1024, max_workers=4, callback=-1):
+        """
+        增量同步本地目录到远程目录
+        1. 大小和修改时间都相同的文件直接跳过
+        2. 大小相同但修改时间不同的文件，通过一次批量的远程sha256sum和本地摘要比较，相同则只同步修改时间
+        3. 远程已存在且不小于delta_threshold的变化文件，在远程计算分块摘要(需要远程有python)，只上传不同的数据块，
+           写入远程复制的临时文件后原子替换
+        4. 其余新增或变化的文件通过多个SFTP通道并发完整上传，上传后同步修改时间
+        
+        :param local_dir: 本地目录
+        :param remote_dir: 远程目录，相对路径时基于specific_remote_path
+        :param specific_remote_path: 指定远程目录，为None使用config['remotePath']或home目录
+        :param delete: 是否删除本地已不存在的远程文件和目录
+        :param block_size: 分块比较的块大小
+        :param delta_threshold: 分块上传的文件大小下限
+        :param max_workers: 完整上传时并发的SFTP通道数
+        :param callback: 完整上传的汇总进度回调，同upload_tree
+        :return: {
+            'code': 成功返回0，有失败返回-1,
+            'uploaded': 完整上传的文件, 'delta': 分块上传的文件, 'skipped': 跳过的文件数, 'deleted': 删除的远程路径,
+            'failed': 失败的文件, 'bytes': 实际上传的字节数, 'elapsed': 耗时
+        }
+        """
+        start = time.time()
+        target_root = urljoin(self._remote_base(specific_remote_path), remote_dir)
+        result = {'code': 0, 'uploaded': [], 'delta': [], 'skipped': 0, 'deleted': [], 'failed': [], 'bytes': 0}
+        local_dirs = []
+        local_files = {}
+        for root, dirnames, filenames in os.walk(local_dir):
+            rel = os.path.relpath(root, local_dir)
+            rel = '' if rel == '.' else '/'.join(rel.split(os.sep))
+            local_dirs.extend(urljoin(rel, name) if rel else name for name in sorted(dirnames))
+            for name in filenames:
+                path = os.path.join(root, name)
+                if os.path.isfile(path):
+                    local_files[urljoin(rel, name) if rel else name] = path
+        if self.mkdir(target_root, specific_remote_path='/') != 0:
+            result['code'] = -1
+            result['failed'] = sorted(local_files)
+            result['elapsed'] = time.time() - start
+            return result
+        try:
+            remote_dirs, remote_files = self._walk_remote(target_root)
+        except Exception as e:
+            self.logger.error('sync list {} error: {}'.format(target_root, e))
+            remote_dirs, remote_files = [], {}
+        for rel in local_dirs:
+            if rel not in remote_dirs:
+                try:
+                    self.sftp.mkdir(urljoin(target_root, rel))
+                except IOError:
+                    pass
+                if self.metadata is not None:
+                    self.metadata.add_dir(urljoin(target_root, rel))
+
+        changed = []
+        same_size = []
+        for rel, path in sorted(local_files.items()):
+            attr = remote_files.get(rel)
+            st = os.stat(path)
+            if attr is None:
+                changed.append(rel)
+            elif attr.st_size != st.st_size:
+                changed.append(rel)
+            elif int(attr.st_mtime) == int(st.st_mtime):
+                result['skipped'] += 1
+            else:
+                same_size.append(rel)
+        if same_size:
+            digests = self.remote_digests([urljoin(target_root, rel) for rel in same_size])
+            for rel in same_size:
+                path = local_files[rel]
+                remote_path = urljoin(target_root, rel)
+                if digests.get(remote_path) == self._local_digest(path):
+                    st = os.stat(path)
+                    self._invalidate(remote_path)
+                    try:
+                        self.sftp.utime(remote_path, (st.st_atime, st.st_mtime))
+                    except Exception as e:
+                        self.logger.error('sync utime {} error: {}'.format(remote_path, e))
+                    result['skipped'] += 1
+                else:
+                    changed.append(rel)
+
+        delta = [rel for rel in changed if rel in remote_files and os.path.getsize(local_files[rel]) >= delta_threshold]
+        blocks = self._remote_block_digests([urljoin(target_root, rel) for rel in delta], block_size)
+        full = [rel for rel in changed if urljoin(target_root, rel) not in blocks]
+        for rel in delta:
+            remote_path = urljoin(target_root, rel)
+            if remote_path not in blocks:
+                continue
+            try:
+                result['bytes'] += self._upload_delta(local_files[rel], remote_path, blocks[remote_path], block_size)
+                result['delta'].append(rel)
+            except Exception as e:
+                self.logger.error('sync delta {} error: {}'.format(rel, e))
+                full.append(rel)
+
+        tasks = [(local_files[rel], urljoin(target_root, rel)) for rel in full]
+        total = sum(os.path.getsize(task[0]) for task in tasks)
+        failed = self._transfer_files(tasks, max_workers, 'upload', self._tree_progress(total, callback, 'upload'),
+                                      preserve_times=True) if tasks else []
+        failed = set(failed)
+        for rel in full:
+            if local_files[rel] in failed:
+                result['failed'].append(rel)
+            else:
+                result['uploaded'].append(rel)
+                result['bytes'] += os.path.getsize(local_files[rel])
+
+        if delete:
+            for rel in sorted(set(remote_files) - set(local_files)):
+                if self.remove(urljoin(target_root, rel), specific_remote_path='/') == 0:
+                    result['deleted'].append(rel)
+            for rel in sorted(set(remote_dirs) - set(local_dirs), key=lambda item: -item.count('/')):
+                if self.rmdir(urljoin(target_root, rel), specific_remote_path='/') == 0:
+                    result['deleted'].append(rel)
+        if result['failed']:
+            result['code'] = -1
+        result['elapsed'] = time.time() - start
+        self.logger.info('[{}] sync {} -> {}: uploaded={}, delta={}, skipped={}, deleted={}, bytes={}'.format(
+            'Success' if result['code'] == 0 else 'Failed', local_dir, target_root, len(result['uploaded']),
+            len(result['delta']), result['skipped'], len(result['deleted']), result['bytes']))
+        return result
+
+    def _archive_channel(self, cmd, window_size):
+        """
+        打开执行tar的通道，后台线程同时读取stderr，tar输出大量警告时不会因为stderr窗口耗尽而阻塞数据的传输
+
+        :return: (channel, stderr)，stderr传给_archive_finish
+        """
+        channel = self.ssh.get_transport().open_session(window_size=window_size)
+        channel.exec_command(cmd)
+        output = []
+
+        def _drain():
+            try:
+                data = channel.recv_stderr(32768)
+                while data:
+                    output.append(data)
+                    data = channel.recv_stderr(32768)
+            except Exception:
+                pass
+        reader = threading.Thread(target=_drain)
+        reader.daemon = True
+        reader.start()
+        return channel, (reader, output)
+
+    @staticmethod
+    def _archive_finish(channel, stderr):
+        """
+        等待远程命令结束
+
+        :return: (退出码, stderr的内容)
+        """
+        reader, output = stderr
+        try:
+            status = channel.recv_exit_status()
+            reader.join(1)
+            return status, b''.join(output).decode('utf-8', 'replace').strip()
+        finally:
+            channel.close()
+
+    @_multiplexed
+    def upload_archive(self, local_dir, remote_dir, specific_remote_path=None, compress='gz', level=6,
+                       window_size=None, chunk_size=256 * 1024):
+        """
+        以tar流的方式批量上传目录，适合大量小文件
+        后台线程边打包边压缩，数据通过exec通道直接写入远程的tar -x，两端都不产生临时文件
+        远程需要有tar，压缩时还需要tar支持对应的解压参数(-z/-j/-J)
+
+        :param local_dir: 本地目录
+        :param remote_dir: 远程目录，相对路径时基于specific_remote_path
+        :param specific_remote_path: 指定远程目录，为None使用config['remotePath']或home目录
+        :param compress: 压缩方式，None/'gz'/'bz2'/'xz'，网络较快时压缩可能反而更慢
+        :param level: 压缩级别
+        :param window_size: exec通道窗口大小，None使用paramiko默认值
+        :param chunk_size: 每次发送的字节数
+        :return: {'code': 成功返回0，失败返回-1, 'files': 文件数, 'bytes': 文件总字节数, 'sent': 实际发送的字节数, 'elapsed': 耗时}
+        """
+        start = time.time()
+        target_root = urljoin(self._remote_base(specific_remote_path), remote_dir)
+        result = {'code': -1, 'files': 0, 'bytes': 0, 'sent': 0}
+        if compress not in COMPRESSORS:
+            self.logger.error('unsupported compress: {}'.format(compress))
+            result['elapsed'] = time.time() - start
+            return result
+        if not os.path.isdir(local_dir):
+            self.logger.error('upload archive error: {} is not a directory'.format(local_dir))
+            result['elapsed'] = time.time() - start
+            return result
+        self.logger.info('Start upload archive from {}'.format(local_dir))
+        if self.mkdir(target_root, specific_remote_path='/') != 0:
+            result['elapsed'] = time.time() - start
+            return result
+        self._invalidate(target_root, recursive=True)
+        error = None
+        try:
+            writer = ArchiveWriter(compress, level, chunk_size=chunk_size)
+            channel, stderr = self._archive_channel(
+                'tar -x{}f - -C {}'.format(COMPRESSORS[compress][0], quote(target_root)), window_size)
+        except Exception as e:
+            self.logger.error('upload archive error: {}'.format(e))
+            result['elapsed'] = time.time() - start
+            return result
+        packed = {}
+        packer = threading.Thread(target=lambda: packed.update(pack_dir(local_dir, writer)))
+        packer.daemon = True
+        packer.start()
+        try:
+            while True:
+                data = writer.queue.get()
+                if data is None:
+                    break
+                if isinstance(data, Exception):
+                    error = data
+                    break
+                channel.sendall(data)
+                result['sent'] += len(data)
+        except Exception as e:
+            error = e
+        finally:
+            writer.stopped.set()
+            packer.join()
+        try:
+            channel.shutdown_write()
+            status, err = self._archive_finish(channel, stderr)
+        except Exception as e:
+            status, err = -1, str(e)
+        result.update(packed)
+        result['elapsed'] = time.time() - start
+        if error is not None or status != 0:
+            self.logger.error('[Failed] upload archive to {}, status={}, error={}, stderr={}'.format(
+                target_root, status, error, err))
+            return result
+        result['code'] = 0
+        self.logger.info('[Success] upload archive to {}: files={}, bytes={}, sent={}, {:.2f}s'.format(
+            target_root, result['files'], result['bytes'], result['sent'], result['elapsed']))
+        return result
+
+    @_multiplexed
+    def download_archive(self, remote_dir, local_dir, specific_remote_path=None, compress='gz', level=6,
+                         window_size=None):
+        """
+        以tar流的方式批量下载目录，适合大量小文件
+        远程tar -c(经过压缩命令)的输出通过exec通道边接收边解包到本地目录，两端都不产生临时文件
+
+        :param remote_dir: 远程目录，相对路径时基于specific_remote_path
+        :param local_dir: 本地目录
+        :param specific_remote_path: 指定远程目录，为None使用config['remotePath']或home目录
+        :param compress: 压缩方式，None/'gz'/'bz2'/'xz'，远程需要有对应的gzip/bzip2/xz命令
+        :param level: 压缩级别
+        :param window_size: exec通道窗口大小，None使用paramiko默认值
+        :return: {'code': 成功返回0，失败返回-1, 'files': 文件数, 'bytes': 文件总字节数, 'received': 实际接收的字节数, 'elapsed': 耗时}
+        """
+        start = time.time()
+        source_root = urljoin(self._remote_base(specific_remote_path), remote_dir)
+        result = {'code': -1, 'files': 0, 'bytes': 0, 'received': 0}
+        if compress not in COMPRESSORS:
+            self.logger.error('unsupported compress: {}'.format(compress))
+            result['elapsed'] = time.time() - start
+            return result
+        self.logger.info('Start download archive from {}'.format(source_root))
+        cmd = 'tar -cf - -C {} .'.format(quote(source_root))
+        if compress is not None:
+            cmd += ' | {} -c -{}'.format(COMPRESSORS[compress][1], level)
+        error = None
+        status, err = -1, ''
+        try:
+            if not os.path.exists(local_dir):
+                os.makedirs(local_dir)
+            channel, stderr = self._archive_channel(cmd, window_size)
+        except Exception as e:
+            self.logger.error('download archive error: {}'.format(e))
+            result['elapsed'] = time.time() - start
+            return result
+        stdout = channel.makefile('rb')
+        read = stdout.read
+
+        def _counting_read(size=-1):
+            data = read(size)
+            result['received'] += len(data)
+            return data
+
+        stdout.read = _counting_read
+        try:
+            result.update(extract_stream(stdout, local_dir, compress))
+        except Exception as e:
+            error = e
+            # 不再读取stdout，远程命令会阻塞在写入上，关闭通道使其结束
+            channel.close()
+        try:
+            status, err = self._archive_finish(channel, stderr)
+        except Exception as e:
+            error = error or e
+        result['elapsed'] = time.time() - start
+        if error is not None or status != 0:
+            self.logger.error('[Failed] download archive from {}, status={}, error={}, stderr={}'.format(
+                source_root, status, error, err))
+            return result
+        result['code'] = 0
+        self.logger.info('[Success] download archive to {}: files={}, bytes={}, received={}, {:.2f}s'.format(
+            local_dir, result['files'], result['bytes'], result['received'], result['elapsed']))
+        return result
+
+    @_multiplexed
     def mkdir(self, path, mode=o777, specific_remote_path=None):
         """
         创建目录
@@ -230,7 +1718,7 @@ class SSHTransport(AbstractTransport):
         :param path: 目录路径
         :param mode: 权限
         :param specific_remote_path: 指定远程目录, 为None使用config['remotePath']或home目录
-        :return: 成功返回0
+        :return: 成功返回0，未启用元数据缓存时SFTP的当前目录切换到该目录，启用时不切换
         """
         if specific_remote_path is not None:
             remote_path = specific_remote_path
@@ -238,30 +1726,13 @@ class SSHTransport(AbstractTransport):
             remote_path = self.config.get('remotePath', self.home)
         target_path = urljoin(remote_path, path)
         try:
-            self.sftp.chdir(target_path)
-        except IOError:
-            try:
-                self.sftp.mkdir(target_path, mode=mode)
-            except:
-                base_path = '/'
-                for p in target_path.split('/'):
-                    if p:
-                        base_path = urljoin(base_path, p)
-                        try:
-                            self.sftp.chdir(base_path)
-                        except IOError:
-                            try:
-                                self.sftp.mkdir(base_path, mode=mode)
-                            except Exception as e:
-                                self.logger.error('mkdir {} error: {}'.format(base_path, e))
-                                return -1
-        try:
-            self.sftp.chdir(target_path)
+            self._ensure_dir(target_path, mode=mode)
             return 0
         except Exception as e:
-            self.logger.error('mkdir->chdir {} error {}'.format(target_path, e))
+            self.logger.error('mkdir {} error: {}'.format(target_path, e))
             return -1
 
+    @_multiplexed
     def chdir(self, path, specific_remote_path=None):
         """
         切换目录
@@ -282,6 +1753,7 @@ class SSHTransport(AbstractTransport):
             self.logger.error('chdir error: {}'.format(e))
             return -1
 
+    @_multiplexed
     def listdir(self, path, specific_remote_path=None):
         """
         遍历目录
@@ -301,6 +1773,7 @@ class SSHTransport(AbstractTransport):
             self.logger.error('listdir error: {}'.format(e))
             return None
 
+    @_multiplexed
     def rmdir(self, path, specific_remote_path=None):
         """
         删除目录
@@ -315,12 +1788,14 @@ class SSHTransport(AbstractTransport):
             else:
                 remote_path = self.config.get('remotePath', self.home)
             target_path = urljoin(remote_path, path)
+            self._invalidate(target_path, recursive=True)
             self.sftp.rmdir(target_path)
             return 0
         except Exception as e:
             self.logger.error('rmdir error: {}'.format(e))
             return -1
 
+    @_multiplexed
     def remove(self, path, specific_remote_path=None):
         """
         删除文件
@@ -335,13 +1810,14 @@ class SSHTransport(AbstractTransport):
             else:
                 remote_path = self.config.get('remotePath', self.home)
             target_path = urljoin(remote_path, path)
-
+            self._invalidate(target_path)
             self.sftp.remove(target_path)
             return 0
         except Exception as e:
             self.logger.error('remove error: {}'.format(e))
             return -1
 
+    @_multiplexed
     def rename(self, oldpath, newpath):
         """
         重命名
@@ -351,12 +1827,15 @@ class SSHTransport(AbstractTransport):
         :return: 成功返回0
         """
         try:
+            self._invalidate(oldpath, recursive=True)
+            self._invalidate(newpath, recursive=True)
             self.sftp.rename(oldpath, newpath)
             return 0
         except Exception as e:
             self.logger.error('rename error: {}'.format(e))
             return -1
 
+    @_multiplexed
     def chmod(self, path, mode=o777, specific_remote_path=None):
         """
         设置权限
@@ -372,13 +1851,14 @@ class SSHTransport(AbstractTransport):
             else:
                 remote_path = self.config.get('remotePath', self.home)
             target_path = urljoin(remote_path, path)
-
+            self._invalidate(target_path)
             self.sftp.chmod(target_path, mode)
             return 0
         except Exception as e:
             self.logger.error('chmod error: {}'.format(e))
             return -1
 
+    @_multiplexed
     def chown(self, path, uid, gid, specific_remote_path=None):
         """
         更改所属用户和组
@@ -395,7 +1875,7 @@ class SSHTransport(AbstractTransport):
             else:
                 remote_path = self.config.get('remotePath', self.home)
             target_path = urljoin(remote_path, path)
-
+            self._invalidate(target_path)
             self.sftp.chown(target_path, uid, gid)
             return 0
         except Exception as e: